@@ -0,0 +1,238 @@
+import json
+import math
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime
+import numpy as np
+from pytz import timezone
+from pymongo import UpdateOne
+
+import repository
+from config import ALERT_RULES_FILE
+from notifications import send_line_summary
+
+tz = timezone("Asia/Bangkok")
+
+ALERT_STATE_COLLECTION = "alert_state"
+
+@dataclass
+class AlertRule:
+    """
+    Threshold rule with a hysteresis band
+
+    The alert fires once the value has been past `threshold` for
+    `min_duration` seconds and clears only when it comes back past
+    `clear_threshold`, so a sensor hovering at the boundary does not flap.
+    """
+    name: str
+    key: str
+    direction: str  # "above" or "below"
+    threshold: float
+    clear_threshold: float
+    message: str
+    clear_message: str = ""
+    min_duration: float = 0.0
+    cooldown: float = 1800.0
+
+DEFAULT_RULES = [
+    AlertRule("too_cold", "temperature", "below", 20, 21,
+              "⚠️ Too cold! Current temperature is {value}°C 🥶",
+              "✅ Temperature is back to {value}°C.", min_duration=120),
+    AlertRule("too_hot", "temperature", "above", 35, 34,
+              "⚠️ Too hot! Current temperature is {value}°C 🥵",
+              "✅ Temperature is back to {value}°C.", min_duration=120),
+    AlertRule("low_light", "lightIntensity_val", "below", 300, 350,
+              "⚠️ Low light in the room! Current brightness level is {value} lux 💡",
+              "✅ Light is back to {value} lux.", min_duration=300),
+    AlertRule("poor_air", "airQuality_val", "above", 1536, 1400,
+              "⚠️ Poor air quality detected! Current air quality index is {value} 😷",
+              "✅ Air quality is back to {value}.", min_duration=60),
+]
+
+def load_rules(path=ALERT_RULES_FILE):
+    """
+    :param path: JSON file holding a list of rule objects, or None for the defaults
+    :return: List of AlertRule
+    """
+    if not path:
+        return list(DEFAULT_RULES)
+    with open(path) as rules_file:
+        return [AlertRule(**rule) for rule in json.load(rules_file)]
+
+class CompiledRules:
+    """
+    Rules flattened into arrays so a batch of readings is evaluated in one pass
+
+    Values are multiplied by +1 ("above") or -1 ("below") so every rule
+    becomes "fire when value > threshold, clear when value <= clear".
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.keys = sorted({rule.key for rule in rules})
+        self.key_index = np.array([self.keys.index(rule.key) for rule in rules], dtype=int)
+        self.sign = np.array([1.0 if rule.direction == "above" else -1.0 for rule in rules])
+        self.threshold = np.array([rule.threshold for rule in rules], dtype=float) * self.sign
+        self.clear_threshold = np.array([rule.clear_threshold for rule in rules], dtype=float) * self.sign
+        self.min_duration = np.array([rule.min_duration for rule in rules], dtype=float)
+        self.cooldown = np.array([rule.cooldown for rule in rules], dtype=float)
+
+    def values_matrix(self, readings):
+        """
+        :param readings: List of sensor reading dictionaries
+        :return: (n_readings, n_rules) array of signed values, NaN where missing
+        """
+        raw = np.array([
+            [reading.get(key) if isinstance(reading.get(key), (int, float)) else np.nan for key in self.keys]
+            for reading in readings
+        ], dtype=float).reshape(len(readings), len(self.keys))
+        return raw[:, self.key_index] * self.sign
+
+class AlertEngine:
+    """
+    Evaluates ingested readings against the compiled rules
+
+    Alert state (active, pending since, last notified) lives in arrays
+    mirrored to the alert_state collection, and a push is sent only when
+    a rule changes state.
+    """
+    def __init__(self, rules):
+        self.compiled = CompiledRules(rules)
+        size = len(rules)
+        self.active = np.zeros(size, dtype=bool)
+        self.pending_since = np.full(size, np.nan)
+        self.last_notified = np.full(size, -np.inf)
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def load_state(self):
+        """
+        Restore the alert state persisted by a previous process
+        """
+        names = [rule.name for rule in self.compiled.rules]
+        for document in repository.db[ALERT_STATE_COLLECTION].find({"_id": {"$in": names}}):
+            index = names.index(document["_id"])
+            self.active[index] = document.get("active", False)
+            pending = document.get("pending_since")
+            self.pending_since[index] = np.nan if pending is None else pending
+            last_notified = document.get("last_notified")
+            self.last_notified[index] = -np.inf if last_notified is None else last_notified
+        self.loaded = True
+
+    def save_state(self, indexes, last_values):
+        """
+        Persist the state of the given rules
+
+        :param indexes: Indexes of rules whose state changed
+        :param last_values: Last raw value seen per rule
+        """
+        if not len(indexes):
+            return
+        now = datetime.now(tz)
+        repository.db[ALERT_STATE_COLLECTION].bulk_write([
+            UpdateOne({"_id": self.compiled.rules[i].name}, {"$set": {
+                "active": bool(self.active[i]),
+                "pending_since": None if math.isnan(self.pending_since[i]) else float(self.pending_since[i]),
+                "last_notified": None if math.isinf(self.last_notified[i]) else float(self.last_notified[i]),
+                "last_value": None if math.isnan(last_values[i]) else float(last_values[i]),
+                "updated_at": now
+            }}, upsert=True)
+            for i in indexes
+        ], ordered=False)
+
+    def evaluate(self, readings):
+        """
+        Advance the alert state machines over a batch of readings
+
+        :param readings: List of sensor reading dictionaries, oldest first
+        :return: List of notification texts for state changes
+        """
+        compiled = self.compiled
+        values = compiled.values_matrix(readings)
+        times = np.array([reading_epoch(reading) for reading in readings])
+
+        # Whole-batch comparisons; NaN (missing key) is neither a breach nor a clear
+        breach = values > compiled.threshold
+        clear = values <= compiled.clear_threshold
+
+        before = (self.active.copy(), self.pending_since.copy())
+        notifications = []
+
+        for row, moment in enumerate(times):
+            starting = breach[row] & ~self.active & np.isnan(self.pending_since)
+            self.pending_since = np.where(starting, moment, self.pending_since)
+            # The condition went away before lasting min_duration
+            self.pending_since = np.where(~breach[row] & ~self.active, np.nan, self.pending_since)
+
+            due = ~self.active & breach[row] & (moment - self.pending_since >= compiled.min_duration)
+            # Inside the cooldown the rule stays pending instead of going active
+            # silently: it fires once the cooldown is over if the breach lasts,
+            # and no clear message follows an alert that was never sent
+            fire = due & (moment - self.last_notified >= compiled.cooldown)
+            resolve = self.active & clear[row]
+            self.active = (self.active | fire) & ~resolve
+            self.pending_since = np.where(fire | resolve, np.nan, self.pending_since)
+            self.last_notified = np.where(fire, moment, self.last_notified)
+
+            for index in np.flatnonzero(fire | resolve):
+                rule = compiled.rules[index]
+                value = values[row, index] * compiled.sign[index]
+                template = rule.message if fire[index] else rule.clear_message
+                if template:
+                    notifications.append(template.format(value=round(float(value), 1)))
+
+        changed = np.flatnonzero(
+            (self.active != before[0]) |
+            ~((self.pending_since == before[1]) | (np.isnan(self.pending_since) & np.isnan(before[1])))
+        )
+        last_values = values[-1] * compiled.sign
+        self.save_state(changed, last_values)
+        return notifications
+
+def reading_epoch(reading):
+    """
+    :param reading: Sensor reading with an ISO 'timestamp'
+    :return: Seconds since the epoch
+    """
+    timestamp = reading.get('timestamp')
+    return datetime.fromisoformat(timestamp).timestamp() if timestamp else datetime.now(tz).timestamp()
+
+alert_engine = AlertEngine(load_rules())
+
+def evaluate_readings(readings):
+    """
+    Evaluate a batch of readings (e.g. when catching up) and push state changes
+
+    :param readings: List of sensor reading dictionaries, oldest first
+    :return: List of notification texts that were queued
+    """
+    if not readings:
+        return []
+
+    with alert_engine.lock:
+        if not alert_engine.loaded:
+            alert_engine.load_state()
+        notifications = alert_engine.evaluate(readings)
+
+    if notifications:
+        notification_message = "🌿 **Real-Time Environment Alerts:**\n" + "\n".join(notifications)
+        send_line_summary(notification_message)
+        print("Queued real-time environment notifications:", notification_message)
+    return notifications
+
+def evaluate_reading(sensor_data, sensor_id):
+    """
+    Ingestion consumer evaluating one reading
+
+    :param sensor_data: Dictionary of sensor values
+    :param sensor_id: ID of the reading
+    """
+    try:
+        evaluate_readings([sensor_data])
+    except Exception as e:
+        print(f"Error evaluating alert rules: {e}")
+
+def rules_as_json():
+    """
+    :return: The active rules as JSON, handy as a starting point for ALERT_RULES_FILE
+    """
+    return json.dumps([asdict(rule) for rule in alert_engine.compiled.rules], ensure_ascii=False, indent=2)
@@ -0,0 +1,252 @@
+"""
+Replay benchmark for the sensor ingestion path
+
+Feeds synthetic (or recorded) Firebase sensorData payloads through the same
+code the app runs: single-feed readings go through the ingestion dispatcher
+and its consumers (daily aggregates, history rollups, alert rules), fleet
+readings (with a device_id) through the poll path's store_fleet_readings,
+one bulk write per poll. Reports readings per second, MongoDB round trips per
+reading and whether the stored daily min/avg/max match a NumPy reference.
+
+Point MONGODB_URI at a disposable local MongoDB (e.g. `docker run -p
+27017:27017 mongo`); the benchmark drops and recreates its own database.
+
+    python bench_ingestion.py --devices 20 --interval 5 --duration 3600
+    python bench_ingestion.py --replay recorded.ndjson --rate 200
+    python bench_ingestion.py --batch-size 50 --output new.json --compare old.json
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bench_support import command_counter, save_results, compare_results
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def synthetic_readings(devices, interval, duration, start):
+    """
+    Generate readings for every device, interleaved in time order
+
+    :param devices: Number of devices (1 means the original single feed)
+    :param interval: Seconds between two readings of a device
+    :param duration: Seconds of simulated time
+    :param start: Aware datetime of the first reading
+    :return: List of sensorData payloads
+    """
+    readings = []
+    steps = int(duration // interval)
+    for step in range(steps):
+        moment = start + timedelta(seconds=step * interval)
+        for device in range(devices):
+            reading = {
+                "id": f"bench-{device}-{step}",
+                "timestamp": moment.isoformat(),
+                # Daily cycle plus noise, so some alert rules trip and clear
+                "temperature": round(26 + 6 * np.sin(step / 720) + random.gauss(0, 0.5), 2),
+                "humidity": round(60 + 15 * np.cos(step / 900) + random.gauss(0, 2), 2),
+                "airQuality_val": round(900 + random.gauss(0, 150), 1),
+                "lightIntensity_val": round(max(0.0, 500 + 400 * np.sin(step / 500)), 1),
+                "soilMoisture": round(45 + random.gauss(0, 5), 2)
+            }
+            if devices > 1:
+                reading["device_id"] = f"bench-device-{device:03d}"
+            readings.append(reading)
+    return readings
+
+def recorded_readings(path, start):
+    """
+    Load recorded payloads (one JSON object per line)
+
+    :param path: NDJSON file
+    :param start: Aware datetime used for payloads without a timestamp
+    :return: List of sensorData payloads
+    """
+    readings = []
+    with open(path) as recorded:
+        for index, line in enumerate(recorded):
+            if not line.strip():
+                continue
+            reading = json.loads(line)
+            reading.setdefault("id", f"replay-{index}")
+            reading.setdefault("timestamp", (start + timedelta(seconds=index)).isoformat())
+            readings.append(reading)
+    return readings
+
+def poll_ticks(readings):
+    """
+    Group fleet readings into polls, one per timestamp
+
+    :param readings: List of payloads in time order
+    :return: List of reading lists
+    """
+    ticks = {}
+    for reading in readings:
+        ticks.setdefault(reading["timestamp"], []).append(reading)
+    return list(ticks.values())
+
+def reference_aggregates(readings, keys):
+    """
+    Compute daily min/avg/max per (device, date) with NumPy
+
+    :param readings: List of payloads
+    :param keys: Sensor keys to aggregate
+    :return: Dictionary of (device_id, date) to {key: (min, mean, max)}
+    """
+    groups = {}
+    for reading in readings:
+        groups.setdefault((reading.get("device_id"), reading["timestamp"][0:10]), []).append(reading)
+
+    reference = {}
+    for group, group_readings in groups.items():
+        reference[group] = {}
+        for key in keys:
+            values = np.array([
+                reading[key] for reading in group_readings if is_number(reading.get(key))
+            ], dtype=float)
+            if values.size:
+                reference[group][key] = (values.min(), values.mean(), values.max())
+    return reference
+
+def check_aggregates(collection, reference, tolerance):
+    """
+    Compare stored daily aggregates with the reference
+
+    :param collection: sensor_averages collection
+    :param reference: Output of reference_aggregates
+    :param tolerance: Largest absolute difference accepted
+    :return: Dictionary with the number of values checked, mismatches and max error
+    """
+    checked, mismatches, missing, max_error = 0, [], 0, 0.0
+    for (device_id, day), expected in reference.items():
+        document = collection.find_one({"device_id": device_id, "date": day})
+        if document is None:
+            missing += 1
+            continue
+        for key, (minimum, mean, maximum) in expected.items():
+            stored = (
+                document.get("min_values", {}).get(key),
+                document["sums"][key] / document["counts"][key] if document.get("counts", {}).get(key) else None,
+                document.get("max_values", {}).get(key)
+            )
+            for label, want, got in zip(("min", "avg", "max"), (minimum, mean, maximum), stored):
+                checked += 1
+                error = abs(want - got) if got is not None else float("inf")
+                max_error = max(max_error, error)
+                if error > tolerance:
+                    mismatches.append({"device": device_id, "date": day, "key": key, "stat": label,
+                                       "expected": round(float(want), 6), "stored": got})
+    return {
+        "values_checked": checked,
+        "aggregates_missing": missing,
+        "mismatches": len(mismatches),
+        "max_abs_error": max_error,
+        "examples": mismatches[:5],
+        "correct": not mismatches and not missing
+    }
+
+def run_benchmark(args):
+    # Configure the app before importing it: config.py reads the environment at import time
+    os.environ["MONGO_DB_NAME"] = args.database
+    os.environ["SENSOR_BATCH_SIZE"] = str(args.batch_size)
+    os.environ.setdefault("ACCESS_TOKEN", "benchmark-token")
+    os.environ.setdefault("CHANNEL_SECRET", "benchmark-secret")
+
+    import repository
+    import main  # registers the ingestion consumers exactly as the app does
+    from pytz import timezone
+    from indexes import ensure_indexes
+    from sensor_history import ensure_history_collections
+    from sensor_ingestion import dispatch_reading
+    from devices import store_fleet_readings
+    from sensor_data_sync import flush_buffered_readings, SENSOR_KEYS
+
+    tz = timezone("Asia/Bangkok")
+    repository.mongo_client.drop_database(args.database)
+    ensure_indexes()
+    ensure_history_collections()
+    # A few recipients so alert notifications are queued like in production
+    repository.users_collection().insert_many([{"user_id": f"U{i:032x}"} for i in range(10)])
+
+    start = datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    if args.replay:
+        readings = recorded_readings(args.replay, start)
+    else:
+        readings = synthetic_readings(args.devices, args.interval, args.duration, start)
+    fleet = any(reading.get("device_id") for reading in readings)
+    print(f"Replaying {len(readings)} readings through the {'fleet' if fleet else 'stream'} path...")
+
+    command_counter.reset()
+    started = time.perf_counter()
+    replayed = 0
+    for tick in poll_ticks(readings) if fleet else [[reading] for reading in readings]:
+        if fleet:
+            store_fleet_readings([dict(reading) for reading in tick])
+        else:
+            dispatch_reading(dict(tick[0]), tick[0]["id"])
+        replayed += len(tick)
+        if args.rate:
+            # Pace the replay instead of draining the backlog as fast as possible
+            delay = started + replayed / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    flush_buffered_readings()
+    elapsed = time.perf_counter() - started
+
+    commands = dict(command_counter.counts)
+    correctness = check_aggregates(
+        repository.sensor_averages_collection(),
+        reference_aggregates(readings, SENSOR_KEYS),
+        args.tolerance
+    )
+    results = {
+        "config": {
+            "readings": len(readings),
+            "path": "fleet" if fleet else "stream",
+            "devices": args.devices,
+            "interval_s": args.interval,
+            "duration_s": args.duration,
+            "rate": args.rate,
+            "batch_size": args.batch_size,
+            "replay": args.replay
+        },
+        "elapsed_s": round(elapsed, 3),
+        "readings_per_s": round(len(readings) / elapsed, 1),
+        "mongo_round_trips_per_reading": round(command_counter.total() / len(readings), 3),
+        "mongo_commands": commands,
+        "alerts_queued": repository.db["notification_outbox"].count_documents({}),
+        "correctness": correctness
+    }
+
+    repository.mongo_client.drop_database(args.database)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1, help="simulated devices (1: the original single feed)")
+    parser.add_argument("--interval", type=float, default=5.0, help="simulated seconds between readings of a device")
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds of data")
+    parser.add_argument("--rate", type=float, default=0.0, help="readings per second to replay at (0: as fast as possible)")
+    parser.add_argument("--replay", help="NDJSON file of recorded sensorData payloads")
+    parser.add_argument("--batch-size", type=int, default=1, help="SENSOR_BATCH_SIZE for the aggregate writes")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="largest accepted min/avg/max difference")
+    parser.add_argument("--database", default="emotion_detection_bench_ingestion")
+    parser.add_argument("--output", default="bench_ingestion_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print(json.dumps({key: results[key] for key in (
+        "readings_per_s", "mongo_round_trips_per_reading", "correctness"
+    )}, indent=2, default=str))
+    save_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results, ["readings_per_s", "mongo_round_trips_per_reading"])
+
+if __name__ == "__main__":
+    main()
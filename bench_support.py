@@ -0,0 +1,105 @@
+"""
+Helpers shared by the benchmark scripts (bench_*.py)
+
+Import this module before anything that creates a MongoClient, so the
+command listener sees every round trip.
+"""
+import json
+import subprocess
+import threading
+from datetime import datetime
+import numpy as np
+from pymongo import monitoring
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Counts MongoDB commands (round trips) per command name
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def started(self, event):
+        with self.lock:
+            self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+    def total(self):
+        with self.lock:
+            # Handshakes and heartbeats are not part of the request path
+            return sum(count for name, count in self.counts.items()
+                       if name not in ("hello", "isMaster", "ismaster", "ping", "endSessions"))
+
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+def latency_summary(samples_ms):
+    """
+    :param samples_ms: List of latencies in milliseconds
+    :return: Dictionary with count, mean and p50/p95/p99/max
+    """
+    if not samples_ms:
+        return {"count": 0}
+    samples = np.array(samples_ms)
+    return {
+        "count": int(samples.size),
+        "mean": round(float(samples.mean()), 2),
+        "p50": round(float(np.percentile(samples, 50)), 2),
+        "p95": round(float(np.percentile(samples, 95)), 2),
+        "p99": round(float(np.percentile(samples, 99)), 2),
+        "max": round(float(samples.max()), 2)
+    }
+
+def git_commit():
+    """
+    :return: Short hash of the checked out commit, or "unknown"
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def save_results(results, path):
+    """
+    Write benchmark results as JSON, stamped with the commit and time
+
+    :param results: Dictionary of results
+    :param path: Output file path
+    """
+    results = {"commit": git_commit(), "recorded_at": datetime.now().isoformat(), **results}
+    with open(path, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"Results written to {path}")
+
+def compare_results(baseline_path, results, metrics):
+    """
+    Print how selected metrics moved relative to a previous run
+
+    :param baseline_path: JSON file written by an earlier run
+    :param results: Dictionary of current results
+    :param metrics: List of dotted metric paths, e.g. "ack_latency_ms.p99"
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    def lookup(document, path):
+        for part in path.split("."):
+            document = document.get(part, {}) if isinstance(document, dict) else {}
+        return document if isinstance(document, (int, float)) else None
+
+    print(f"Compared with {baseline.get('commit', '?')}:")
+    for metric in metrics:
+        old, new = lookup(baseline, metric), lookup(results, metric)
+        if old is None or new is None:
+            continue
+        change = ((new - old) / old * 100) if old else 0.0
+        print(f"  {metric}: {old} -> {new} ({change:+.1f}%)")
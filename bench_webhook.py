@@ -0,0 +1,225 @@
+"""
+Load test for the /callback webhook
+
+Sends correctly signed LINE webhook deliveries for every chat command to
+the FastAPI app running in-process, with replies going to a local fake
+LINE API. Reports throughput, acknowledgement and end-to-end reply
+latency, and MongoDB round trips per event.
+
+Point MONGODB_URI at a disposable local MongoDB (e.g. `docker run -p
+27017:27017 mongo`); the benchmark seeds and drops its own database.
+
+    python bench_webhook.py --requests 2000 --concurrency 50 --batch-size 3
+    python bench_webhook.py --output bench_results.json --compare previous.json
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import time
+import uuid
+
+from bench_support import command_counter, latency_summary, save_results, compare_results
+from fake_services import FakeLineApi
+
+COMMANDS = ["Summary", "Watering", "Emotions", "Environment", "History humidity 3h"]
+
+def sign(body, channel_secret):
+    """
+    :param body: Raw request body (bytes)
+    :param channel_secret: LINE channel secret
+    :return: Value of the X-Line-Signature header
+    """
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+def message_event(text, user_id):
+    """
+    :param text: Text of the message
+    :param user_id: Sender's LINE user ID
+    :return: Webhook message event as sent by the LINE Platform
+    """
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "message": {"id": str(random.randint(10 ** 15, 10 ** 16)), "type": "text", "text": text, "quoteToken": "q"}
+    }
+
+def webhook_delivery(commands, user_ids, channel_secret):
+    """
+    :param commands: Texts of the events in the delivery
+    :param user_ids: Senders of the events
+    :param channel_secret: LINE channel secret
+    :return: Tuple of (body bytes, signature, list of reply tokens)
+    """
+    events = [message_event(text, user_id) for text, user_id in zip(commands, user_ids)]
+    body = json.dumps({"destination": "Ubenchmark", "events": events}).encode("utf-8")
+    return body, sign(body, channel_secret), [event["replyToken"] for event in events]
+
+def seed_database(repository):
+    """
+    Insert a realistic day of data for the commands to read
+    """
+    from datetime import datetime, timedelta
+    from pytz import timezone
+    from sensor_history import ensure_history_collections, record_readings
+
+    tz = timezone("Asia/Bangkok")
+    now = datetime.now(tz)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    emotions = ["happy", "sad", "neutral", "angry", "fear", "surprise", "disgust"]
+
+    repository.db["emotions"].insert_many([
+        {"emotion": random.choice(emotions), "date_time": (start + timedelta(seconds=20 * i)).isoformat()}
+        for i in range(int((now - start).total_seconds() // 20))
+    ] or [{"emotion": "happy", "date_time": now.isoformat()}])
+    repository.db["water"].insert_one({"date": datetime.now().strftime("%Y-%m-%d"), "water_time": ["08:00", "12:00"]})
+
+    ensure_history_collections()
+    readings = [
+        {
+            "id": f"bench-{i}",
+            "timestamp": (now - timedelta(minutes=i)).isoformat(),
+            "temperature": 25 + random.random() * 5,
+            "humidity": 55 + random.random() * 20,
+            "airQuality_val": 800 + random.random() * 400,
+            "lightIntensity_val": 400 + random.random() * 300,
+            "soilMoisture": 40 + random.random() * 20
+        }
+        for i in range(180, 0, -1)
+    ]
+    from sensor_data_sync import update_averages_batch
+    update_averages_batch(readings)
+    record_readings(readings)
+
+async def run_benchmark(args):
+    fake_line = FakeLineApi()
+    line_host = await fake_line.start()
+
+    # Configure the app before importing it: config.py reads the environment at import time
+    os.environ["LINE_API_HOST"] = line_host
+    os.environ.setdefault("ACCESS_TOKEN", "benchmark-token")
+    os.environ.setdefault("CHANNEL_SECRET", "benchmark-secret")
+    os.environ["MONGO_DB_NAME"] = args.database
+    os.environ["FIREBASE_DB_URL"] = line_host  # no sensor feed here, ingestion just fails fast
+    os.environ["SENSOR_STREAM_ENABLED"] = "false"
+    os.environ["SENSOR_POLL_INTERVAL"] = "3600"
+    os.environ["EMOTION_RECONCILE_MINUTES"] = "1440"
+
+    import uvicorn
+    import repository
+    import main
+    from config import CHANNEL_SECRET
+
+    repository.mongo_client.drop_database(args.database)
+    seed_database(repository)
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    import aiohttp
+    url = f"http://127.0.0.1:{args.port}/callback"
+    users = [f"U{i:032x}" for i in range(args.users)]
+    commands = itertools.cycle(COMMANDS)
+    ack_latencies, reply_latencies, statuses = [], [], {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def deliver(session):
+        batch = [next(commands) for _ in range(args.batch_size)]
+        body, signature, reply_tokens = webhook_delivery(batch, random.sample(users, args.batch_size), CHANNEL_SECRET)
+        arrivals = [fake_line.expect_reply(token) for token in reply_tokens]
+
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, data=body, headers={
+                "Content-Type": "application/json",
+                "X-Line-Signature": signature
+            }) as response:
+                await response.read()
+                ack_latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*[arrival.wait() for arrival in arrivals]), timeout=args.reply_timeout)
+        except asyncio.TimeoutError:
+            pass
+        for token in reply_tokens:
+            if token in fake_line.replies:
+                reply_latencies.append((fake_line.replies[token] - started) * 1000)
+
+    async with aiohttp.ClientSession() as session:
+        # Warm up caches and connection pools outside the measurement
+        await asyncio.gather(*[deliver(session) for _ in range(min(20, args.requests))])
+        ack_latencies.clear()
+        reply_latencies.clear()
+        statuses.clear()
+        command_counter.reset()
+
+        started = time.perf_counter()
+        await asyncio.gather(*[deliver(session) for _ in range(args.requests)])
+        elapsed = time.perf_counter() - started
+
+    events = args.requests * args.batch_size
+    results = {
+        "config": {
+            "requests": args.requests,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "commands": COMMANDS
+        },
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "events_per_s": round(events / elapsed, 1),
+        "status_codes": statuses,
+        "ack_latency_ms": latency_summary(ack_latencies),
+        "reply_latency_ms": latency_summary(reply_latencies),
+        "mongo_round_trips_per_event": round(command_counter.total() / events, 3),
+        "mongo_commands": dict(command_counter.counts)
+    }
+
+    server.should_exit = True
+    await server_task
+    await fake_line.stop()
+    repository.mongo_client.drop_database(args.database)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="webhook deliveries to send")
+    parser.add_argument("--batch-size", type=int, default=1, help="events per delivery")
+    parser.add_argument("--concurrency", type=int, default=20, help="deliveries in flight")
+    parser.add_argument("--users", type=int, default=200, help="distinct senders")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database", default="emotion_detection_bench")
+    parser.add_argument("--reply-timeout", type=float, default=30.0)
+    parser.add_argument("--output", default="bench_webhook_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+    args.users = max(args.users, args.batch_size)
+
+    results = asyncio.run(run_benchmark(args))
+    print(json.dumps({key: results[key] for key in (
+        "throughput_rps", "ack_latency_ms", "reply_latency_ms", "mongo_round_trips_per_event"
+    )}, indent=2))
+    save_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results, [
+            "throughput_rps", "ack_latency_ms.p50", "ack_latency_ms.p99",
+            "reply_latency_ms.p50", "reply_latency_ms.p99", "mongo_round_trips_per_event"
+        ])
+
+if __name__ == "__main__":
+    main()
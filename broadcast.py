@@ -0,0 +1,55 @@
+import asyncio
+import random
+import aiohttp
+from linebot.v3.messaging.exceptions import ApiException
+
+from config import BROADCAST_BACKOFF_BASE, BROADCAST_BACKOFF_MAX
+
+# LINE accepts at most 500 recipients per multicast request
+MULTICAST_LIMIT = 500
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def chunk_recipients(user_ids, size=MULTICAST_LIMIT):
+    """
+    Split recipients into multicast batches, dropping duplicates and empty IDs
+
+    :param user_ids: Iterable of LINE user IDs
+    :param size: Maximum batch size
+    :return: List of lists of user IDs
+    """
+    unique_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+    return [unique_ids[i:i + size] for i in range(0, len(unique_ids), size)]
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Exponential backoff with full jitter
+
+    :param attempt: Number of attempts made so far (1-based)
+    :param retry_after: Value of the Retry-After header, if any
+    :return: Seconds to sleep before the next attempt
+    """
+    cap = min(BROADCAST_BACKOFF_MAX, BROADCAST_BACKOFF_BASE * (2 ** (attempt - 1)))
+    delay = random.uniform(0, cap)
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+def is_retryable(error):
+    """
+    :param error: Exception raised by a LINE API call
+    :return: True if the call may succeed when retried
+    """
+    if isinstance(error, ApiException):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+def retry_after_header(error):
+    """
+    :param error: Exception raised by a LINE API call
+    :return: Retry-After header value or None
+    """
+    headers = getattr(error, 'headers', None)
+    return headers.get('Retry-After') if headers else None
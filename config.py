@@ -1,30 +1,138 @@
 import os
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
 
 # Load environment variables
 load_dotenv()
 
+# Structured logs (JSON lines); DEBUG also logs every MongoDB command
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
 # MongoDB Configuration
 MONGODB_URI = os.getenv("MONGODB_URI")
-try:
-    mongo_client = MongoClient(MONGODB_URI)
-    mongo_client.admin.command('ping')  # Test the connection
-    print("Successfully connected to MongoDB!")
-except Exception as e:
-    print(f"Error occurred while connecting to MongoDB: {e}")
-    raise
-
-# Database and Collections
-DB = mongo_client["emotion_detection"]
-EMOTIONS_COLLECTION = DB["emotions"]
-WATER_COLLECTION = DB["water"]
-USERS_COLLECTION = DB["users"]
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "emotion_detection")
+
+# Connection pool shared by every module, see repository.py
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+
+# Firebase Realtime Database holding the live sensor feed
+FIREBASE_DB_URL = os.getenv(
+    "FIREBASE_DB_URL",
+    "https://embedded-project-1f031-default-rtdb.asia-southeast1.firebasedatabase.app"
+)
+SENSOR_DATA_PATH = os.getenv("SENSOR_DATA_PATH", "/sensorData")
+FIREBASE_CONNECT_TIMEOUT = float(os.getenv("FIREBASE_CONNECT_TIMEOUT", "5"))
+FIREBASE_READ_TIMEOUT = float(os.getenv("FIREBASE_READ_TIMEOUT", "10"))
+# Firebase sends a keep-alive event every 30 seconds on an open stream
+FIREBASE_STREAM_READ_TIMEOUT = float(os.getenv("FIREBASE_STREAM_READ_TIMEOUT", "75"))
+SENSOR_STREAM_ENABLED = os.getenv("SENSOR_STREAM_ENABLED", "true").lower() == "true"
+SENSOR_POLL_INTERVAL = float(os.getenv("SENSOR_POLL_INTERVAL", "60"))
+
+# JSON file with the alert rules, see alert_rules.DEFAULT_RULES for the format
+ALERT_RULES_FILE = os.getenv("ALERT_RULES_FILE")
+
+# Raw readings are kept this long in the time-series collection
+SENSOR_HISTORY_RETENTION_DAYS = int(os.getenv("SENSOR_HISTORY_RETENTION_DAYS", "30"))
+# Upper bound on rollup documents read by one history query
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "300"))
+
+# Number of sensor readings folded into one sensor_averages write
+SENSOR_BATCH_SIZE = int(os.getenv("SENSOR_BATCH_SIZE", "1"))
+
+# Seconds a cached chat command read model stays fresh without a write, and
+# the number of read models kept (the least recently used are evicted)
+READ_MODEL_CACHE_TTL = float(os.getenv("READ_MODEL_CACHE_TTL", "60"))
+READ_MODEL_CACHE_MAX_ENTRIES = int(os.getenv("READ_MODEL_CACHE_MAX_ENTRIES", "10000"))
+
+# Maximum number of user IDs kept in the in-memory known-user set
+KNOWN_USERS_MAX_ENTRIES = int(os.getenv("KNOWN_USERS_MAX_ENTRIES", "500000"))
+
+# Minutes between reconciliations of today's emotion counters with the emotions collection
+EMOTION_RECONCILE_MINUTES = int(os.getenv("EMOTION_RECONCILE_MINUTES", "5"))
+
+# Resilience: consecutive failures that open a dependency's circuit, seconds
+# before a trial call, per-call deadlines and the total budget for a reply
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+MONGO_CALL_DEADLINE = float(os.getenv("MONGO_CALL_DEADLINE", "1.5"))
+LINE_CALL_DEADLINE = float(os.getenv("LINE_CALL_DEADLINE", "5"))
+REPLY_LATENCY_BUDGET = float(os.getenv("REPLY_LATENCY_BUDGET", "3"))
+# Oldest cached value a reply may fall back to while MongoDB is down
+LAST_KNOWN_GOOD_MAX_AGE = float(os.getenv("LAST_KNOWN_GOOD_MAX_AGE", "86400"))
+
+# Fleet mode: poll every device in the devices registry concurrently
+FLEET_MODE = os.getenv("FLEET_MODE", "false").lower() == "true"
+FLEET_POLL_INTERVAL = float(os.getenv("FLEET_POLL_INTERVAL", "30"))
+FLEET_CONCURRENCY = int(os.getenv("FLEET_CONCURRENCY", "50"))
+FLEET_HTTP_TIMEOUT = float(os.getenv("FLEET_HTTP_TIMEOUT", "10"))
+# Seconds the chat-to-device mapping is cached
+DEVICE_REGISTRY_TTL = float(os.getenv("DEVICE_REGISTRY_TTL", "60"))
+
+# Startup: "background" serves requests (and answers /healthz) while indexes are
+# created and the user cache is warmed, /readyz turns ready once that is done;
+# "blocking" finishes that work before uvicorn accepts connections
+STARTUP_BOOTSTRAP = os.getenv("STARTUP_BOOTSTRAP", "background").lower()
+# Seconds /readyz waits for MongoDB to answer a ping
+READINESS_PING_TIMEOUT = float(os.getenv("READINESS_PING_TIMEOUT", "1"))
+
+# Minutes between refreshes of today's trend rollups (day/week/month)
+TREND_REFRESH_MINUTES = int(os.getenv("TREND_REFRESH_MINUTES", "15"))
+
+# Retention: raw emotions and water records older than RETENTION_DAYS are
+# exported to Parquet under ARCHIVE_DIR and deleted from MongoDB
+# ARCHIVE_DELETE_AFTER_DAYS later; minute/hour sensor rollups that old are dropped
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_DELETE_AFTER_DAYS = int(os.getenv("ARCHIVE_DELETE_AFTER_DAYS", "7"))
+# Rows per Parquet file, bounds the memory used while exporting a day
+ARCHIVE_PART_ROWS = int(os.getenv("ARCHIVE_PART_ROWS", "100000"))
+RETENTION_JOB_TIMEOUT = float(os.getenv("RETENTION_JOB_TIMEOUT", "1800"))
+
+# "local": one process runs every job; "mongo": workers/replicas coordinate
+# through leases in MongoDB so each scheduled job runs in exactly one instance
+COORDINATION_MODE = os.getenv("COORDINATION_MODE", "local")
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "30"))
+
+# Time zone of daily jobs (the machine's local zone when unset)
+SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE")
+# A daily job whose firing was missed (no instance running) runs at startup
+# if the firing is at most this many seconds old
+CRON_MISFIRE_GRACE_SECONDS = float(os.getenv("CRON_MISFIRE_GRACE_SECONDS", "21600"))
+SUMMARY_JOB_TIMEOUT = float(os.getenv("SUMMARY_JOB_TIMEOUT", "300"))
+RECONCILE_JOB_TIMEOUT = float(os.getenv("RECONCILE_JOB_TIMEOUT", "120"))
+
+# Emotion detection uploads: required X-Api-Key value (unset: uploads are refused) and batch limit
+INGEST_API_KEY = os.getenv("INGEST_API_KEY")
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "10000"))
 
 # LINE Bot Configuration
 ACCESS_TOKEN = os.getenv('ACCESS_TOKEN')
 CHANNEL_SECRET = os.getenv('CHANNEL_SECRET')
+# Point at a local fake LINE API server when testing
+LINE_API_HOST = os.getenv('LINE_API_HOST', 'https://api.line.me')
+
+# Broadcast (multicast fan-out) configuration
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+BROADCAST_BACKOFF_BASE = float(os.getenv("BROADCAST_BACKOFF_BASE", "0.5"))
+BROADCAST_BACKOFF_MAX = float(os.getenv("BROADCAST_BACKOFF_MAX", "30"))
+
+# Notification outbox: delivery workers per process, lease on a claimed batch
+# and how often idle workers look for batches queued by other processes
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
 
-line_configuration = Configuration(access_token=ACCESS_TOKEN)
-line_bot_api = MessagingApi(ApiClient(line_configuration))
\ No newline at end of file
+# Webhook pipeline configuration
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+# "reject": answer 503 so LINE redelivers later, "drop_oldest": evict the oldest queued event
+WEBHOOK_BACKPRESSURE_POLICY = os.getenv("WEBHOOK_BACKPRESSURE_POLICY", "reject")
+# Redelivered events are recognised by webhookEventId for this many seconds
+WEBHOOK_DEDUPE_TTL = float(os.getenv("WEBHOOK_DEDUPE_TTL", "3600"))
+WEBHOOK_DEDUPE_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUPE_MAX_ENTRIES", "100000"))
+# "auto": also claim event IDs in MongoDB when COORDINATION_MODE=mongo; "true"/"false" to force
+WEBHOOK_DEDUPE_MONGO = os.getenv("WEBHOOK_DEDUPE_MONGO", "auto").lower()
@@ -0,0 +1,179 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from pytz import utc
+
+import repository
+from config import COORDINATION_MODE, LEADER_LEASE_SECONDS
+
+LEASES_COLLECTION = "job_leases"
+CURSORS_COLLECTION = "ingestion_cursors"
+
+# Identifies this process among all workers and replicas
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# Last claimed reading per cursor when running as a single process
+local_cursors = {}
+local_cursors_lock = threading.Lock()
+
+def distributed():
+    """
+    :return: True when several processes share the database and must coordinate
+    """
+    return COORDINATION_MODE == "mongo"
+
+def leases_collection():
+    return repository.db[LEASES_COLLECTION]
+
+def acquire_lease(name, ttl):
+    """
+    Take or renew a named lease held by this instance
+
+    :param name: Lease name
+    :param ttl: Seconds the lease stays valid without renewal
+    :return: True if this instance holds the lease
+    """
+    now = datetime.now(utc)
+    try:
+        leases_collection().find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": INSTANCE_ID}]},
+            {"$set": {"owner": INSTANCE_ID, "expires_at": now + timedelta(seconds=ttl), "renewed_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists, is unexpired and belongs to another instance
+        return False
+
+def release_lease(name):
+    """
+    Give up a lease held by this instance so another one can take over at once
+
+    :param name: Lease name
+    """
+    leases_collection().update_one(
+        {"_id": name, "owner": INSTANCE_ID},
+        {"$set": {"expires_at": datetime.now(utc)}}
+    )
+
+def claim_window(name, window_seconds, at=None):
+    """
+    Claim the current run window of a scheduled job across all instances
+
+    Every instance fires the same trigger at (about) the same time; the first
+    one to insert the window's lease document runs the job, the others skip.
+
+    :param name: Job name
+    :param window_seconds: Length of the window, usually the job interval
+    :param at: Epoch seconds the firing was scheduled for (now by default),
+        so a late catch-up run claims the same window as the original firing
+    :return: True if this instance should run the job
+    """
+    at = time.time() if at is None else at
+    window_start = int(at // window_seconds * window_seconds)
+    now = datetime.now(utc)
+    try:
+        leases_collection().insert_one({
+            "_id": f"{name}:{window_start}",
+            "owner": INSTANCE_ID,
+            "claimed_at": now,
+            # Removed by the TTL index once the window is over
+            "expires_at": now + timedelta(seconds=window_seconds * 2)
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+def claim_reading(cursor_name, sensor_id):
+    """
+    Advance a shared ingestion cursor to sensor_id if it is not there already
+
+    :param cursor_name: Name of the cursor, one per consumer that deduplicates
+    :param sensor_id: ID of the reading
+    :return: True if the reading is new and this caller should process it
+    """
+    if sensor_id is None:
+        return False
+
+    if not distributed():
+        with local_cursors_lock:
+            if local_cursors.get(cursor_name) == sensor_id:
+                return False
+            local_cursors[cursor_name] = sensor_id
+            return True
+
+    try:
+        result = repository.db[CURSORS_COLLECTION].update_one(
+            {"_id": cursor_name, "last_id": {"$ne": sensor_id}},
+            {"$set": {"last_id": sensor_id, "owner": INSTANCE_ID, "updated_at": datetime.now(utc)}},
+            upsert=True
+        )
+        return result.modified_count == 1 or result.upserted_id is not None
+    except DuplicateKeyError:
+        # The cursor already points at this reading
+        return False
+
+class LeaderElection:
+    """
+    Keeps a renewed lease in a background thread and runs callbacks on changes
+
+    Used for continuous work (the sensor ingestion stream) that must run in
+    exactly one instance. With COORDINATION_MODE=local the instance is
+    always the leader.
+    """
+    def __init__(self, name, on_elected, on_demoted, ttl=LEADER_LEASE_SECONDS):
+        self.name = name
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.ttl = ttl
+        self.is_leader = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def step(self):
+        try:
+            leader = acquire_lease(self.name, self.ttl)
+        except PyMongoError as e:
+            # Without the database the lease cannot be proven, step down
+            print(f"Could not renew lease {self.name}: {e}")
+            leader = False
+
+        if leader and not self.is_leader:
+            print(f"{INSTANCE_ID} became leader for {self.name}.")
+            self.is_leader = True
+            self.on_elected()
+        elif not leader and self.is_leader:
+            print(f"{INSTANCE_ID} lost leadership for {self.name}.")
+            self.is_leader = False
+            self.on_demoted()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.step()
+            # Renew well before expiry
+            self.stop_event.wait(self.ttl / 3)
+
+    def start(self):
+        if not distributed():
+            self.is_leader = True
+            self.on_elected()
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name=f"leader-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(5.0)
+        if self.is_leader:
+            self.is_leader = False
+            self.on_demoted()
+            if distributed():
+                release_lease(self.name)
@@ -0,0 +1,239 @@
+import asyncio
+import sys
+import threading
+import time
+from datetime import datetime
+import aiohttp
+from pytz import timezone
+from pymongo.errors import PyMongoError
+
+import repository
+from config import (
+    FLEET_CONCURRENCY,
+    FLEET_HTTP_TIMEOUT,
+    DEVICE_REGISTRY_TTL
+)
+from sensor_data_sync import sensor_data_url, update_averages_batch
+from coordination import claim_reading
+from metrics import track, log_event
+from resilience import breakers
+
+tz = timezone("Asia/Bangkok")
+
+DEVICES_COLLECTION = "devices"
+
+# recipient ID -> device ID, reloaded from the registry every DEVICE_REGISTRY_TTL seconds
+recipient_devices = {}
+recipient_devices_expires = 0.0
+recipient_devices_lock = threading.Lock()
+
+# One aiohttp session per process for the fleet polls, created on the event
+# loop that polls
+fleet_session = None
+
+def devices_collection():
+    """
+    :return: Collection of registered sensor devices
+    """
+    return repository.db[DEVICES_COLLECTION]
+
+def device_path(device_id):
+    """
+    :param device_id: Device ID
+    :return: Default Realtime Database path of a device's sensor feed
+    """
+    return f"/devices/{device_id}/sensorData"
+
+def register_device(device_id, recipients, path=None, name=None):
+    """
+    Add or update a device in the registry
+
+    :param device_id: Device ID
+    :param recipients: LINE user, group or room IDs whose replies use this device
+    :param path: Realtime Database path of the feed, defaults to device_path()
+    :param name: Display name
+    """
+    devices_collection().update_one(
+        {'_id': device_id},
+        {'$set': {
+            'path': path or device_path(device_id),
+            'recipients': list(recipients),
+            'name': name or device_id,
+            'enabled': True,
+            'updated_at': datetime.now(tz)
+        }},
+        upsert=True
+    )
+    invalidate_recipient_devices()
+
+def enabled_devices():
+    """
+    :return: List of enabled device documents
+    """
+    return list(devices_collection().find({'enabled': True}, {'path': 1, 'recipients': 1}))
+
+def invalidate_recipient_devices():
+    global recipient_devices_expires
+
+    with recipient_devices_lock:
+        recipient_devices_expires = 0.0
+
+def device_for_recipient(*recipient_ids):
+    """
+    Find the device assigned to a chat
+
+    :param recipient_ids: Candidate IDs, most specific first (group, room, user)
+    :return: Device ID or None for the original single sensor feed
+    """
+    global recipient_devices, recipient_devices_expires
+
+    with recipient_devices_lock:
+        if time.monotonic() >= recipient_devices_expires:
+            try:
+                mapping = {}
+                for device in devices_collection().find({'enabled': True}, {'recipients': 1}):
+                    for recipient in device.get('recipients', []):
+                        mapping.setdefault(recipient, device['_id'])
+                recipient_devices = mapping
+                recipient_devices_expires = time.monotonic() + DEVICE_REGISTRY_TTL
+            except PyMongoError as e:
+                # Keep answering with the previous mapping, retry a bit later
+                print(f"Could not reload the device registry: {e}")
+                recipient_devices_expires = time.monotonic() + min(DEVICE_REGISTRY_TTL, 10)
+        mapping = recipient_devices
+
+    for recipient_id in recipient_ids:
+        if recipient_id and recipient_id in mapping:
+            return mapping[recipient_id]
+    return None
+
+def device_for_source(source):
+    """
+    :param source: LINE event source (user, group or room)
+    :return: Device ID or None
+    """
+    return device_for_recipient(
+        getattr(source, 'group_id', None),
+        getattr(source, 'room_id', None),
+        getattr(source, 'user_id', None)
+    )
+
+async def fetch_device(session, semaphore, device):
+    """
+    Fetch the current reading of one device
+
+    :param session: aiohttp.ClientSession
+    :param semaphore: Semaphore bounding concurrent requests
+    :param device: Device document
+    :return: Tuple of (device ID, reading) or (device ID, None) on failure
+    """
+    async with semaphore:
+        try:
+            with track("firebase", "fetch_device"):
+                async with session.get(sensor_data_url(device['path'])) as response:
+                    response.raise_for_status()
+                    reading = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            log_event("fleet_fetch_failed", device_id=device['_id'], error=str(e))
+            return device['_id'], None
+
+    if not isinstance(reading, dict):
+        return device['_id'], None
+    reading['device_id'] = device['_id']
+    reading['timestamp'] = datetime.now(tz).isoformat()
+    return device['_id'], reading
+
+def get_fleet_session():
+    """
+    :return: The process's fleet ClientSession, created on first use so its
+        keep-alive connections are reused across polls
+    """
+    global fleet_session
+
+    if fleet_session is None or fleet_session.closed:
+        fleet_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=FLEET_CONCURRENCY),
+            timeout=aiohttp.ClientTimeout(total=FLEET_HTTP_TIMEOUT)
+        )
+    return fleet_session
+
+async def close_fleet_session():
+    """
+    Close the fleet session's connections, used on shutdown
+    """
+    global fleet_session
+
+    if fleet_session is not None:
+        await fleet_session.close()
+    fleet_session = None
+
+async def fetch_fleet(devices):
+    """
+    Fetch every device concurrently over the shared fleet session
+
+    :param devices: List of device documents
+    :return: List of readings (devices that failed are left out)
+    """
+    semaphore = asyncio.Semaphore(FLEET_CONCURRENCY)
+    session = get_fleet_session()
+    results = await asyncio.gather(*[fetch_device(session, semaphore, device) for device in devices])
+    return [reading for _, reading in results if reading is not None]
+
+def store_fleet_readings(readings):
+    """
+    Fold the new readings into the (device, date) aggregates with one bulk write
+
+    :param readings: Readings returned by fetch_fleet
+    :return: Number of new readings written
+    """
+    new_readings = [
+        reading for reading in readings
+        # One cursor per device, so an unchanged reading is not counted twice
+        if claim_reading(f"device:{reading['device_id']}", reading.get('id'))
+    ]
+    return update_averages_batch(new_readings)
+
+async def poll_fleet():
+    """
+    Scheduler job: fetch every enabled device and store the new readings
+    """
+    devices = await asyncio.to_thread(enabled_devices)
+    if not devices:
+        return
+    firebase = breakers["firebase"]
+    if not firebase.allow():
+        log_event("fleet_poll_skipped", reason="firebase circuit open")
+        return
+    started = time.perf_counter()
+    try:
+        readings = await fetch_fleet(devices)
+    except BaseException:
+        # allow() may have started a half-open trial, which must not stay
+        # pending; the single-feed ingestion shares this breaker
+        firebase.record_failure()
+        raise
+    # Single devices fail on their own, only a poll where none answered counts against Firebase
+    if readings:
+        firebase.record_success()
+    else:
+        firebase.record_failure()
+    written = await asyncio.to_thread(store_fleet_readings, readings)
+    log_event(
+        "fleet_polled",
+        devices=len(devices),
+        fetched=len(readings),
+        written=written,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1)
+    )
+
+if __name__ == "__main__":
+    # python devices.py add <device_id> <recipient_id> [<recipient_id> ...]
+    # python devices.py list
+    if len(sys.argv) >= 4 and sys.argv[1] == "add":
+        register_device(sys.argv[2], sys.argv[3:])
+        print(f"Registered device {sys.argv[2]} for {', '.join(sys.argv[3:])}.")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "list":
+        for device in devices_collection().find():
+            print(f"{device['_id']}: {device.get('path')} -> {', '.join(device.get('recipients', []))}")
+    else:
+        print("Usage: python devices.py add <device_id> <recipient_id>... | list")
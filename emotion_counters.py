@@ -0,0 +1,212 @@
+import sys
+from datetime import date, datetime, timedelta
+from pytz import timezone
+from pymongo import UpdateOne
+
+import repository
+from read_model_cache import read_model_cache
+from config import EMOTION_RECONCILE_MINUTES
+
+tz = timezone("Asia/Bangkok")
+
+COUNTERS_COLLECTION = "emotion_counters"
+
+def counters_collection():
+    """
+    :return: Collection of per-day emotion counters
+    """
+    return repository.db[COUNTERS_COLLECTION]
+
+def emotion_range_filter(start_day, end_day=None):
+    """
+    Build the date_time filter selecting whole Bangkok days of emotions
+
+    date_time is an ISO string for detections written by the camera directly
+    and a BSON date for detections uploaded to /ingest/emotions. Range
+    comparisons only match values of the same BSON type, so each branch of
+    the $or selects one kind and both use the date_time index.
+
+    :param start_day: First date to select
+    :param end_day: Last date to select (inclusive), defaults to start_day
+    :return: MongoDB filter document
+    """
+    next_day = (end_day or start_day) + timedelta(days=1)
+    start = tz.localize(datetime.combine(start_day, datetime.min.time()))
+    end = tz.localize(datetime.combine(next_day, datetime.min.time()))
+    return {
+        "$or": [
+            {"date_time": {
+                "$gte": start_day.isoformat() + "T00:00:00+07:00",
+                "$lt": next_day.isoformat() + "T00:00:00+07:00"
+            }},
+            {"date_time": {"$gte": start, "$lt": end}}
+        ]
+    }
+
+def local_time_part(date_format, start, length):
+    """
+    :param date_format: $dateToString format for BSON dates
+    :param start: Offset of the part in ISO strings
+    :param length: Length of the part in ISO strings
+    :return: Expression extracting a Bangkok date/time part from $date_time
+    """
+    return {
+        "$cond": [
+            {"$eq": [{"$type": "$date_time"}, "date"]},
+            {"$dateToString": {"format": date_format, "date": "$date_time", "timezone": "Asia/Bangkok"}},
+            {"$substrCP": ["$date_time", start, length]}
+        ]
+    }
+
+def counter_pipeline(start_day, end_day=None):
+    """
+    Build the aggregation counting detections per day, hour and emotion
+
+    :param start_day: First date to count
+    :param end_day: Last date to count (inclusive), defaults to start_day
+    :return: Aggregation pipeline
+    """
+    return [
+        {"$match": emotion_range_filter(start_day, end_day)},
+        {
+            "$group": {
+                "_id": {
+                    "day": local_time_part("%Y-%m-%d", 0, 10),
+                    "hour": local_time_part("%H", 11, 2),
+                    "emotion": "$emotion"
+                },
+                "count": {"$sum": 1}
+            }
+        }
+    ]
+
+def record_emotions(detections):
+    """
+    Increment the counters for newly written detections
+
+    :param detections: Iterable of (emotion, aware datetime) tuples
+    """
+    increments = {}
+    for emotion, moment in detections:
+        local = moment.astimezone(tz)
+        day_increments = increments.setdefault(local.strftime("%Y-%m-%d"), {"total": 0})
+        day_increments["total"] += 1
+        for field in (f"counts.{emotion}", f"hours.{local:%H}.{emotion}"):
+            day_increments[field] = day_increments.get(field, 0) + 1
+
+    if not increments:
+        return
+    counters_collection().bulk_write([
+        UpdateOne({"_id": day}, {"$inc": day_increments}, upsert=True)
+        for day, day_increments in increments.items()
+    ], ordered=False)
+    read_model_cache.notify_write("emotions")
+
+def reconcile_counters(start_day, end_day=None):
+    """
+    Recompute the counters of a range of days from the emotions collection
+
+    Used to backfill existing data and to pick up detections written by
+    processes that do not call record_emotions.
+
+    :param start_day: First date to reconcile
+    :param end_day: Last date to reconcile (inclusive), defaults to start_day
+    :return: Number of day documents written
+    """
+    end_day = end_day or start_day
+    days = {}
+    current = start_day
+    while current <= end_day:
+        days[current.isoformat()] = {"total": 0, "counts": {}, "hours": {}}
+        current += timedelta(days=1)
+
+    for result in repository.db["emotions"].aggregate(counter_pipeline(start_day, end_day), allowDiskUse=True):
+        key, count = result["_id"], result["count"]
+        day = days.get(key["day"])
+        if day is None or key["emotion"] is None:
+            continue
+        day["total"] += count
+        day["counts"][key["emotion"]] = day["counts"].get(key["emotion"], 0) + count
+        hour = day["hours"].setdefault(key["hour"], {})
+        hour[key["emotion"]] = hour.get(key["emotion"], 0) + count
+
+    now = datetime.now(tz)
+    counters_collection().bulk_write([
+        UpdateOne({"_id": day_key}, {"$set": {**counters, "reconciled_at": now}}, upsert=True)
+        for day_key, counters in days.items()
+    ], ordered=False)
+    read_model_cache.notify_write("emotions")
+    return len(days)
+
+def reconcile_today():
+    """
+    Scheduler job reconciling today's counters, and yesterday's until it is sealed
+
+    Detections written just before midnight are only picked up by a run
+    after midnight. Yesterday is sealed by the first run that starts at
+    least EMOTION_RECONCILE_MINUTES into the new day; trend rollups treat a
+    day as complete only once its counters are sealed.
+    """
+    try:
+        now = datetime.now(tz)
+        today = now.date()
+        yesterday = today - timedelta(days=1)
+        reconcile_counters(today)
+
+        if counters_collection().find_one({"_id": yesterday.isoformat(), "sealed": True}, {"_id": 1}) is None:
+            reconcile_counters(yesterday)
+            midnight = tz.localize(datetime.combine(today, datetime.min.time()))
+            if now - midnight >= timedelta(minutes=EMOTION_RECONCILE_MINUTES):
+                counters_collection().update_one({"_id": yesterday.isoformat()}, {"$set": {"sealed": True}})
+    except Exception as e:
+        print(f"Error reconciling emotion counters: {e}")
+
+def get_day_counts(day=None):
+    """
+    Read the emotion counters of a day with a single lookup
+
+    :param day: date to read, defaults to today (Bangkok time)
+    :return: Tuple of (total detections, dictionary of emotion to count)
+    """
+    day = day or datetime.now(tz).date()
+    document = counters_collection().find_one({"_id": day.isoformat()}, {"total": 1, "counts": 1})
+    if document is None:
+        # First read of the day before the reconcile job ran
+        reconcile_counters(day)
+        document = counters_collection().find_one({"_id": day.isoformat()}, {"total": 1, "counts": 1})
+    return document.get("total", 0), document.get("counts", {})
+
+def emotion_breakdown(day=None):
+    """
+    :param day: date to read, defaults to today (Bangkok time)
+    :return: Dictionary of emotion to {'count', 'percentage'}
+    """
+    total, counts = get_day_counts(day)
+    if not total:
+        return {}
+    return {
+        emotion: {
+            'count': count,
+            'percentage': round((count / total) * 100, 1)
+        } for emotion, count in counts.items()
+    }
+
+def predominant_emotion(day=None):
+    """
+    :param day: date to read, defaults to today (Bangkok time)
+    :return: Emotion with the highest count or None
+    """
+    _, counts = get_day_counts(day)
+    if not counts:
+        return None
+    return max(counts, key=counts.get)
+
+if __name__ == "__main__":
+    # python emotion_counters.py --backfill 2024-11-01 2024-11-30
+    if len(sys.argv) >= 3 and sys.argv[1] == "--backfill":
+        first = date.fromisoformat(sys.argv[2])
+        last = date.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else datetime.now(tz).date()
+        written = reconcile_counters(first, last)
+        print(f"Backfilled emotion counters for {written} days.")
+    else:
+        reconcile_today()
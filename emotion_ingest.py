@@ -0,0 +1,151 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+from pytz import timezone
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from config import INGEST_MAX_BATCH
+from repository import emotions_collection
+from emotion_counters import record_emotions
+
+tz = timezone("Asia/Bangkok")
+
+# Errors reported back per request, the rest are only counted
+MAX_REPORTED_ERRORS = 20
+# Fields the app itself writes or queries on, never taken from a client
+RESERVED_FIELDS = {"_id", "date", "archived_at", "extra"}
+
+class EmotionDetection(BaseModel):
+    """
+    One detection uploaded by the camera
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    # Used in counter field paths, see emotion_counters.record_emotions
+    emotion: str = Field(min_length=1, max_length=32, pattern=r"^[a-z_]+$")
+    date_time: datetime
+    confidence: Optional[float] = Field(default=None, ge=0, le=100)
+    camera_id: Optional[str] = Field(default=None, max_length=64)
+    # Extra detector output (region, scores, ...), kept apart from the fields
+    # retention and the counters rely on
+    extra: Optional[Dict[str, Any]] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def nest_extra_fields(cls, data):
+        if not isinstance(data, dict):
+            return data
+        fields = {key: value for key, value in data.items() if key in cls.model_fields and key != "extra"}
+        extra = {
+            key: value for key, value in data.items()
+            if key not in cls.model_fields and key not in RESERVED_FIELDS
+            and not key.startswith("$") and "." not in key
+        }
+        if extra:
+            fields["extra"] = extra
+        return fields
+
+    @field_validator("emotion", mode="before")
+    @classmethod
+    def normalize_emotion(cls, value):
+        return value.strip().lower() if isinstance(value, str) else value
+
+    @field_validator("date_time")
+    @classmethod
+    def localize_date_time(cls, value):
+        # Timestamps without an offset are Bangkok time, like the legacy strings
+        return tz.localize(value) if value.tzinfo is None else value
+
+def parse_batch(body, content_type=None):
+    """
+    Decode a JSON array or NDJSON request body
+
+    :param body: Request body as bytes or str
+    :param content_type: Content-Type header value
+    :return: List of decoded items
+    :raises ValueError: If the body is not valid JSON/NDJSON or is too large
+    """
+    text = body.decode("utf-8") if isinstance(body, bytes) else body
+    stripped = text.lstrip()
+
+    if stripped.startswith("[") and "ndjson" not in (content_type or ""):
+        items = json.loads(stripped)
+    else:
+        items = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Line {line_number} is not valid JSON: {e}")
+
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array or NDJSON lines.")
+    if len(items) > INGEST_MAX_BATCH:
+        raise ValueError(f"Batch of {len(items)} detections exceeds the limit of {INGEST_MAX_BATCH}.")
+    return items
+
+def validate_detections(items):
+    """
+    :param items: List of decoded items
+    :return: Tuple of (list of EmotionDetection, list of (index, error message))
+    """
+    detections, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            detections.append(EmotionDetection.model_validate(item))
+        except ValidationError as e:
+            errors.append((index, "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            )))
+    return detections, errors
+
+def ingest_emotions(body, content_type=None):
+    """
+    Validate and store a batch of detections, then update the emotion counters
+
+    Invalid items are skipped and reported; the valid ones are written with
+    a single unordered insert_many.
+
+    :param body: Request body (JSON array or NDJSON)
+    :param content_type: Content-Type header value
+    :return: Dictionary with accepted/inserted/rejected counts and sample errors
+    :raises ValueError: If the body cannot be decoded
+    """
+    items = parse_batch(body, content_type)
+    detections, errors = validate_detections(items)
+
+    documents = [detection.model_dump(exclude_none=True) for detection in detections]
+    failed_indexes = set()
+    if documents:
+        try:
+            emotions_collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_indexes.add(write_error["index"])
+                errors.append((None, write_error.get("errmsg", "write failed")))
+
+    inserted = [
+        (detection.emotion, detection.date_time)
+        for index, detection in enumerate(detections)
+        if index not in failed_indexes
+    ]
+    # Same pass as the insert, so Summary/Emotions see the batch right away
+    try:
+        record_emotions(inserted)
+    except PyMongoError as e:
+        # The detections are stored; failing here would make the client
+        # upload them again. reconcile_today fixes the counters.
+        print(f"Could not update emotion counters for {len(inserted)} detections: {e}")
+
+    return {
+        "received": len(items),
+        "inserted": len(inserted),
+        "rejected": len(items) - len(inserted),
+        "errors": [
+            {"index": index, "error": message}
+            for index, message in errors[:MAX_REPORTED_ERRORS]
+        ]
+    }
@@ -0,0 +1,124 @@
+"""
+Local stand-ins for the external services, used by the benchmarks and tests
+
+Importing this module has no side effects.
+"""
+import asyncio
+import json
+import time
+from aiohttp import web
+
+class FakeLineApi:
+    """
+    Local stand-in for the LINE Messaging API recording when replies arrive
+    """
+    def __init__(self):
+        self.replies = {}
+        self.multicasts = []
+        self.reply_arrived = {}
+        self.runner = None
+        self.port = None
+
+    async def handle_reply(self, request):
+        body = await request.json()
+        self.replies[body["replyToken"]] = time.perf_counter()
+        arrived = self.reply_arrived.pop(body["replyToken"], None)
+        if arrived is not None:
+            arrived.set()
+        return web.json_response({"sentMessages": [{"id": "1", "quoteToken": "q"}]})
+
+    async def handle_multicast(self, request):
+        body = await request.json()
+        self.multicasts.append(len(body.get("to", [])))
+        return web.json_response({})
+
+    async def handle_push(self, request):
+        return web.json_response({"sentMessages": [{"id": "1", "quoteToken": "q"}]})
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/v2/bot/message/reply", self.handle_reply)
+        app.router.add_post("/v2/bot/message/multicast", self.handle_multicast)
+        app.router.add_post("/v2/bot/message/push", self.handle_push)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def expect_reply(self, reply_token):
+        """
+        :param reply_token: Reply token of a webhook event
+        :return: asyncio.Event set when the reply for the token arrives
+        """
+        event = asyncio.Event()
+        self.reply_arrived[reply_token] = event
+        return event
+
+class FakeFirebase:
+    """
+    Local stand-in for the Firebase Realtime Database REST API
+
+    GET <path>.json answers the current snapshot, or with
+    Accept: text/event-stream a server-sent event stream that starts with a
+    'put' of the snapshot followed by every published event.
+    """
+    def __init__(self, snapshot=None):
+        self.snapshot = dict(snapshot or {})
+        self.subscribers = []
+        self.runner = None
+        self.port = None
+
+    async def handle_get(self, request):
+        if "text/event-stream" not in request.headers.get("Accept", ""):
+            return web.json_response(self.snapshot)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        queue = asyncio.Queue()
+        queue.put_nowait(("put", {"path": "/", "data": self.snapshot}))
+        self.subscribers.append(queue)
+        try:
+            while True:
+                event_type, payload = await queue.get()
+                await response.write(f"event: {event_type}\ndata: {json.dumps(payload)}\n\n".encode())
+        except ConnectionResetError:
+            pass  # the client went away
+        finally:
+            self.subscribers.remove(queue)
+        return response
+
+    def publish(self, event_type, path="/", data=None):
+        """
+        Send an event to every open stream; call it on the server's event loop
+
+        :param event_type: 'put', 'patch', 'keep-alive', 'cancel' or 'auth_revoked'
+        :param path: Path of the change relative to the streamed path
+        :param data: New value at the path
+        """
+        if event_type == "put" and path == "/":
+            self.snapshot = dict(data or {})
+        elif event_type == "patch" and path == "/":
+            self.snapshot.update(data or {})
+        payload = {"path": path, "data": data} if event_type in ("put", "patch") else data
+        for queue in self.subscribers:
+            queue.put_nowait((event_type, payload))
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self.handle_get)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,72 @@
+"""
+Import-time profile of the app
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter and
+reports the slowest imports, so cold-start regressions (a heavy library
+imported at module level, a client connecting at import time) show up
+before they reach a replica.
+
+    python import_profile.py
+    python import_profile.py --module webhook_pipeline --top 40
+    python import_profile.py --budget 800   # exit 1 if the import takes longer (ms)
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+def profile_imports(module):
+    """
+    :param module: Module to import
+    :return: Tuple of (wall time of the import in ms, list of (self us, cumulative us, depth, name))
+    """
+    code = f"import time; started = time.perf_counter(); import {module}; " \
+           f"print((time.perf_counter() - started) * 1000)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return float(result.stdout.strip().splitlines()[-1]), imports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import")
+    parser.add_argument("--top", type=int, default=25, help="number of imports listed")
+    parser.add_argument("--budget", type=float, help="fail if the import takes longer than this many ms")
+    args = parser.parse_args()
+
+    wall_ms, imports = profile_imports(args.module)
+
+    # Packages imported directly by the module (and the interpreter's startup imports)
+    packages = {}
+    for self_us, cumulative_us, depth, name in imports:
+        if depth <= 1:
+            root = name.split(".")[0]
+            packages[root] = packages.get(root, 0) + cumulative_us
+
+    print(f"import {args.module}: {wall_ms:.0f} ms ({len(imports)} modules)\n")
+    print("Slowest packages (cumulative ms):")
+    for name, cumulative_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f}  {name}")
+
+    print("\nSlowest modules (self ms):")
+    for self_us, cumulative_us, _, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f}  {name} (cumulative {cumulative_us / 1000:.1f})")
+
+    if args.budget is not None and wall_ms > args.budget:
+        print(f"\nimport {args.module} took {wall_ms:.0f} ms, over the {args.budget:.0f} ms budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import sys
+from datetime import datetime, timedelta
+from pytz import timezone
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+import repository
+from config import MONGO_DB_NAME, ARCHIVE_DELETE_AFTER_DAYS
+from emotion_counters import counter_pipeline
+from sensor_data_sync import build_aggregate_update, aggregate_filter
+from known_users import user_upsert
+
+tz = timezone("Asia/Bangkok")
+
+# Indexes required by every query the bot runs, per collection
+INDEXES = {
+    "emotions": [
+        # date_time range + emotion lets the counter reconciliation be answered from the index
+        ([("date_time", ASCENDING), ("emotion", ASCENDING)], {"name": "date_time_emotion"}),
+        # Deletes detections exported to the Parquet archive, see retention.py
+        ([("archived_at", ASCENDING)], {"name": "archived_at_ttl", "expireAfterSeconds": ARCHIVE_DELETE_AFTER_DAYS * 86400}),
+    ],
+    "water": [
+        ([("date", ASCENDING)], {"name": "date"}),
+        ([("archived_at", ASCENDING)], {"name": "archived_at_ttl", "expireAfterSeconds": ARCHIVE_DELETE_AFTER_DAYS * 86400}),
+    ],
+    "sensor_averages": [
+        # One aggregate per device and day; device_id is null for the original feed
+        ([("device_id", ASCENDING), ("date", ASCENDING)], {"name": "device_date_unique", "unique": True}),
+    ],
+    "devices": [
+        ([("recipients", ASCENDING)], {"name": "recipients"}),
+    ],
+    "users": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+    ],
+    "job_leases": [
+        # Drops per-window job claims and stale leader leases
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "notification_outbox": [
+        # Due batches in order, and expired leases of the 'sending' ones
+        ([("status", ASCENDING), ("available_at", ASCENDING)], {"name": "status_available_at"}),
+        # Delivered and failed batches are kept for a week
+        ([("finished_at", ASCENDING)], {"name": "finished_at_ttl", "expireAfterSeconds": 7 * 86400}),
+    ],
+    "trend_rollups": [
+        # Open day rollups picked up by every refresh
+        ([("level", ASCENDING), ("complete", ASCENDING)], {"name": "level_complete"}),
+    ],
+    "archive_manifest": [
+        ([("collection", ASCENDING), ("complete", ASCENDING)], {"name": "collection_complete"}),
+    ],
+    "webhook_events": [
+        # Forgets processed webhook event IDs once redeliveries are no longer expected
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+}
+
+# Indexes replaced by the ones above, dropped at startup
+DROPPED_INDEXES = {
+    # Would allow only one device per day
+    "sensor_averages": ["date_unique"],
+}
+
+def ensure_indexes(db=None):
+    """
+    Create every declared index, reporting the ones that cannot be built
+
+    :param db: Database to bootstrap, defaults to the application database
+    :return: List of (collection, index name, error) for failed indexes
+    """
+    db = db if db is not None else repository.db
+    failures = []
+
+    for collection_name, names in DROPPED_INDEXES.items():
+        existing = db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                db[collection_name].drop_index(name)
+                print(f"Dropped index {name} on {collection_name}.")
+
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except OperationFailure as e:
+                # e.g. duplicate documents blocking a unique index
+                print(f"Could not create index {options['name']} on {collection_name}: {e}")
+                failures.append((collection_name, options['name'], str(e)))
+    return failures
+
+def query_shapes(day):
+    """
+    Explain commands for every query shape the application runs
+
+    :param day: date used to fill in the date filters
+    :return: Dictionary of shape name to explain-able command
+    """
+    date_string = day.isoformat()
+    return {
+        "emotions.reconcile_counters": {
+            "aggregate": "emotions",
+            "pipeline": counter_pipeline(day),
+            "cursor": {}
+        },
+        "emotion_counters.day": {
+            "find": "emotion_counters",
+            "filter": {"_id": date_string}
+        },
+        "water.today": {
+            "find": "water",
+            "filter": {"date": date_string}
+        },
+        "sensor_averages.today": {
+            "find": "sensor_averages",
+            "filter": aggregate_filter(date_string)
+        },
+        "sensor_averages.device_today": {
+            "find": "sensor_averages",
+            "filter": aggregate_filter(date_string, "plant-01")
+        },
+        "sensor_averages.upsert": {
+            "update": "sensor_averages",
+            "updates": [{
+                "q": aggregate_filter(date_string),
+                "u": build_aggregate_update([{"temperature": 25.0, "timestamp": date_string}]),
+                "upsert": True
+            }]
+        },
+        "sensor_rollups_hour.range": {
+            "find": "sensor_rollups_hour",
+            "filter": {"_id": {"$gte": datetime(day.year, day.month, day.day) - timedelta(days=7)}, "counts.humidity": {"$gt": 0}},
+            "sort": {"_id": 1}
+        },
+        "users.upsert": {
+            "update": "users",
+            "updates": [{
+                "q": user_upsert("U-plan-check")[0],
+                "u": user_upsert("U-plan-check")[1],
+                "upsert": True
+            }]
+        },
+    }
+
+def winning_plan_stages(explain):
+    """
+    Collect the stage names of every winning plan in an explain result
+
+    :param explain: Explain output (nested dicts and lists)
+    :return: Set of stage names
+    """
+    stages = set()
+
+    def walk(node, in_winning_plan):
+        if isinstance(node, dict):
+            if in_winning_plan and "stage" in node:
+                stages.add(node["stage"])
+            for key, value in node.items():
+                walk(value, in_winning_plan or key in ("winningPlan", "queryPlan"))
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_winning_plan)
+
+    walk(explain, False)
+    return stages
+
+def seed_plan_check_data(db, day):
+    """
+    Insert enough documents that the planner has to choose between plans
+
+    :param db: Scratch database
+    :param day: date the documents are spread around
+    """
+    emotions = ["happy", "sad", "neutral", "angry", "fear", "surprise", "disgust"]
+    start = tz.localize(datetime.combine(day - timedelta(days=3), datetime.min.time()))
+    # Legacy ISO strings and uploaded BSON dates side by side
+    db["emotions"].insert_many([
+        {
+            "emotion": emotions[i % len(emotions)],
+            "date_time": (start + timedelta(minutes=7 * i)).isoformat() if i % 2
+            else start + timedelta(minutes=7 * i)
+        }
+        for i in range(2000)
+    ])
+    db["water"].insert_many([
+        {"date": (day - timedelta(days=i)).isoformat(), "water_time": ["08:00"]}
+        for i in range(30)
+    ])
+    db["sensor_averages"].insert_many([
+        {"device_id": device_id, "date": (day - timedelta(days=i)).isoformat(), "count": 1}
+        for i in range(1, 30)
+        for device_id in (None, "plant-01", "plant-02")
+    ])
+    db["users"].insert_many([{"user_id": f"U{i:032d}"} for i in range(500)])
+    db["sensor_rollups_hour"].insert_many([
+        {"_id": datetime(day.year, day.month, day.day) - timedelta(hours=i), "counts": {"humidity": 60}}
+        for i in range(500)
+    ])
+
+def check_query_plans():
+    """
+    Run every query shape against seeded data and report COLLSCAN plans
+
+    :return: Dictionary of shape name to winning plan stages that scan the collection
+    """
+    db = repository.mongo_client[f"{MONGO_DB_NAME}_plan_check"]
+    repository.mongo_client.drop_database(db.name)
+    day = datetime.now(tz).date()
+
+    try:
+        ensure_indexes(db)
+        seed_plan_check_data(db, day)
+
+        failures = {}
+        for name, command in query_shapes(day).items():
+            explain = db.command("explain", command, verbosity="queryPlanner")
+            stages = winning_plan_stages(explain)
+            status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+            print(f"{name}: {status} ({', '.join(sorted(stages))})")
+            if status == "COLLSCAN":
+                failures[name] = sorted(stages)
+        return failures
+    finally:
+        repository.mongo_client.drop_database(db.name)
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        if check_query_plans():
+            print("Query plan check failed: some query shapes fall back to COLLSCAN.")
+            sys.exit(1)
+        print("Query plan check passed.")
+    else:
+        ensure_indexes()
+        print("Indexes are up to date.")
@@ -0,0 +1,297 @@
+import asyncio
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from pytz import timezone, utc
+
+import repository
+from config import SCHEDULER_TIMEZONE, CRON_MISFIRE_GRACE_SECONDS
+from coordination import distributed, claim_window
+
+JOB_RUNS_COLLECTION = "job_runs"
+
+def scheduler_tz():
+    """
+    :return: Time zone cron jobs fire in (the machine's local zone by default)
+    """
+    if SCHEDULER_TIMEZONE:
+        return timezone(SCHEDULER_TIMEZONE)
+    return datetime.now().astimezone().tzinfo
+
+class Job:
+    """
+    A job registered with the runner and its timing stats
+    """
+    def __init__(self, name, func, timeout, interval=None, jitter=0.0,
+                 cron=None, catch_up="skip", window_seconds=None):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.interval = interval
+        self.jitter = jitter
+        self.cron = cron  # (hour, minute)
+        self.catch_up = catch_up
+        self.window_seconds = window_seconds or interval or 3600
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_duration_ms = None
+        self.last_error = None
+        self.next_run = None
+
+    def previous_fire_time(self, now):
+        """
+        :param now: Aware datetime
+        :return: Latest cron fire time at or before now
+        """
+        local = now.astimezone(scheduler_tz())
+        hour, minute = self.cron
+        fire = local.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if fire > local:
+            fire -= timedelta(days=1)
+        return fire
+
+    def next_fire_time(self, now):
+        """
+        :param now: Aware datetime
+        :return: First cron fire time after now
+        """
+        return self.previous_fire_time(now) + timedelta(days=1)
+
+    def status(self):
+        return {
+            "name": self.name,
+            "schedule": f"every {self.interval}s" if self.interval else f"daily at {self.cron[0]:02d}:{self.cron[1]:02d}",
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "last_started": self.last_started.isoformat() if self.last_started else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+            "next_run": self.next_run.isoformat() if self.next_run else None
+        }
+
+class AsyncJobRunner:
+    """
+    Runs periodic jobs on the event loop
+
+    Blocking job functions run in worker threads. A job that is still running
+    when its next firing comes is skipped instead of piling up, and a job
+    exceeding its timeout is reported (its thread is left to finish).
+    """
+    def __init__(self):
+        self.jobs = {}
+        self.tasks = []
+
+    def add_interval_job(self, name, func, seconds, timeout, jitter=0.1):
+        """
+        :param name: Job name
+        :param func: Callable (sync or async) taking no arguments
+        :param seconds: Interval between firings
+        :param timeout: Seconds after which a run counts as timed out
+        :param jitter: Fraction of the interval a firing is delayed into its window at random
+        """
+        self.jobs[name] = Job(name, func, timeout, interval=seconds, jitter=jitter)
+
+    def add_cron_job(self, name, func, hour, minute, timeout, catch_up="run_once"):
+        """
+        :param name: Job name
+        :param func: Callable (sync or async) taking no arguments
+        :param hour: Hour of the daily firing
+        :param minute: Minute of the daily firing
+        :param timeout: Seconds after which a run counts as timed out
+        :param catch_up: "run_once" to run a firing missed while no instance
+            was up (within CRON_MISFIRE_GRACE_SECONDS), "skip" to drop it
+        """
+        self.jobs[name] = Job(name, func, timeout, cron=(hour, minute), catch_up=catch_up, window_seconds=3600)
+
+    async def run_job(self, job, scheduled_at):
+        """
+        Run one firing of a job unless it is still running or claimed elsewhere
+
+        :param job: Job to run
+        :param scheduled_at: Aware datetime the firing was scheduled for
+        """
+        if job.running:
+            job.skipped += 1
+            print(f"Job {job.name} is still running, skipping this firing.")
+            return
+
+        if distributed():
+            try:
+                claimed = await asyncio.to_thread(claim_window, job.name, job.window_seconds, scheduled_at.timestamp())
+            except Exception as e:
+                # Without the claim another instance may run it, skip this firing
+                job.skipped += 1
+                job.last_error = f"could not claim firing: {e}"
+                print(f"Job {job.name} could not claim its {scheduled_at.isoformat()} firing: {e}")
+                return
+            if not claimed:
+                return
+
+        job.running = True
+        job.last_started = datetime.now(utc)
+        started = time.perf_counter()
+
+        if asyncio.iscoroutinefunction(job.func):
+            task = asyncio.ensure_future(job.func())
+        else:
+            task = asyncio.ensure_future(asyncio.to_thread(job.func))
+
+        def finished(done_task):
+            job.running = False
+            job.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            if done_task.cancelled():
+                return
+            error = done_task.exception()
+            if error is not None:
+                job.failures += 1
+                job.last_error = str(error)
+                print(f"Job {job.name} failed: {error}")
+            elif job.cron:
+                asyncio.get_running_loop().run_in_executor(None, record_cron_run, job.name, scheduled_at)
+
+        task.add_done_callback(finished)
+        job.runs += 1
+
+        done, _ = await asyncio.wait({task}, timeout=job.timeout)
+        if not done:
+            # A thread cannot be interrupted; it stays marked as running so
+            # later firings are skipped until it returns
+            job.timeouts += 1
+            job.last_error = f"timed out after {job.timeout}s"
+            print(f"Job {job.name} exceeded its {job.timeout}s timeout.")
+
+    async def run_firing(self, job, scheduled_at):
+        """
+        run_job for the loops: an error ends the firing, never the loop
+        """
+        try:
+            await self.run_job(job, scheduled_at)
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            print(f"Job {job.name} firing at {scheduled_at.isoformat()} failed: {e}")
+
+    async def catch_up(self, job, retry_delay=30.0):
+        """
+        Run the latest firing if no instance ran it, retrying while MongoDB is unreachable
+
+        :param job: Cron job with catch_up="run_once"
+        :param retry_delay: Seconds between attempts to read the last run
+        """
+        missed = job.previous_fire_time(datetime.now(utc))
+        while (datetime.now(utc) - missed).total_seconds() <= CRON_MISFIRE_GRACE_SECONDS:
+            try:
+                last = await asyncio.to_thread(last_cron_run, job.name)
+            except Exception as e:
+                job.last_error = f"could not read last run: {e}"
+                print(f"Job {job.name} could not check for a missed firing, retrying in {retry_delay:.0f}s: {e}")
+                await asyncio.sleep(retry_delay)
+                continue
+            if last is None or last < missed:
+                print(f"Job {job.name} missed its {missed.isoformat()} firing, catching up.")
+                await self.run_firing(job, missed)
+            return
+
+    async def interval_loop(self, job):
+        # Firings follow the fixed grid claim_window uses: one per window, at a
+        # random offset into it so replicas and jobs do not fire in lockstep.
+        # Scheduling from the previous run's end with +/- jitter could fire
+        # twice in one window and then skip the next one entirely.
+        window = math.floor(time.time() / job.interval)
+        await asyncio.sleep(random.uniform(0, job.interval * job.jitter))
+        while True:
+            await self.run_firing(job, datetime.fromtimestamp(window * job.interval, utc))
+            window += 1
+            fire_at = window * job.interval + random.uniform(0, job.interval * job.jitter)
+            if fire_at <= time.time():
+                # The run overran its window, continue with the current one
+                window = math.floor(time.time() / job.interval)
+                fire_at = time.time()
+            job.next_run = datetime.fromtimestamp(fire_at, utc)
+            await asyncio.sleep(max(0.0, fire_at - time.time()))
+
+    async def cron_loop(self, job):
+        fire = job.next_fire_time(datetime.now(utc))
+        job.next_run = fire
+        if job.catch_up == "run_once":
+            # Retries happen in the background, the next firing is already scheduled
+            catch_up = asyncio.create_task(self.catch_up(job))
+
+        try:
+            while True:
+                job.next_run = fire
+                await asyncio.sleep(max(0.0, (fire - datetime.now(utc)).total_seconds()))
+                await self.run_firing(job, fire)
+                # From the previous firing, not from now: a sleep that wakes
+                # slightly early must not schedule the same firing again
+                fire = job.next_fire_time(fire)
+                if fire <= datetime.now(utc):
+                    # The run overran a whole day, continue with the next future firing
+                    fire = job.next_fire_time(datetime.now(utc))
+        finally:
+            if job.catch_up == "run_once":
+                catch_up.cancel()
+
+    def start(self):
+        """
+        Start every job loop on the running event loop
+        """
+        for job in self.jobs.values():
+            loop = self.interval_loop(job) if job.interval else self.cron_loop(job)
+            self.tasks.append(asyncio.create_task(loop, name=f"job-{job.name}"))
+
+    async def stop(self):
+        """
+        Cancel the job loops; runs already in worker threads finish on their own
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    def alive(self):
+        """
+        :return: True once started and while no job loop has ended
+        """
+        return bool(self.tasks) and not any(task.done() for task in self.tasks)
+
+    def status(self):
+        """
+        :return: List of per-job status dictionaries
+        """
+        return [job.status() for job in self.jobs.values()]
+
+def record_cron_run(name, scheduled_at):
+    """
+    Remember the latest firing of a cron job that completed
+
+    :param name: Job name
+    :param scheduled_at: Aware datetime of the firing
+    """
+    try:
+        repository.db[JOB_RUNS_COLLECTION].update_one(
+            {"_id": name},
+            {"$max": {"last_scheduled_for": scheduled_at.astimezone(utc).replace(tzinfo=None)},
+             "$set": {"finished_at": datetime.now(utc)}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Could not record run of job {name}: {e}")
+
+def last_cron_run(name):
+    """
+    :param name: Job name
+    :return: Aware datetime of the latest completed firing or None
+    """
+    document = repository.db[JOB_RUNS_COLLECTION].find_one({"_id": name})
+    if not document or not document.get("last_scheduled_for"):
+        return None
+    return utc.localize(document["last_scheduled_for"])
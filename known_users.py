@@ -0,0 +1,122 @@
+import sys
+import threading
+from datetime import datetime
+from pytz import timezone
+from pymongo.errors import DuplicateKeyError
+
+from config import KNOWN_USERS_MAX_ENTRIES
+from repository import users_collection, async_users_collection
+
+tz = timezone("Asia/Bangkok")
+
+# User IDs known to exist in the users collection. Bounded: once full, new
+# IDs are not remembered and fall through to the idempotent upsert instead.
+known_user_ids = set()
+known_users_lock = threading.Lock()
+id_bytes = 0
+hits = 0
+upserts = 0
+
+def remember(user_id):
+    """
+    Add a user ID to the known set if there is room
+
+    :param user_id: LINE user ID
+    """
+    global id_bytes
+
+    with known_users_lock:
+        if user_id in known_user_ids or len(known_user_ids) >= KNOWN_USERS_MAX_ENTRIES:
+            return
+        known_user_ids.add(user_id)
+        id_bytes += sys.getsizeof(user_id)
+
+def is_known(user_id):
+    """
+    :param user_id: LINE user ID
+    :return: True if the user is already stored (no database call needed)
+    """
+    global hits
+
+    if user_id in known_user_ids:
+        hits += 1
+        return True
+    return False
+
+def warm_known_users():
+    """
+    Load existing user IDs into memory
+
+    The unique index on users.user_id is created by indexes.ensure_indexes.
+    """
+    cursor = users_collection().find({}, {"user_id": 1, "_id": 0}, batch_size=10000)
+    for user in cursor:
+        if len(known_user_ids) >= KNOWN_USERS_MAX_ENTRIES:
+            break
+        if user.get("user_id"):
+            remember(user["user_id"])
+    cursor.close()
+    print(f"Loaded {len(known_user_ids)} known users.")
+
+def user_upsert(user_id):
+    """
+    :param user_id: LINE user ID
+    :return: Filter and update documents inserting the user only if missing
+    """
+    return (
+        {"user_id": user_id},
+        {"$setOnInsert": {"user_id": user_id, "created_at": datetime.now(tz)}}
+    )
+
+def upsert_user(user_id):
+    """
+    Insert the user unless it already exists
+
+    :param user_id: LINE user ID
+    :return: True if the user was inserted
+    """
+    global upserts
+
+    upserts += 1
+    try:
+        result = users_collection().update_one(*user_upsert(user_id), upsert=True)
+        inserted = result.upserted_id is not None
+    except DuplicateKeyError:
+        # A concurrent upsert for the same user won the race
+        inserted = False
+    remember(user_id)
+    return inserted
+
+async def async_upsert_user(user_id):
+    """
+    Insert the user unless it already exists, without blocking the event loop
+
+    :param user_id: LINE user ID
+    :return: True if the user was inserted
+    """
+    global upserts
+
+    upserts += 1
+    try:
+        result = await async_users_collection().update_one(*user_upsert(user_id), upsert=True)
+        inserted = result.upserted_id is not None
+    except DuplicateKeyError:
+        inserted = False
+    remember(user_id)
+    return inserted
+
+def known_users_stats():
+    """
+    :return: Dictionary with the size and approximate memory use of the known set
+    """
+    with known_users_lock:
+        entries = len(known_user_ids)
+        approx_bytes = sys.getsizeof(known_user_ids) + id_bytes
+    return {
+        "entries": entries,
+        "capacity": KNOWN_USERS_MAX_ENTRIES,
+        "saturated": entries >= KNOWN_USERS_MAX_ENTRIES,
+        "approx_bytes": approx_bytes,
+        "hits": hits,
+        "upserts": upserts
+    }
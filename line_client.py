@@ -0,0 +1,30 @@
+from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi, Configuration
+
+from config import ACCESS_TOKEN, LINE_API_HOST
+
+# One LINE client per process, shared by the webhook workers and the outbox
+# workers. Created on first use, on the event loop that uses it.
+api_client = None
+line_bot_api = None
+
+def get_line_bot_api():
+    """
+    :return: The process's AsyncMessagingApi, created on first use
+    """
+    global api_client, line_bot_api
+
+    if line_bot_api is None:
+        api_client = AsyncApiClient(Configuration(access_token=ACCESS_TOKEN, host=LINE_API_HOST))
+        line_bot_api = AsyncMessagingApi(api_client)
+    return line_bot_api
+
+async def close_line_client():
+    """
+    Close the shared client's connections, used on shutdown
+    """
+    global api_client, line_bot_api
+
+    if api_client is not None:
+        await api_client.close()
+    api_client = None
+    line_bot_api = None
@@ -1,85 +1,300 @@
+import asyncio
+import hmac
+import logging
 import os
+import time
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, Header
-from linebot.v3 import WebhookHandler
+from fastapi.responses import PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from linebot.v3 import WebhookParser
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3.messaging import (
-    ApiClient, 
-    MessagingApi, 
-    Configuration, 
-    ReplyMessageRequest, 
-    TextMessage
+
+from config import (
+    CHANNEL_SECRET,
+    EMOTION_RECONCILE_MINUTES,
+    TREND_REFRESH_MINUTES,
+    FLEET_MODE,
+    FLEET_POLL_INTERVAL,
+    SUMMARY_JOB_TIMEOUT,
+    RECONCILE_JOB_TIMEOUT,
+    RETENTION_JOB_TIMEOUT,
+    STARTUP_BOOTSTRAP,
+    READINESS_PING_TIMEOUT,
+    INGEST_API_KEY
 )
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
+from utils import summarize_emotion_and_water
+from sensor_data_sync import buffer_reading, flush_buffered_readings
+from sensor_ingestion import register_consumer, start_ingestion, stop_ingestion
+from webhook_pipeline import enqueue_events, start_workers, stop_workers
+from webhook_dedupe import dedupe_stats
+from outbox import start_outbox_workers, stop_outbox_workers, outbox_stats
+from line_client import close_line_client
+from resilience import resilience_stats
+import repository
+from metrics import render_metrics, instrument_job, start_trace, trace_id_var, http_request_duration, log_event
+from read_model_cache import read_model_cache
+from known_users import warm_known_users, known_users_stats
+from indexes import ensure_indexes
+from sensor_history import ensure_history_collections, record_reading
+from emotion_counters import reconcile_today
+from emotion_ingest import ingest_emotions
+from trend_rollups import refresh_rollups
+from retention import archive_old_data
+from devices import poll_fleet, close_fleet_session
+from alert_rules import evaluate_reading, alert_engine
+from coordination import LeaderElection
+from job_runner import AsyncJobRunner
+
+# Set once the startup bootstrap has created the indexes and warmed the caches
+bootstrapped = asyncio.Event()
+
+async def bootstrap(retry_delay=5.0):
+    """
+    Create indexes and collections and warm the known-user cache, retrying
+    until MongoDB is reachable, then start the scheduled jobs
+
+    :param retry_delay: Seconds between attempts
+    """
+    while True:
+        try:
+            await run_in_threadpool(ensure_indexes)
+            await run_in_threadpool(ensure_history_collections)
+            await run_in_threadpool(warm_known_users)
+            break
+        except Exception as e:
+            log_event("bootstrap_failed", logging.ERROR, error=str(e), retry_in=retry_delay)
+            await asyncio.sleep(retry_delay)
+
+    bootstrapped.set()
+    # Jobs need the database; started here so a replica booting during a
+    # MongoDB outage still runs its daily jobs once the database is back
+    job_runner.start()
 
-from config import ACCESS_TOKEN, CHANNEL_SECRET
-from response_message import reponse_message
-from utils import store_user_id, summarize_emotion_and_water, check_sensor_conditions
-from sensor_data_sync import fetch_sensor_data, calculate_and_update_averages
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    bootstrap_task = asyncio.create_task(bootstrap())
+    if STARTUP_BOOTSTRAP == "blocking":
+        await bootstrap_task
+    await start_workers()
+    await start_outbox_workers()
+    ingestion_leader.start()
+    yield
+    bootstrap_task.cancel()
+    await job_runner.stop()
+    # Joins the election and ingestion threads and flushes the buffer; kept off
+    # the event loop while the webhook and outbox workers drain
+    await asyncio.to_thread(ingestion_leader.stop)
+    await stop_workers()
+    await stop_outbox_workers()
+    await close_line_client()
+    await close_fleet_session()
+    repository.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-configuration = Configuration(access_token=ACCESS_TOKEN)
-handler = WebhookHandler(channel_secret=CHANNEL_SECRET)
+parser = WebhookParser(channel_secret=CHANNEL_SECRET)
+
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Give every request a trace ID and record its latency
+    """
+    trace_id = start_trace(request.headers.get("X-Request-Id"))
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Route templates keep the label set bounded, unknown paths share one series
+    route = request.scope.get("route")
+    http_request_duration.observe(
+        request.method if request.method in HTTP_METHODS else "OTHER",
+        route.path if route is not None else "unmatched",
+        str(response.status_code),
+        value=time.perf_counter() - started
+    )
+    response.headers["X-Trace-Id"] = trace_id
+    return response
 
 @app.post("/callback")
 async def callback(request: Request, x_line_signature: str = Header(None)):
     """
     Webhook callback for LINE messaging API
+
+    Verifies the signature, queues the events for the async workers and
+    acknowledges immediately.
     """
     body = await request.body()
     body_str = body.decode('utf-8')
     try:
-        handler.handle(body_str, x_line_signature)
+        events = parser.parse(body_str, x_line_signature)
     except InvalidSignatureError:
         print("Invalid signature. Please check your channel access token/channel secret.")
         raise HTTPException(status_code=400, detail="Invalid signature.")
 
+    if not enqueue_events(events, trace_id_var.get()):
+        # Backpressure: LINE redelivers events that were not acknowledged
+        raise HTTPException(status_code=503, detail="Webhook queue is full.")
+
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event: MessageEvent):
+@app.post("/ingest/emotions")
+async def ingest_emotion_detections(request: Request, x_api_key: str = Header(None)):
     """
-    Handle incoming LINE messages
+    Bulk upload of emotion detections as a JSON array or NDJSON
+
+    Stores the valid detections with one insert and updates the emotion
+    counters in the same pass.
     """
-    line_bot_api = MessagingApi(ApiClient(configuration))
-    user_id = event.source.user_id 
-    store_user_id(user_id)
+    if not INGEST_API_KEY:
+        raise HTTPException(status_code=503, detail="Ingestion is disabled until INGEST_API_KEY is set.")
+    if not hmac.compare_digest(x_api_key or "", INGEST_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid API key.")
 
-    reply_message = reponse_message(event)
+    body = await request.body()
+    try:
+        result = await run_in_threadpool(ingest_emotions, body, request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if reply_message:
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[reply_message]
-            )
-        )
+    if result["received"] and not result["inserted"]:
+        raise HTTPException(status_code=422, detail=result)
+    return result
 
-# Create scheduler for multiple tasks
-scheduler = BackgroundScheduler()
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe: the process is up and its event loop answers
+    """
+    return {"status": "ok"}
 
-# Existing summary job - every 5 pm
-summary_trigger = CronTrigger(hour=5, minute=00)
-scheduler.add_job(summarize_emotion_and_water, summary_trigger)
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness probe: startup work is done, every job loop is running and MongoDB answers
+    """
+    checks = {
+        "bootstrap": bootstrapped.is_set(),
+        "jobs": job_runner.alive(),
+        "mongodb": await run_in_threadpool(repository.ping, READINESS_PING_TIMEOUT)
+    }
+    ready = all(checks.values())
+    return JSONResponse({"status": "ready" if ready else "not_ready", "checks": checks},
+                        status_code=200 if ready else 503)
 
-# every 30 minute
-conditions_trigger = IntervalTrigger(minutes=30)
-scheduler.add_job(check_sensor_conditions, conditions_trigger)
+@app.get("/metrics")
+async def metrics():
+    """
+    Latency histograms, error counters and in-flight gauges in Prometheus format
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters of the chat command read-model cache
+    """
+    return read_model_cache.stats()
 
-# New sensor data fetch job - every 1 minute
-sensor_trigger = IntervalTrigger(minutes=1)
-def fetch_and_store_sensor_data():
-    sensor_data, current_sensor_id = fetch_sensor_data()
-    if sensor_data and current_sensor_id:
-        calculate_and_update_averages(sensor_data, current_sensor_id)
+@app.get("/webhook/stats")
+async def webhook_stats():
+    """
+    Size of the seen-event cache and number of duplicate deliveries skipped
+    """
+    return dedupe_stats()
+
+@app.get("/outbox/stats")
+async def notification_outbox_stats():
+    """
+    Number of queued, in-flight, delivered and failed notification batches
+    """
+    return await run_in_threadpool(outbox_stats)
+
+@app.get("/resilience/stats")
+async def resilience_status():
+    """
+    Circuit breaker states and the number of replies served from stale data
+    """
+    return resilience_stats()
+
+@app.get("/jobs")
+async def jobs():
+    """
+    Run counts, failures, timeouts and last duration of the scheduled jobs
+    """
+    return job_runner.status()
+
+@app.get("/users/stats")
+async def users_stats():
+    """
+    Size and approximate memory use of the known-user set
+    """
+    return known_users_stats()
+
+def on_ingestion_elected():
+    # Another instance may have changed the alert state while it was leader
+    alert_engine.loaded = False
+    start_ingestion()
+
+def on_ingestion_demoted():
+    stop_ingestion()
+    flush_buffered_readings()
+
+# Only one instance streams sensor readings (always this one in local mode)
+ingestion_leader = LeaderElection("sensor_ingestion", on_ingestion_elected, on_ingestion_demoted)
+
+# Jobs run on the event loop, each firing runs in one instance only
+job_runner = AsyncJobRunner()
+
+# Existing summary job - every 5 pm, a firing missed while the bot was down runs at startup
+job_runner.add_cron_job(
+    "daily_summary",
+    instrument_job("daily_summary", summarize_emotion_and_water),
+    hour=5, minute=0,
+    timeout=SUMMARY_JOB_TIMEOUT,
+    catch_up="run_once"
+)
+
+# Emotion detections are written by the camera process, fold them into today's counters
+job_runner.add_interval_job(
+    "reconcile_emotion_counters",
+    instrument_job("reconcile_emotion_counters", reconcile_today),
+    seconds=EMOTION_RECONCILE_MINUTES * 60,
+    timeout=RECONCILE_JOB_TIMEOUT
+)
+
+# Fold today's sensor, watering and emotion data into the day/week/month rollups
+job_runner.add_interval_job(
+    "refresh_trend_rollups",
+    instrument_job("refresh_trend_rollups", refresh_rollups),
+    seconds=TREND_REFRESH_MINUTES * 60,
+    timeout=RECONCILE_JOB_TIMEOUT
+)
+
+# Nightly: compact data older than RETENTION_DAYS and move the raw records to the Parquet archive
+job_runner.add_cron_job(
+    "archive_old_data",
+    instrument_job("archive_old_data", archive_old_data),
+    hour=3, minute=30,
+    timeout=RETENTION_JOB_TIMEOUT,
+    catch_up="run_once"
+)
 
-scheduler.add_job(fetch_and_store_sensor_data, sensor_trigger)
+# Fleet mode: fetch every registered device concurrently into per-device aggregates
+if FLEET_MODE:
+    job_runner.add_interval_job(
+        "poll_fleet",
+        instrument_job("poll_fleet", poll_fleet),
+        seconds=FLEET_POLL_INTERVAL,
+        timeout=FLEET_POLL_INTERVAL * 2
+    )
 
-scheduler.start()
+# Every new sensor reading feeds the daily aggregates, the history rollups and the alert rules.
+# buffer_reading writes once SENSOR_BATCH_SIZE readings are buffered (immediately by default).
+register_consumer(buffer_reading)
+register_consumer(record_reading)
+register_consumer(evaluate_reading)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pymongo import monitoring
+
+from config import LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+logger = logging.getLogger("plant_bot")
+
+# Trace ID of the webhook (or job) being processed, and per-trace counters
+trace_id_var = contextvars.ContextVar("trace_id", default=None)
+trace_stats_var = contextvars.ContextVar("trace_stats", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+registry = []
+
+def escape_label_value(value):
+    """
+    :param value: Label value
+    :return: Value escaped for the Prometheus text format (backslash, quote, newline)
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metric:
+    """
+    Base class for metrics rendered in the Prometheus text format
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def label_string(self, labels, extra=None):
+        pairs = list(zip(self.labelnames, labels)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{self.label_string(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{self.label_string(labels, {'le': le})} {cumulative}")
+                lines.append(f"{self.name}_sum{self.label_string(labels)} {total}")
+                lines.append(f"{self.name}_count{self.label_string(labels)} {count}")
+        return lines
+
+external_call_duration = Histogram(
+    "external_call_duration_seconds", "Latency of calls to external dependencies",
+    ("dependency", "operation"))
+external_call_errors = Counter(
+    "external_call_errors_total", "Failed calls to external dependencies",
+    ("dependency", "operation"))
+external_calls_in_flight = Gauge(
+    "external_calls_in_flight", "Calls to external dependencies in progress",
+    ("dependency",))
+job_duration = Histogram(
+    "job_duration_seconds", "Duration of scheduled jobs", ("job",),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0))
+job_failures = Counter("job_failures_total", "Scheduled job runs that raised", ("job",))
+jobs_running = Gauge("jobs_running", "Scheduled jobs in progress", ("job",))
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests served by the app",
+    ("method", "path", "status"))
+
+def render_metrics():
+    """
+    :return: Every registered metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Emit a structured (JSON) log line tagged with the current trace ID
+
+    :param event: Short event name
+    :param level: logging level
+    :param fields: Extra fields to include
+    """
+    if not logger.isEnabledFor(level):
+        return
+    record = {"ts": round(time.time(), 3), "event": event, "trace_id": trace_id_var.get(), **fields}
+    logger.log(level, json.dumps(record, default=str, ensure_ascii=False))
+
+def start_trace(trace_id=None):
+    """
+    Start a trace in the current context
+
+    :param trace_id: Existing trace ID to continue, or None for a new one
+    :return: The trace ID
+    """
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    trace_id_var.set(trace_id)
+    trace_stats_var.set({"mongo_commands": 0, "mongo_seconds": 0.0})
+    return trace_id
+
+@contextmanager
+def track(dependency, operation):
+    """
+    Time a call to an external dependency (usable around sync and async code)
+
+    :param dependency: e.g. "line", "firebase"
+    :param operation: e.g. "reply_message"
+    """
+    external_calls_in_flight.inc(dependency)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        external_call_errors.inc(dependency, operation)
+        log_event("external_call_failed", logging.WARNING,
+                  dependency=dependency, operation=operation, error=str(e))
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        external_calls_in_flight.dec(dependency)
+        external_call_duration.observe(dependency, operation, value=elapsed)
+
+def instrument_job(name, job):
+    """
+    Wrap a scheduler job with timing, failure counting and a trace ID
+
+    :param name: Job name used as the metric label
+    :param job: Callable or coroutine function run by the scheduler
+    :return: Wrapped callable
+    """
+    @contextmanager
+    def instrumented():
+        start_trace()
+        jobs_running.inc(name)
+        started = time.perf_counter()
+        log_event("job_started", job=name)
+        try:
+            yield
+        except Exception as e:
+            job_failures.inc(name)
+            log_event("job_failed", logging.ERROR, job=name, error=str(e))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            jobs_running.dec(name)
+            job_duration.observe(name, value=elapsed)
+            log_event("job_finished", job=name, duration_ms=round(elapsed * 1000, 1))
+
+    if asyncio.iscoroutinefunction(job):
+        @functools.wraps(job)
+        async def async_wrapper(*args, **kwargs):
+            with instrumented():
+                return await job(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(job)
+    def wrapper(*args, **kwargs):
+        with instrumented():
+            return job(*args, **kwargs)
+    return wrapper
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Records every MongoDB command as an external call and attributes it to the trace
+    """
+    def started(self, event):
+        external_calls_in_flight.inc("mongodb")
+        stats = trace_stats_var.get()
+        if stats is not None:
+            stats["mongo_commands"] += 1
+
+    def finished(self, event, failed):
+        seconds = event.duration_micros / 1e6
+        external_calls_in_flight.dec("mongodb")
+        external_call_duration.observe("mongodb", event.command_name, value=seconds)
+        stats = trace_stats_var.get()
+        if stats is not None:
+            stats["mongo_seconds"] += seconds
+        if failed:
+            external_call_errors.inc("mongodb", event.command_name)
+        log_event("mongo_command", logging.DEBUG, command=event.command_name,
+                  duration_ms=round(seconds * 1000, 2), failed=failed)
+
+    def succeeded(self, event):
+        self.finished(event, False)
+
+    def failed(self, event):
+        self.finished(event, True)
+
+mongo_command_metrics = MongoCommandMetrics()
@@ -1,38 +1,23 @@
-from linebot.v3.messaging import (
-    TextMessage, 
-    PushMessageRequest, 
-    ApiClient, 
-    MessagingApi, 
-    Configuration
-)
-from config import USERS_COLLECTION, ACCESS_TOKEN, CHANNEL_SECRET
+from repository import users_collection
+from outbox import enqueue_broadcast
 
 def send_line_summary(message):
     """
-    Send summary message to all registered users
-    
+    Queue a summary message for all registered users
+
+    The message is written to the notification outbox as multicast batches
+    and sent by the outbox delivery workers, which retry failed batches.
+
     :param message: Summary message to send
+    :return: Dictionary with the recipients and batches queued, or None on error
     """
     try:
-        configuration = Configuration(access_token=ACCESS_TOKEN)
-        line_bot_api = MessagingApi(ApiClient(configuration))
-        
-        users = USERS_COLLECTION.find()
-        
-        for user in users:
-            user_id = user.get('user_id')
-            if user_id:
-                try:
-                    text_message = TextMessage(text=message)
-                    
-                    line_bot_api.push_message(
-                        push_message_request=PushMessageRequest(
-                            to=user_id,
-                            messages=[text_message]
-                        )
-                    )
-                    print(f"Summary sent to user: {user_id}")
-                except Exception as e:
-                    print(f"Failed to send message to user {user_id}: {e}")
+        users = users_collection().find({}, {"user_id": 1, "_id": 0})
+        user_ids = [user.get('user_id') for user in users]
+
+        stats = enqueue_broadcast(message, user_ids)
+        print(f"Summary queued for {stats['recipients']} users in {stats['batches']} batches.")
+        return stats
     except Exception as e:
-        print(f"Error in sending LINE summary: {e}")
\ No newline at end of file
+        print(f"Error in queueing LINE summary: {e}")
+        return None
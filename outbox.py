@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pytz import utc
+from linebot.v3.messaging import MulticastRequest, TextMessage
+
+import repository
+from config import (
+    BROADCAST_MAX_RETRIES,
+    OUTBOX_WORKERS,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_POLL_INTERVAL
+)
+from broadcast import chunk_recipients, backoff_delay, is_retryable, retry_after_header
+from coordination import INSTANCE_ID
+from metrics import Counter, track, start_trace, log_event
+from resilience import breakers, CircuitOpenError
+from line_client import get_line_bot_api
+
+OUTBOX_COLLECTION = "notification_outbox"
+
+outbox_batches = Counter(
+    "outbox_batches_total", "Outbox multicast batches by final status", ("status",))
+outbox_attempts = Counter(
+    "outbox_attempts_total", "Multicast attempts made by the outbox workers", ("result",))
+
+workers = []
+# Set when a batch is enqueued in this process so idle workers wake at once
+work_available = None
+event_loop = None
+
+def outbox_collection():
+    """
+    :return: Collection of queued multicast batches
+    """
+    return repository.db[OUTBOX_COLLECTION]
+
+def enqueue_broadcast(text, user_ids):
+    """
+    Queue a text message for every recipient, one outbox document per multicast batch
+
+    Only writes to MongoDB; the delivery workers send the batches.
+
+    :param text: Text message to send
+    :param user_ids: Iterable of LINE user IDs
+    :return: Dictionary with the number of recipients and batches queued
+    """
+    batches = chunk_recipients(user_ids)
+    if not batches:
+        return {'recipients': 0, 'batches': 0}
+
+    now = datetime.now(utc)
+    outbox_collection().insert_many([
+        {
+            'text': text,
+            'recipients': recipients,
+            'status': 'pending',
+            'attempts': 0,
+            # Same key on every attempt, so LINE drops duplicate deliveries
+            'retry_key': str(uuid.uuid4()),
+            'available_at': now,
+            'created_at': now
+        }
+        for recipients in batches
+    ], ordered=False)
+
+    if event_loop is not None:
+        event_loop.call_soon_threadsafe(work_available.set)
+    return {'recipients': sum(len(recipients) for recipients in batches), 'batches': len(batches)}
+
+async def claim_batch():
+    """
+    Lease the oldest due batch, including batches whose previous lease expired
+
+    :return: Claimed outbox document or None
+    """
+    now = datetime.now(utc)
+    return await repository.async_db[OUTBOX_COLLECTION].find_one_and_update(
+        {'$or': [
+            {'status': 'pending', 'available_at': {'$lte': now}},
+            # The worker holding it crashed or was stopped mid-send
+            {'status': 'sending', 'lease_expires_at': {'$lt': now}}
+        ]},
+        {
+            '$set': {
+                'status': 'sending',
+                'lease_owner': INSTANCE_ID,
+                'lease_expires_at': now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('available_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def finish_batch(batch, update):
+    """
+    Record the outcome of an attempt if this worker still holds the lease
+
+    :param batch: Claimed outbox document
+    :param update: Fields to set
+    """
+    await repository.async_db[OUTBOX_COLLECTION].update_one(
+        {'_id': batch['_id'], 'lease_owner': INSTANCE_ID, 'attempts': batch['attempts']},
+        {'$set': {**update, 'updated_at': datetime.now(utc)}, '$unset': {'lease_expires_at': ''}}
+    )
+
+async def deliver_batch(batch):
+    """
+    Make one multicast attempt for a claimed batch and record the result
+
+    Retryable failures go back to 'pending' with a backoff delay; the
+    others, and batches out of attempts, are marked 'failed'.
+
+    :param batch: Claimed outbox document
+    """
+    try:
+        with breakers["line"].guard(), track("line", "multicast"):
+            await get_line_bot_api().multicast(
+                MulticastRequest(to=batch['recipients'], messages=[TextMessage(text=batch['text'])]),
+                x_line_retry_key=batch['retry_key']
+            )
+        status = 'delivered'
+    except CircuitOpenError as e:
+        # Not an attempt: wait for the circuit to allow a trial call
+        await finish_batch(batch, {
+            'status': 'pending',
+            'attempts': batch['attempts'] - 1,
+            'available_at': datetime.now(utc) + timedelta(seconds=e.retry_in + 1),
+            'last_error': str(e)
+        })
+        return
+    except Exception as e:
+        http_status = getattr(e, 'status', None)
+        if http_status == 409:
+            # A previous attempt with this retry key was already accepted
+            status = 'delivered'
+        elif is_retryable(e) and batch['attempts'] <= BROADCAST_MAX_RETRIES:
+            outbox_attempts.inc('retry')
+            delay = backoff_delay(batch['attempts'], retry_after_header(e))
+            await finish_batch(batch, {
+                'status': 'pending',
+                'available_at': datetime.now(utc) + timedelta(seconds=delay),
+                'last_error': str(e),
+                'http_status': http_status
+            })
+            return
+        else:
+            outbox_attempts.inc('failed')
+            outbox_batches.inc('failed')
+            log_event("outbox_batch_failed", logging.WARNING, batch=str(batch['_id']),
+                      attempts=batch['attempts'], http_status=http_status, error=str(e))
+            await finish_batch(batch, {
+                'status': 'failed',
+                'finished_at': datetime.now(utc),
+                'last_error': str(e),
+                'http_status': http_status
+            })
+            return
+
+    outbox_attempts.inc('delivered')
+    outbox_batches.inc(status)
+    await finish_batch(batch, {'status': status, 'finished_at': datetime.now(utc)})
+
+async def worker_loop(worker_id):
+    """
+    Claim and deliver batches until cancelled
+
+    :param worker_id: Index of the worker, used in log messages
+    """
+    while True:
+        try:
+            batch = await claim_batch()
+        except Exception as e:
+            log_event("outbox_claim_failed", logging.ERROR, worker=worker_id, error=str(e))
+            batch = None
+
+        if batch is None:
+            work_available.clear()
+            try:
+                await asyncio.wait_for(work_available.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        start_trace()
+        try:
+            await deliver_batch(batch)
+        except Exception as e:
+            # The lease expires and another worker retries the batch
+            log_event("outbox_delivery_failed", logging.ERROR, worker=worker_id, error=str(e))
+
+async def start_outbox_workers(count=OUTBOX_WORKERS):
+    """
+    Create the delivery worker tasks
+
+    :param count: Number of concurrent delivery workers
+    """
+    global work_available, event_loop
+
+    work_available = asyncio.Event()
+    event_loop = asyncio.get_running_loop()
+
+    for worker_id in range(count):
+        workers.append(asyncio.create_task(worker_loop(worker_id)))
+    print(f"Started {count} notification outbox workers.")
+
+async def stop_outbox_workers():
+    """
+    Stop the delivery workers; batches in flight are retried after their lease expires
+    """
+    global event_loop
+
+    event_loop = None
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
+
+def outbox_stats():
+    """
+    :return: Number of outbox batches per status
+    """
+    counts = {'pending': 0, 'sending': 0, 'delivered': 0, 'failed': 0}
+    for result in outbox_collection().aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+        counts[result['_id']] = result['count']
+    return counts
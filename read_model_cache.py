@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pytz import timezone
+
+from config import READ_MODEL_CACHE_TTL, READ_MODEL_CACHE_MAX_ENTRIES
+
+tz = timezone("Asia/Bangkok")
+
+# Chat commands whose cached replies depend on each collection
+INVALIDATED_BY = {
+    "sensor_averages": ("Summary", "Environment"),
+    "water": ("Summary", "Watering"),
+    "emotions": ("Summary", "Emotions"),
+}
+
+class Flight:
+    """
+    A computation in progress that concurrent callers wait on
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class ReadModelCache:
+    """
+    In-process cache of command read models keyed by (command, date)
+
+    Entries expire after a TTL or when a write to a collection they depend
+    on invalidates them. Concurrent misses for the same key are coalesced
+    into a single computation. Past dates are never looked up again, so
+    beyond max_entries expired and then least recently used entries are
+    evicted.
+    """
+    def __init__(self, ttl, max_entries=READ_MODEL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing it on a miss
+
+        :param key: Tuple identifying the read model, e.g. ("Summary", "2024-11-20")
+        :param compute: Callable producing the value
+        :return: Cached or freshly computed value
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self.flights[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+            with self.lock:
+                # Skip storing if an invalidation raced with the computation
+                if self.flights.get(key) is flight:
+                    self.store(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+
+    def store(self, key, value):
+        """
+        Store an entry and enforce max_entries; called with the lock held
+        """
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) <= self.max_entries:
+            return
+        now = time.monotonic()
+        for expired in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            del self.entries[expired]
+            self.evictions += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *commands):
+        """
+        Drop every cached entry for the given commands, whatever the date
+
+        :param commands: Command names such as "Summary"
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in commands]:
+                del self.entries[key]
+            for key in [key for key in self.flights if key[0] in commands]:
+                del self.flights[key]
+            self.invalidations += 1
+
+    def notify_write(self, collection_name):
+        """
+        Invalidate the read models that depend on a collection
+
+        :param collection_name: Name of the collection that was written
+        """
+        commands = INVALIDATED_BY.get(collection_name)
+        if commands:
+            self.invalidate(*commands)
+
+    def stats(self):
+        """
+        :return: Dictionary of cache counters
+        """
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+def today_key(command, *parts):
+    """
+    :param command: Command name
+    :param parts: Further key parts, e.g. the device the reply is about
+    :return: Cache key for the command and the current Bangkok date
+    """
+    return (command, datetime.now(tz).strftime("%Y-%m-%d"), *parts)
+
+read_model_cache = ReadModelCache(READ_MODEL_CACHE_TTL)
@@ -0,0 +1,132 @@
+import threading
+import pymongo
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+
+from config import (
+    MONGODB_URI,
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS
+)
+from metrics import mongo_command_metrics
+
+# One pooled client per process. MongoClient is thread-safe, so the scheduler
+# threads and the FastAPI threadpool all share the same connections.
+client_options = {
+    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+    # Latency histograms and per-trace round trip counts, see metrics.py
+    "event_listeners": [mongo_command_metrics],
+}
+
+# Both clients are created on first use instead of at import time. Creating a
+# client does not block (it connects in the background), so importing the app
+# never waits for MongoDB; /readyz reports whether it is reachable.
+sync_client = None
+async_client = None
+client_lock = threading.Lock()
+
+def get_client() -> MongoClient:
+    """
+    :return: The process's MongoClient, created on first use
+    """
+    global sync_client
+
+    if sync_client is None:
+        with client_lock:
+            if sync_client is None:
+                sync_client = MongoClient(MONGODB_URI, **client_options)
+    return sync_client
+
+def get_async_client() -> AsyncIOMotorClient:
+    """
+    :return: The process's motor client for code running on the event loop, created on first use
+    """
+    global async_client
+
+    if async_client is None:
+        with client_lock:
+            if async_client is None:
+                async_client = AsyncIOMotorClient(MONGODB_URI, **client_options)
+    return async_client
+
+def get_db() -> Database:
+    return get_client()[MONGO_DB_NAME]
+
+def __getattr__(name):
+    # repository.db, repository.async_db and the client names keep working, lazily
+    if name == "mongo_client":
+        return get_client()
+    if name == "db":
+        return get_db()
+    if name == "async_mongo_client":
+        return get_async_client()
+    if name == "async_db":
+        return get_async_client()[MONGO_DB_NAME]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def ping(timeout=1.0):
+    """
+    Check that MongoDB answers, used by the readiness probe
+
+    :param timeout: Seconds to wait for the answer
+    :return: True if the ping succeeded
+    """
+    try:
+        with pymongo.timeout(timeout):
+            get_client().admin.command('ping')
+        return True
+    except PyMongoError as e:
+        print(f"MongoDB ping failed: {e}")
+        return False
+
+def emotions_collection() -> Collection:
+    """
+    :return: Collection of emotion detections
+    """
+    return get_db()["emotions"]
+
+def water_collection() -> Collection:
+    """
+    :return: Collection of daily watering records
+    """
+    return get_db()["water"]
+
+def users_collection() -> Collection:
+    """
+    :return: Collection of registered LINE users
+    """
+    return get_db()["users"]
+
+def sensor_averages_collection() -> Collection:
+    """
+    :return: Collection of daily sensor aggregates
+    """
+    return get_db()["sensor_averages"]
+
+def async_users_collection() -> AsyncIOMotorCollection:
+    """
+    :return: Collection of registered LINE users, motor flavour
+    """
+    return get_async_client()[MONGO_DB_NAME]["users"]
+
+def close():
+    """
+    Close the shared clients, used on shutdown
+    """
+    if sync_client is not None:
+        sync_client.close()
+    if async_client is not None:
+        async_client.close()
@@ -0,0 +1,201 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import pymongo
+from pymongo.errors import PyMongoError
+from pytz import timezone
+
+from config import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+    MONGO_CALL_DEADLINE,
+    LAST_KNOWN_GOOD_MAX_AGE
+)
+from metrics import Gauge, log_event
+
+tz = timezone("Asia/Bangkok")
+
+circuit_state = Gauge(
+    "circuit_state", "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)",
+    ("dependency",))
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit is open
+    """
+    def __init__(self, dependency, retry_in):
+        super().__init__(f"{dependency} circuit is open, retrying in {retry_in:.0f}s")
+        self.dependency = dependency
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while instead of waiting on it
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast with CircuitOpenError. After reset_seconds one trial call is
+    let through (half-open); its outcome closes or reopens the circuit.
+    """
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+        circuit_state.set(name, value=0)
+
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def retry_in(self):
+        """
+        :return: Seconds until the next trial call is allowed
+        """
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        """
+        :return: True if a call may be made now
+        """
+        with self.lock:
+            state = self.state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                circuit_state.set(self.name, value=1)
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                log_event("circuit_closed", dependency=self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+            circuit_state.set(self.name, value=0)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log_event("circuit_opened", dependency=self.name, failures=self.failures)
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+                circuit_state.set(self.name, value=2)
+
+    @contextmanager
+    def guard(self):
+        """
+        Run a call through the breaker (usable around sync and async code)
+
+        :raises CircuitOpenError: If the circuit is open
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        else:
+            self.record_success()
+
+    def stats(self):
+        return {"state": self.state(), "failures": self.failures, "retry_in": round(self.retry_in(), 1)}
+
+breakers = {
+    "firebase": CircuitBreaker("firebase"),
+    "mongodb": CircuitBreaker("mongodb"),
+    "line": CircuitBreaker("line"),
+}
+
+class LastKnownGood:
+    """
+    Latest successfully computed value of each read model, with its age
+    """
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.values = {}
+        self.lock = threading.Lock()
+        self.served_stale = 0
+
+    def store(self, key, value):
+        with self.lock:
+            self.values[key] = (value, time.time())
+
+    def get(self, key):
+        """
+        :param key: Read model key
+        :return: Tuple of (value, aware datetime it was computed) or None
+        """
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None or time.time() - entry[1] > self.max_age:
+                return None
+            self.served_stale += 1
+            return entry[0], datetime.fromtimestamp(entry[1], tz)
+
+last_known_good = LastKnownGood(LAST_KNOWN_GOOD_MAX_AGE)
+
+def guarded_read(compute, deadline=MONGO_CALL_DEADLINE):
+    """
+    Run MongoDB reads through the mongodb breaker with one deadline for all of them
+
+    :param compute: Callable running the reads
+    :param deadline: Seconds allowed for the reads together
+    :return: Result of compute
+    """
+    with breakers["mongodb"].guard(), pymongo.timeout(deadline):
+        return compute()
+
+def read_with_fallback(key, compute):
+    """
+    Compute a read model, falling back to its last known good value when
+    MongoDB is slow, failing or circuit-broken
+
+    :param key: Key of the read model, the same across days (e.g. ("Environment", None))
+    :param compute: Callable producing the value, usually through guarded_read
+    :return: Tuple of (value, None) when fresh or (value, aware datetime) when stale
+    :raises Exception: The original error if there is no fallback value
+    """
+    try:
+        value = compute()
+    except (PyMongoError, CircuitOpenError) as e:
+        fallback = last_known_good.get(key)
+        if fallback is None:
+            raise
+        log_event("served_last_known_good", key=list(key), error=str(e))
+        return fallback
+
+    last_known_good.store(key, value)
+    return value, None
+
+def stale_note(stale_since):
+    """
+    :param stale_since: Aware datetime of the fallback value, or None
+    :return: Line appended to replies answered from stale data
+    """
+    if stale_since is None:
+        return ""
+    return f"\n\n⚠️ Live data is temporarily unavailable, showing data from {stale_since:%d %b %H:%M}."
+
+def resilience_stats():
+    """
+    :return: Breaker states and the number of stale answers served
+    """
+    return {
+        "circuits": {name: breaker.stats() for name, breaker in breakers.items()},
+        "served_stale": last_known_good.served_stale
+    }
@@ -1,69 +1,49 @@
 from linebot.v3.messaging import TextMessage, Emoji
-from utils import count_water_times_today, summarize_emotion_and_water, get_latest_sensor_averages
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from utils import (
+    count_water_times_today,
+    summarize_emotion_and_water,
+    get_latest_sensor_stats,
+    format_percentiles
+)
 from pytz import timezone
-import os
-from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
+from emotion_counters import predominant_emotion
+from read_model_cache import read_model_cache, today_key
+from sensor_history import history_reply
+from devices import device_for_source
+from trend_rollups import trend_period, trend_reply
+from resilience import guarded_read, read_with_fallback, stale_note, CircuitOpenError
 
-load_dotenv()
 tz = timezone("Asia/Bangkok")
 
+UNAVAILABLE_TEXT = "Sorry, I can't reach your plant's data right now. 🌱 Please try again in a moment."
+
+def read_model(command, compute, *parts):
+    """
+    Serve a read model from the cache, from MongoDB within the call deadline,
+    or from its last known good value while MongoDB is unavailable
+
+    :param command: Command name
+    :param compute: Callable running the MongoDB reads
+    :param parts: Further key parts, e.g. the device
+    :return: Tuple of (value, None) when fresh or (value, aware datetime) when stale
+    """
+    return read_with_fallback(
+        (command, *parts),
+        lambda: read_model_cache.get_or_compute(today_key(command, *parts), lambda: guarded_read(compute))
+    )
+
 def get_today_predominant_emotion():
     """
     Retrieve the predominant emotion for today based on count statistics.
     
     :return: Emotion string or None
     """
-    today = datetime.now(tz).isoformat()
-    todayYMD = today[0:10]
-    tmr = datetime.now(tz) + timedelta(days=1)
-    tmrYMD = tmr.isoformat()[0:10]
-    
     try:
-        MONGODB_URI = os.getenv("MONGODB_URI")
-        mongo_client = MongoClient(MONGODB_URI)
-        
-        try:
-            db = mongo_client["emotion_detection"]
-            emotions_collection = db["emotions"]
-            
-            # Aggregate emotion counts for today
-            emotion_pipeline = [
-                {
-                    "$match": {
-                        "date_time": {
-                            "$gte": todayYMD + "T00:00:00+07:00", 
-                            "$lt": tmrYMD + "T00:00:00+07:00"
-                        }
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": "$emotion",
-                        "count": {"$sum": 1}
-                    }
-                },
-                {
-                    "$sort": {"count": -1}
-                }
-            ]
-            emotion_results = list(emotions_collection.aggregate(emotion_pipeline))
-            
-            if emotion_results:
-                return emotion_results[0]['_id']  # Return the emotion with the highest count
-            
-            return None  # No emotions recorded today
-        
-        except Exception as e:
-            print(f"Error fetching predominant emotion: {e}")
-            return None
-        
-        finally:
-            mongo_client.close()
-    
+        return predominant_emotion()  # None when no emotions were recorded today
+
     except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
+        print(f"Error fetching predominant emotion: {e}")
         return None
 
 def reponse_message(event):
@@ -75,21 +55,61 @@ def reponse_message(event):
     """
     request_message = event.message.text
 
-    if request_message.startswith("Summary"):
-        summary = summarize_emotion_and_water(auto_send=False)
-        return TextMessage(text=summary)
+    # Read models are served from memory, see read_model_cache.py. While MongoDB
+    # is down Summary/Watering/Environment/Trend answer from their last known good value.
 
-    if request_message.startswith("Watering"):
-        result = count_water_times_today()
-        if result:
-            today_date, water_count = result
-            text_response = f"Good job! 🌱 You have watered your plant {water_count} times today. Keep up the great work in taking care of your green friend!"
-        else:
-            text_response = "I'm thirsty! 🌿 Water me before it's too late!"
-        return TextMessage(text=text_response)
+    try:
+        if request_message.startswith("Summary"):
+            # Each chat reads its own device's sensor data (None: the original feed)
+            device_id = device_for_source(event.source)
+            summary, stale_since = read_model(
+                "Summary",
+                lambda: summarize_emotion_and_water(auto_send=False, device_id=device_id),
+                device_id
+            )
+            return TextMessage(text=summary + stale_note(stale_since))
+
+        if request_message.startswith("Watering"):
+            result, stale_since = read_model("Watering", count_water_times_today)
+            if result:
+                today_date, water_count = result
+                text_response = f"Good job! 🌱 You have watered your plant {water_count} times today. Keep up the great work in taking care of your green friend!"
+            else:
+                text_response = "I'm thirsty! 🌿 Water me before it's too late!"
+            return TextMessage(text=text_response + stale_note(stale_since))
+
+        if request_message.startswith("Environment"):
+            device_id = device_for_source(event.source)
+            (temperature, humidity, distributions), stale_since = read_model(
+                "Environment",
+                lambda: get_latest_sensor_stats(device_id),
+                device_id
+            )
+
+            response_text = (
+                f"Here's an update on your room's environment: "
+                f"🌡️ Temperature: {round(temperature)}°C{format_percentiles(distributions, 'temperature', '°C')} | "
+                f"💧 Humidity: {round(humidity)}%{format_percentiles(distributions, 'humidity', '%')}. "
+                "Stay comfortable, and let's keep the plant happy!"
+            )
+            return TextMessage(text=response_text + stale_note(stale_since))
+
+        if request_message.startswith("History"):
+            # Free-form ranges are not cached, there is no last known good to serve
+            return TextMessage(text=guarded_read(lambda: history_reply(request_message)))
+
+        if request_message.startswith("Trend"):
+            # Rollups are refreshed by a job, so the cache TTL bounds staleness
+            period = trend_period(request_message)
+            text_response, stale_since = read_model(f"Trend {period}", lambda: trend_reply(period))
+            return TextMessage(text=text_response + stale_note(stale_since))
+    except (PyMongoError, CircuitOpenError) as e:
+        # No recent data to fall back on, answer within the budget anyway
+        print(f"Could not build reply to {request_message!r}: {e}")
+        return TextMessage(text=UNAVAILABLE_TEXT)
     
     if request_message.startswith("Emotions"):
-        emotion = get_today_predominant_emotion()
+        emotion = read_model_cache.get_or_compute(today_key("Emotions"), get_today_predominant_emotion)
         
         if not emotion:
             return TextMessage(text="No emotion data available today. Let's keep things positive! 🌱")
@@ -112,13 +132,4 @@ def reponse_message(event):
         
         return TextMessage(text=response_text)
 
-    if request_message.startswith("Environment"):
-        temperature, humidity = get_latest_sensor_averages()
-        
-        response_text = (
-            f"Here's an update on your room's environment: 🌡️ Temperature: {round(temperature)}°C | 💧 Humidity: {round(humidity)}%. "
-            "Stay comfortable, and let's keep the plant happy!"
-        )
-        return TextMessage(text=response_text)
-
     return None
\ No newline at end of file
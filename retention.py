@@ -0,0 +1,329 @@
+import json
+import os
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+from itertools import islice
+from pytz import timezone, utc
+
+import repository
+from config import RETENTION_DAYS, ARCHIVE_DIR, ARCHIVE_PART_ROWS
+from emotion_counters import emotion_range_filter, local_time_part, reconcile_counters, counters_collection
+from trend_rollups import ensure_day_rollups, build_day_rollups, save_rollups, rollups_collection, days_between
+from sensor_history import READINGS_COLLECTION, rollup_collection
+from metrics import log_event
+
+tz = timezone("Asia/Bangkok")
+
+MANIFEST_COLLECTION = "archive_manifest"
+
+# Raw collections exported and then removed by the archived_at TTL index
+ARCHIVED_COLLECTIONS = ["emotions", "water"]
+# Sensor rollups dropped once older than the retention window, the day rollups stay
+COMPACTED_RESOLUTIONS = ["minute", "hour"]
+
+def manifest_collection():
+    """
+    :return: Collection recording what was exported, one document per collection and day
+    """
+    return repository.db[MANIFEST_COLLECTION]
+
+def retention_cutoff():
+    """
+    :return: First date kept in the hot collections
+    """
+    return datetime.now(tz).date() - timedelta(days=RETENTION_DAYS)
+
+def archive_directory(collection_name, day):
+    """
+    :param collection_name: Archived collection
+    :param day: Date
+    :return: Directory of the day's Parquet files (hive-style date= partition)
+    """
+    return os.path.join(ARCHIVE_DIR, collection_name, f"date={day.isoformat()}")
+
+def day_bounds(day):
+    """
+    :param day: Date
+    :return: Tuple of naive UTC datetimes bounding the Bangkok day, as stored by pymongo
+    """
+    start = tz.localize(datetime.combine(day, datetime.min.time()))
+    end = tz.localize(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return start.astimezone(utc).replace(tzinfo=None), end.astimezone(utc).replace(tzinfo=None)
+
+def day_filter(collection_name, day):
+    """
+    :param collection_name: Archived collection
+    :param day: Date
+    :return: Filter selecting the day's documents that were not exported yet
+    """
+    if collection_name == READINGS_COLLECTION:
+        # Time-series documents cannot be updated, the manifest tracks them
+        start, end = day_bounds(day)
+        return {"ts": {"$gte": start, "$lt": end}}
+    if collection_name == "emotions":
+        return {"$and": [emotion_range_filter(day), {"archived_at": {"$exists": False}}]}
+    return {"date": day.isoformat(), "archived_at": {"$exists": False}}
+
+def days_to_archive(collection_name, cutoff):
+    """
+    :param collection_name: "emotions" or "water"
+    :param cutoff: First date kept
+    :return: Sorted list of older dates that still have documents to export
+    """
+    if collection_name == "water":
+        days = repository.water_collection().distinct(
+            "date", {"date": {"$lt": cutoff.isoformat()}, "archived_at": {"$exists": False}})
+    else:
+        start, _ = day_bounds(cutoff)
+        days = [result["_id"] for result in repository.emotions_collection().aggregate([
+            {"$match": {
+                "$or": [
+                    {"date_time": {"$lt": cutoff.isoformat() + "T00:00:00+07:00"}},
+                    {"date_time": {"$lt": start}}
+                ],
+                "archived_at": {"$exists": False}
+            }},
+            {"$group": {"_id": local_time_part("%Y-%m-%d", 0, 10)}}
+        ], allowDiskUse=True)]
+    return sorted(date.fromisoformat(day) for day in days if day)
+
+def reading_days_to_archive():
+    """
+    Raw sensor readings expire after SENSOR_HISTORY_RETENTION_DAYS on their own,
+    so they are exported as soon as their day is over
+
+    :return: Sorted list of finished dates not exported yet
+    """
+    oldest = repository.db[READINGS_COLLECTION].find_one({}, {"ts": 1}, sort=[("ts", 1)])
+    if oldest is None:
+        return []
+    first = utc.localize(oldest["ts"]).astimezone(tz).date()
+    yesterday = datetime.now(tz).date() - timedelta(days=1)
+    exported = {
+        document["day"]
+        for document in manifest_collection().find({"collection": READINGS_COLLECTION, "complete": True}, {"day": 1})
+    }
+    return [day for day in days_between(first, yesterday) if day.isoformat() not in exported]
+
+def to_record(document):
+    """
+    Make a document storable in Parquet: string IDs, UTC timestamps and the
+    free-form 'extra' of uploaded detections as a JSON string
+
+    :param document: MongoDB document
+    :return: Flat dictionary
+    """
+    record = dict(document)
+    record["_id"] = str(record["_id"])
+    record.pop("archived_at", None)
+    # Its shape differs from detection to detection, pyarrow cannot infer
+    # one struct type for the column
+    if record.get("extra") is not None:
+        record["extra"] = json.dumps(record["extra"], default=str, sort_keys=True)
+    for key, value in record.items():
+        if isinstance(value, datetime):
+            record[key] = utc.localize(value) if value.tzinfo is None else value.astimezone(utc)
+    # Emotions written by the camera carry an ISO string instead of a BSON date
+    if isinstance(record.get("date_time"), str):
+        record["date_time"] = datetime.fromisoformat(record["date_time"]).astimezone(utc)
+    return record
+
+def write_part(collection_name, day, documents):
+    """
+    Write documents to a new Parquet file of the day
+
+    :param collection_name: Archived collection
+    :param day: Date
+    :param documents: List of documents
+    :return: Path of the file
+    """
+    # Imported here so the web process does not load pandas/pyarrow at startup
+    import pandas as pd
+
+    directory = archive_directory(collection_name, day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+    frame = pd.DataFrame.from_records([to_record(document) for document in documents])
+    # Written under a temporary name so readers never see a partial file
+    frame.to_parquet(path + ".tmp", engine="pyarrow", compression="zstd", index=False)
+    os.replace(path + ".tmp", path)
+    return path
+
+def archive_day(collection_name, day):
+    """
+    Export one day of a collection to Parquet and mark the exported documents
+
+    Marked documents are deleted by the archived_at TTL index after
+    ARCHIVE_DELETE_AFTER_DAYS, which leaves time to check the files.
+
+    :param collection_name: "emotions", "water" or the raw sensor readings collection
+    :param day: Date
+    :return: Number of documents exported
+    """
+    collection = repository.db[collection_name]
+    cursor = collection.find(day_filter(collection_name, day), batch_size=ARCHIVE_PART_ROWS)
+    exported = 0
+    while True:
+        documents = list(islice(cursor, ARCHIVE_PART_ROWS))
+        if not documents:
+            break
+        path = write_part(collection_name, day, documents)
+        if collection_name != READINGS_COLLECTION:
+            collection.update_many(
+                {"_id": {"$in": [document["_id"] for document in documents]}},
+                {"$set": {"archived_at": datetime.now(utc)}}
+            )
+        manifest_collection().update_one(
+            {"_id": f"{collection_name}:{day.isoformat()}"},
+            {
+                "$set": {"collection": collection_name, "day": day.isoformat(), "updated_at": datetime.now(tz)},
+                "$push": {"files": path},
+                "$inc": {"rows": len(documents)}
+            },
+            upsert=True
+        )
+        exported += len(documents)
+
+    # Readings are selected through the manifest, only a fully exported day is skipped
+    manifest_collection().update_one(
+        {"_id": f"{collection_name}:{day.isoformat()}"},
+        {"$set": {"collection": collection_name, "day": day.isoformat(), "complete": True}},
+        upsert=True
+    )
+    return exported
+
+def compact_day(day):
+    """
+    Make sure the day's emotion counters and trend rollup exist before its raw data goes
+
+    :param day: Date
+    """
+    if counters_collection().find_one({"_id": day.isoformat()}, {"_id": 1}) is None:
+        reconcile_counters(day)
+    rollup = ensure_day_rollups([day])[day]
+    if not rollup.get("complete"):
+        save_rollups(build_day_rollups([day]))
+    # Rebuilding it later would count the deleted water records as zero
+    rollups_collection().update_one({"_id": rollup["_id"]}, {"$set": {"archived": True}})
+
+def compact_sensor_rollups(cutoff):
+    """
+    Drop minute and hour sensor rollups older than the cutoff, the day rollups keep the history
+
+    :param cutoff: First date kept
+    :return: Number of rollup documents deleted
+    """
+    start, _ = day_bounds(cutoff)
+    return sum(
+        rollup_collection(resolution).delete_many({"_id": {"$lt": start}}).deleted_count
+        for resolution in COMPACTED_RESOLUTIONS
+    )
+
+def archive_old_data():
+    """
+    Scheduler job: compact, export and expire everything older than the retention window
+
+    :return: Dictionary with the number of documents exported per collection
+    """
+    cutoff = retention_cutoff()
+    exported = {name: 0 for name in ARCHIVED_COLLECTIONS + [READINGS_COLLECTION]}
+    try:
+        days = sorted({day for name in ARCHIVED_COLLECTIONS for day in days_to_archive(name, cutoff)})
+        for day in days:
+            compact_day(day)
+            for name in ARCHIVED_COLLECTIONS:
+                exported[name] += archive_day(name, day)
+        for day in reading_days_to_archive():
+            exported[READINGS_COLLECTION] += archive_day(READINGS_COLLECTION, day)
+        compacted = compact_sensor_rollups(cutoff)
+        log_event("archive_completed", cutoff=cutoff.isoformat(), days=len(days),
+                  exported=exported, rollups_compacted=compacted)
+    except Exception as e:
+        print(f"Error archiving old data: {e}")
+    return exported
+
+def archived_days(collection_name):
+    """
+    :param collection_name: Archived collection
+    :return: Sorted list of dates with archive files
+    """
+    directory = os.path.join(ARCHIVE_DIR, collection_name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        date.fromisoformat(name[len("date="):]) for name in os.listdir(directory) if name.startswith("date=")
+    )
+
+def read_archive(collection_name, start_day, end_day=None, columns=None):
+    """
+    Read archived documents of a range of days
+
+    :param collection_name: Archived collection
+    :param start_day: First date to read
+    :param end_day: Last date to read (inclusive), defaults to start_day
+    :param columns: Columns to load, all when None
+    :return: pandas DataFrame, timestamps in UTC
+    """
+    import pandas as pd
+
+    if columns is not None and "_id" not in columns:
+        columns = ["_id"] + list(columns)
+    frames = []
+    for day in days_between(start_day, end_day or start_day):
+        directory = archive_directory(collection_name, day)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".parquet"):
+                frames.append(pd.read_parquet(os.path.join(directory, name), engine="pyarrow", columns=columns))
+    if not frames:
+        return pd.DataFrame(columns=columns or ["_id"])
+    # A run interrupted between writing a file and marking its documents exports them twice
+    return pd.concat(frames, ignore_index=True).drop_duplicates("_id")
+
+def archived_emotion_counts(start_day, end_day=None):
+    """
+    :param start_day: First date
+    :param end_day: Last date (inclusive), defaults to start_day
+    :return: Dictionary of date string to {emotion: count} from the archive
+    """
+    frame = read_archive("emotions", start_day, end_day, columns=["emotion", "date_time"])
+    if frame.empty:
+        return {}
+    days = frame["date_time"].dt.tz_convert("Asia/Bangkok").dt.strftime("%Y-%m-%d")
+    counts = {}
+    for (day, emotion), count in frame.groupby([days, frame["emotion"].str.lower()]).size().items():
+        counts.setdefault(day, {})[emotion] = int(count)
+    return counts
+
+def archived_readings(key, start, end):
+    """
+    Raw sensor values of a time range from the archive
+
+    :param key: Sensor key, e.g. "humidity"
+    :param start: Range start (aware datetime)
+    :param end: Range end (aware datetime)
+    :return: pandas Series of values indexed by Bangkok time
+    """
+    import pandas as pd
+
+    frame = read_archive(READINGS_COLLECTION, start.astimezone(tz).date(), end.astimezone(tz).date(),
+                         columns=["ts", key])
+    if frame.empty or key not in frame:
+        return pd.Series(dtype=float)
+    frame = frame[(frame["ts"] >= start) & (frame["ts"] < end)].dropna(subset=[key])
+    return frame.set_index(frame["ts"].dt.tz_convert("Asia/Bangkok"))[key].sort_index()
+
+if __name__ == "__main__":
+    # python retention.py --run
+    # python retention.py --emotions 2024-01-01 2024-01-31
+    if len(sys.argv) >= 2 and sys.argv[1] == "--run":
+        print(archive_old_data())
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--emotions":
+        first = date.fromisoformat(sys.argv[2])
+        last = date.fromisoformat(sys.argv[3]) if len(sys.argv) >= 4 else first
+        for day, counts in sorted(archived_emotion_counts(first, last).items()):
+            print(day, ", ".join(f"{emotion}: {count}" for emotion, count in sorted(counts.items())))
+    else:
+        print("Usage: python retention.py --run | --emotions <first day> [<last day>]")
@@ -1,17 +1,36 @@
 import requests
-import os
-from datetime import datetime, date
-from dotenv import load_dotenv
-from pymongo import MongoClient
-import statistics
+import threading
+from datetime import datetime
 from pytz import timezone
+from pymongo import UpdateOne
+from requests.adapters import HTTPAdapter
+from config import (
+    FIREBASE_DB_URL,
+    SENSOR_DATA_PATH,
+    FIREBASE_CONNECT_TIMEOUT,
+    FIREBASE_READ_TIMEOUT,
+    SENSOR_BATCH_SIZE
+)
+from repository import sensor_averages_collection
+from metrics import track
+from resilience import breakers, CircuitOpenError
+from coordination import claim_reading
+from read_model_cache import read_model_cache
+from sensor_sketches import sketch_increments, distribution
 
-load_dotenv()
+tz = timezone("Asia/Bangkok")
 
-# Global variable to keep track of the last sensor ID
-last_sensor_id = None
+# Keep-alive session reused by every Firebase request
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+http_session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
 
-tz = timezone("Asia/Bangkok")
+def sensor_data_url(path=SENSOR_DATA_PATH):
+    """
+    :param path: Realtime Database path of the sensor feed
+    :return: REST URL of the path
+    """
+    return f"{FIREBASE_DB_URL.rstrip('/')}{path}.json"
 
 def fetch_sensor_data():
     """
@@ -20,127 +39,248 @@ def fetch_sensor_data():
     :return: Tuple of (sensor_data, sensor_id) or (None, None) if fetch fails
     """
     try:
-        url = "https://embedded-project-1f031-default-rtdb.asia-southeast1.firebasedatabase.app/sensorData.json"
-        
-        response = requests.get(url)
-        response.raise_for_status()
+        with breakers["firebase"].guard(), track("firebase", "fetch_sensor_data"):
+            response = http_session.get(
+                sensor_data_url(),
+                timeout=(FIREBASE_CONNECT_TIMEOUT, FIREBASE_READ_TIMEOUT)
+            )
+            response.raise_for_status()
         
         sensor_data = response.json()
+        if not isinstance(sensor_data, dict):
+            return None, None
         sensor_data['timestamp'] = datetime.now(tz).isoformat()
         
         current_sensor_id = sensor_data.get('id')
         
         return sensor_data, current_sensor_id
     
-    except requests.RequestException as e:
+    except (requests.RequestException, ValueError, CircuitOpenError) as e:
         print(f"Error fetching sensor data: {e}")
         return None, None
 
+SENSOR_KEYS = [
+    'temperature', 
+    'humidity', 
+    'airQuality_val', 
+    'lightIntensity_val', 
+    'soilMoisture'
+]
+
+# Readings waiting to be folded into a single write, see buffer_reading()
+reading_buffer = []
+reading_buffer_lock = threading.Lock()
+# Readings kept for a retry while MongoDB is unavailable; the oldest are dropped beyond it
+READING_BUFFER_LIMIT = 5000
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def reading_date(reading):
+    """
+    :param reading: Sensor reading with an ISO 'timestamp' (Bangkok time)
+    :return: Date string YYYY-MM-DD the reading belongs to
+    """
+    timestamp = reading.get('timestamp') or datetime.now(tz).isoformat()
+    return timestamp[0:10]
+
+def aggregate_filter(day, device_id=None):
+    """
+    :param day: Date string YYYY-MM-DD
+    :param device_id: Fleet device ID, None for the original single sensor feed
+    :return: Filter selecting the daily aggregate of a device
+    """
+    # Matches documents written before device_id existed too (missing == null)
+    return {'device_id': device_id, 'date': day}
+
+def build_aggregate_update(readings):
+    """
+    Fold sensor readings into one update document
+
+    Sums and counts are kept exactly with $inc and extremes with $min/$max,
+    so concurrent writers never overwrite each other and nothing is rounded.
+    Sums of squares and histograms (see sensor_sketches.py) are $inc'ed too.
+
+    :param readings: List of sensor reading dictionaries for the same date
+    :return: MongoDB update document
+    """
+    increments = {'count': len(readings)}
+    min_values = {}
+    max_values = {}
+
+    for reading in readings:
+        for key in SENSOR_KEYS:
+            value = reading.get(key)
+            if not is_number(value):
+                continue
+            increments[f'sums.{key}'] = increments.get(f'sums.{key}', 0) + value
+            increments[f'counts.{key}'] = increments.get(f'counts.{key}', 0) + 1
+            min_values[f'min_values.{key}'] = min(min_values.get(f'min_values.{key}', value), value)
+            max_values[f'max_values.{key}'] = max(max_values.get(f'max_values.{key}', value), value)
+
+    increments.update(sketch_increments(readings, SENSOR_KEYS))
+
+    latest = readings[-1]
+    update = {
+        '$inc': increments,
+        '$set': {
+            'id': latest.get('id'),
+            'timestamp': latest.get('timestamp') or datetime.now(tz).isoformat()
+        }
+    }
+    if min_values:
+        update['$min'] = min_values
+        update['$max'] = max_values
+    return update
+
+def derive_averages(record):
+    """
+    Derive per-key averages from a daily aggregate document
+
+    Documents written before running sums were introduced only carry
+    'averages', which are returned unchanged.
+
+    :param record: Document from the sensor_averages collection
+    :return: Dictionary of sensor key to average
+    """
+    if not record:
+        return {}
+
+    sums = record.get('sums')
+    if not sums:
+        return dict(record.get('averages', {}))
+
+    counts = record.get('counts', {})
+    return {
+        key: round(total / counts[key], 2)
+        for key, total in sums.items()
+        if counts.get(key)
+    }
+
+def derive_distributions(record):
+    """
+    Derive per-key percentiles and spread from a daily aggregate document
+
+    :param record: Document from the sensor_averages collection
+    :return: Dictionary of sensor key to {'p50', 'p90', 'std'}
+    """
+    if not record or not record.get('sums'):
+        return {}
+
+    counts = record.get('counts', {})
+    return {
+        key: distribution({
+            'sum': total,
+            'count': counts[key],
+            'min': record.get('min_values', {}).get(key),
+            'max': record.get('max_values', {}).get(key),
+            'sumsq': record.get('sumsq', {}).get(key),
+            'hist': record.get('hist', {}).get(key)
+        })
+        for key, total in record['sums'].items()
+        if counts.get(key)
+    }
+
+def update_averages_batch(readings):
+    """
+    Write buffered readings with one upsert per device and date (a single round trip)
+
+    :param readings: List of sensor reading dictionaries, fleet readings carry 'device_id'
+    :return: Number of readings written
+    """
+    if not readings:
+        return 0
+
+    readings_by_day = {}
+    for reading in readings:
+        key = (reading.get('device_id'), reading_date(reading))
+        readings_by_day.setdefault(key, []).append(reading)
+
+    operations = [
+        UpdateOne(aggregate_filter(day, device_id), build_aggregate_update(day_readings), upsert=True)
+        for (device_id, day), day_readings in readings_by_day.items()
+    ]
+    sensor_averages_collection().bulk_write(operations, ordered=False)
+    read_model_cache.notify_write("sensor_averages")
+    days = sorted({day for _, day in readings_by_day})
+    print(f"Folded {len(readings)} readings into {len(operations)} daily sensor aggregates for {', '.join(days)}")
+    return len(readings)
+
 def calculate_and_update_averages(current_data, current_sensor_id):
     """
-    Calculate averages, min, and max, and update MongoDB
+    Update today's sum, count, min and max with one atomic upsert
 
     :param current_data: Dictionary of current sensor data from Firebase
     :param current_sensor_id: Current sensor ID
     """
-    global last_sensor_id
+    # The cursor is shared by every worker and replica when COORDINATION_MODE=mongo
+    if not claim_reading("sensor_averages", current_sensor_id):
+        print("No new sensor data to process.")
+        return
 
     try:
-        MONGODB_URI = os.getenv("MONGODB_URI")
-        mongo_client = MongoClient(MONGODB_URI)
-
-        try:
-            db = mongo_client["emotion_detection"]
-            sensor_averages_collection = db["sensor_averages"]
-
-            if (current_sensor_id is not None and 
-                current_sensor_id != last_sensor_id):
-
-                now = datetime.now(tz).isoformat()
-                today = now[0:10]
-                today_record = sensor_averages_collection.find_one({
-                    'date': today
-                })
-
-                update_data = {
-                    'date': today,
-                    'id': current_sensor_id,
-                    'count': 1,
-                    'timestamp': datetime.now(tz).isoformat(),
-                    'averages': {},
-                    'min_values': {},
-                    'max_values': {}
-                }
-
-                sensor_keys = [
-                    'temperature', 
-                    'humidity', 
-                    'airQuality_val', 
-                    'lightIntensity_val', 
-                    'soilMoisture'
-                ]
-
-                if today_record:
-                    current_count = today_record.get('count', 1)
-                    update_data['count'] = current_count + 1
-
-                    for key in sensor_keys:
-                        if key in current_data:
-                            # Calculate new average
-                            if key in today_record.get('averages', {}):
-                                new_average = (
-                                    (today_record['averages'][key] * current_count + current_data[key]) / 
-                                    (current_count + 1)
-                                )
-                                update_data['averages'][key] = round(new_average, 2)
-                            else:
-                                update_data['averages'][key] = current_data[key]
-
-                            # Update min
-                            update_data['min_values'][key] = min(
-                                today_record.get('min_values', {}).get(key, float('inf')),
-                                current_data[key]
-                            )
-
-                            # Update max
-                            update_data['max_values'][key] = max(
-                                today_record.get('max_values', {}).get(key, float('-inf')),
-                                current_data[key]
-                            )
-                        else:
-                            update_data['averages'][key] = today_record.get('averages', {}).get(key, 0)
-                            update_data['min_values'][key] = today_record.get('min_values', {}).get(key, 0)
-                            update_data['max_values'][key] = today_record.get('max_values', {}).get(key, 0)
-
-                    sensor_averages_collection.update_one(
-                        {'date': today}, 
-                        {'$set': update_data}
-                    )
-                    print(f"Updated daily sensor averages for {today}")
-                else:
-                    for key in sensor_keys:
-                        update_data['averages'][key] = current_data.get(key, 0)
-                        update_data['min_values'][key] = current_data.get(key, 0)
-                        update_data['max_values'][key] = current_data.get(key, 0)
-
-                    sensor_averages_collection.insert_one(update_data)
-                    print(f"Created new daily sensor averages for {today}")
-
-                print("Updated/New Record:", update_data)
-
-                last_sensor_id = current_sensor_id
-            else:
-                print("No new sensor data to process.")
-
-        except Exception as e:
-            print(f"Error calculating and storing sensor averages: {e}")
-
-        finally:
-            mongo_client.close()
+        today = reading_date(current_data)
+        sensor_averages_collection().update_one(
+            aggregate_filter(today),
+            build_aggregate_update([current_data]),
+            upsert=True
+        )
+        read_model_cache.notify_write("sensor_averages")
+        print(f"Updated daily sensor averages for {today}")
 
     except Exception as e:
-        print(f"Error processing sensor data: {e}")
+        print(f"Error calculating and storing sensor averages: {e}")
 
+def buffer_reading(current_data, current_sensor_id, batch_size=SENSOR_BATCH_SIZE):
+    """
+    Buffer a reading and write the buffer once it holds batch_size readings
+
+    Readings are deduplicated by the ingestion dispatcher before they get here.
+
+    :param current_data: Dictionary of current sensor data from Firebase
+    :param current_sensor_id: Current sensor ID
+    :param batch_size: Number of readings folded into one write
+    """
+    with reading_buffer_lock:
+        reading_buffer.append(current_data)
+        if len(reading_buffer) < batch_size:
+            return
+        readings = reading_buffer[:]
+        reading_buffer.clear()
+
+    write_buffered_readings(readings)
+
+def flush_buffered_readings():
+    """
+    Write whatever is left in the reading buffer
+    """
+    with reading_buffer_lock:
+        readings = reading_buffer[:]
+        reading_buffer.clear()
+
+    write_buffered_readings(readings)
+
+def write_buffered_readings(readings):
+    """
+    Write readings taken from the buffer, putting them back in front of it
+    if the write fails
+
+    The dispatcher has already claimed these readings and will not deliver
+    them again, so they are retried with the next batch or flush.
+
+    :param readings: Readings removed from the buffer
+    """
+    try:
+        update_averages_batch(readings)
+    except Exception as e:
+        with reading_buffer_lock:
+            reading_buffer[:0] = readings
+            dropped = len(reading_buffer) - READING_BUFFER_LIMIT
+            if dropped > 0:
+                del reading_buffer[:dropped]
+        print(f"Error calculating and storing sensor averages, keeping {len(readings)} readings for a retry: {e}")
+        if dropped > 0:
+            print(f"Reading buffer is full, dropped the {dropped} oldest readings.")
 
 def fetch_and_store_sensor_data():
     """
@@ -0,0 +1,262 @@
+from datetime import datetime, timedelta
+from pytz import timezone, utc
+from pymongo import UpdateOne
+from pymongo.errors import CollectionInvalid
+
+import repository
+from config import SENSOR_HISTORY_RETENTION_DAYS, HISTORY_MAX_POINTS
+from sensor_data_sync import SENSOR_KEYS, build_aggregate_update, is_number
+
+tz = timezone("Asia/Bangkok")
+
+READINGS_COLLECTION = "sensor_readings"
+
+# Rollup resolutions from finest to coarsest: (name, bucket size in seconds)
+RESOLUTIONS = [
+    ("minute", 60),
+    ("hour", 3600),
+    ("day", 86400),
+]
+
+# Longest range the History chat command reads
+MAX_HISTORY_DURATION = timedelta(days=366)
+
+# Friendly names accepted by the History chat command
+KEY_ALIASES = {
+    "temperature": "temperature",
+    "temp": "temperature",
+    "humidity": "humidity",
+    "air": "airQuality_val",
+    "airquality": "airQuality_val",
+    "light": "lightIntensity_val",
+    "soil": "soilMoisture",
+    "soilmoisture": "soilMoisture",
+}
+
+def rollup_collection(resolution):
+    """
+    :param resolution: "minute", "hour" or "day"
+    :return: Rollup collection for the resolution
+    """
+    return repository.db[f"sensor_rollups_{resolution}"]
+
+def ensure_history_collections(db=None):
+    """
+    Create the raw readings time-series collection if it does not exist
+
+    :param db: Database to bootstrap, defaults to the application database
+    """
+    db = db if db is not None else repository.db
+    if READINGS_COLLECTION in db.list_collection_names():
+        return
+    try:
+        db.create_collection(
+            READINGS_COLLECTION,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "seconds"},
+            expireAfterSeconds=SENSOR_HISTORY_RETENTION_DAYS * 86400
+        )
+        print(f"Created time-series collection {READINGS_COLLECTION}.")
+    except CollectionInvalid:
+        pass  # created concurrently by another process
+
+def reading_time(reading):
+    """
+    :param reading: Sensor reading with an ISO 'timestamp'
+    :return: Aware UTC datetime of the reading
+    """
+    timestamp = reading.get('timestamp')
+    moment = datetime.fromisoformat(timestamp) if timestamp else datetime.now(tz)
+    if moment.tzinfo is None:
+        moment = tz.localize(moment)
+    return moment.astimezone(utc)
+
+def bucket_start(moment, resolution):
+    """
+    Floor a moment to the start of its rollup bucket
+
+    Day buckets start at Bangkok midnight so they match the daily averages.
+
+    :param moment: Aware datetime
+    :param resolution: "minute", "hour" or "day"
+    :return: Naive UTC datetime (how BSON dates come back from pymongo)
+    """
+    if resolution == "day":
+        local = moment.astimezone(tz)
+        start = tz.localize(datetime(local.year, local.month, local.day))
+    elif resolution == "hour":
+        start = moment.replace(minute=0, second=0, microsecond=0)
+    else:
+        start = moment.replace(second=0, microsecond=0)
+    return start.astimezone(utc).replace(tzinfo=None)
+
+def record_readings(readings):
+    """
+    Store raw readings and fold them into the minute, hour and day rollups
+
+    :param readings: List of sensor reading dictionaries
+    """
+    if not readings:
+        return
+
+    repository.db[READINGS_COLLECTION].insert_many([
+        {
+            "ts": reading_time(reading),
+            "meta": {"sensor_id": reading.get('id')},
+            **{key: reading[key] for key in SENSOR_KEYS if is_number(reading.get(key))}
+        }
+        for reading in readings
+    ], ordered=False)
+
+    for resolution, _ in RESOLUTIONS:
+        buckets = {}
+        for reading in readings:
+            buckets.setdefault(bucket_start(reading_time(reading), resolution), []).append(reading)
+        rollup_collection(resolution).bulk_write([
+            UpdateOne({"_id": start}, build_aggregate_update(bucket_readings), upsert=True)
+            for start, bucket_readings in buckets.items()
+        ], ordered=False)
+
+def record_reading(sensor_data, sensor_id):
+    """
+    Ingestion consumer storing one reading in the history
+
+    :param sensor_data: Dictionary of sensor values
+    :param sensor_id: ID of the reading
+    """
+    try:
+        record_readings([sensor_data])
+    except Exception as e:
+        print(f"Error storing sensor history: {e}")
+
+def choose_resolution(start, end, max_points=HISTORY_MAX_POINTS):
+    """
+    Pick the finest resolution that answers the range with at most max_points buckets
+
+    Ranges too long even for "day" get "day", see downsample.
+
+    :param start: Range start (aware datetime)
+    :param end: Range end (aware datetime)
+    :param max_points: Maximum number of rollup documents to read
+    :return: Tuple of (resolution name, bucket size in seconds)
+    """
+    span = (end - start).total_seconds()
+    for resolution, seconds in RESOLUTIONS:
+        if span / seconds <= max_points:
+            return resolution, seconds
+    return RESOLUTIONS[-1]
+
+def downsample(points, max_points):
+    """
+    Merge consecutive points so at most max_points are left
+
+    :param points: Points as built by query_history, in time order
+    :param max_points: Maximum number of points returned
+    :return: Tuple of (points merged into one, merged points)
+    """
+    group = -(-len(points) // max_points)
+    if group <= 1:
+        return 1, points
+    merged = []
+    for index in range(0, len(points), group):
+        chunk = points[index:index + group]
+        count = sum(point["count"] for point in chunk)
+        merged.append({
+            "time": chunk[0]["time"],
+            "avg": round(sum(point["avg"] * point["count"] for point in chunk) / count, 2),
+            "min": min(point["min"] for point in chunk),
+            "max": max(point["max"] for point in chunk),
+            "count": count
+        })
+    return group, merged
+
+def query_history(key, start, end, max_points=HISTORY_MAX_POINTS):
+    """
+    Read a sensor key over a time range from the rollups
+
+    :param key: Sensor key, e.g. "humidity"
+    :param start: Range start (aware datetime)
+    :param end: Range end (aware datetime)
+    :param max_points: Maximum number of points returned
+    :return: Tuple of (resolution, list of points with time/avg/min/max/count)
+    """
+    resolution, _ = choose_resolution(start, end, max_points)
+    documents = rollup_collection(resolution).find(
+        {
+            "_id": {"$gte": bucket_start(start, resolution), "$lt": end.astimezone(utc).replace(tzinfo=None)},
+            f"counts.{key}": {"$gt": 0}
+        },
+        {"_id": 1, f"sums.{key}": 1, f"counts.{key}": 1, f"min_values.{key}": 1, f"max_values.{key}": 1}
+    ).sort("_id", 1)
+
+    points = []
+    for document in documents:
+        count = document["counts"][key]
+        points.append({
+            "time": utc.localize(document["_id"]).astimezone(tz),
+            "avg": round(document["sums"][key] / count, 2),
+            "min": document["min_values"][key],
+            "max": document["max_values"][key],
+            "count": count
+        })
+
+    # Only "day" can exceed max_points, for ranges longer than max_points days
+    group, points = downsample(points, max_points)
+    if group > 1:
+        resolution = f"{group}-{resolution}"
+    return resolution, points
+
+def parse_duration(text):
+    """
+    :param text: Duration such as "90m", "3h" or "7d"
+    :return: timedelta, at most MAX_HISTORY_DURATION, or None if the text is not a duration
+    """
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if len(text) < 2 or text[-1] not in units or not text[:-1].isdecimal():
+        return None
+    # Clamped before building the timedelta, "99999999d" would overflow it
+    seconds = min(int(text[:-1]) * units[text[-1]], MAX_HISTORY_DURATION.total_seconds())
+    return timedelta(seconds=seconds)
+
+def sparkline(values):
+    """
+    :param values: List of numbers
+    :return: Unicode sparkline of the values
+    """
+    bars = "▁▂▃▄▅▆▇█"
+    low, high = min(values), max(values)
+    if high == low:
+        return bars[0] * len(values)
+    return "".join(bars[int((value - low) / (high - low) * (len(bars) - 1))] for value in values)
+
+def history_reply(request_message):
+    """
+    Build the reply to "History [sensor] [duration]", e.g. "History humidity 3h"
+
+    :param request_message: Text of the chat message
+    :return: Reply text
+    """
+    key, label = "temperature", "3h"
+    for word in request_message.lower().split()[1:]:
+        if word in KEY_ALIASES:
+            key = KEY_ALIASES[word]
+        elif parse_duration(word):
+            label = word
+    duration = parse_duration(label)
+    if duration == MAX_HISTORY_DURATION:
+        label = f"{MAX_HISTORY_DURATION.days}d"
+
+    end = datetime.now(tz)
+    resolution, points = query_history(key, end - duration, end)
+    if not points:
+        return f"No {key} history recorded for that period yet. 🌱"
+
+    total = sum(point["count"] for point in points)
+    average = sum(point["avg"] * point["count"] for point in points) / total
+    # Keep the sparkline readable in a chat bubble
+    step = max(1, len(points) // 24)
+    return (
+        f"📈 {key} over the last {label} ({resolution} buckets):\n"
+        f"{sparkline([point['avg'] for point in points[::step]])}\n"
+        f"avg {round(average, 1)} | min {min(point['min'] for point in points)} | "
+        f"max {max(point['max'] for point in points)}"
+    )
@@ -0,0 +1,195 @@
+import json
+import threading
+import requests
+from datetime import datetime
+from pytz import timezone
+from pymongo.errors import PyMongoError
+
+from config import (
+    FIREBASE_CONNECT_TIMEOUT,
+    FIREBASE_STREAM_READ_TIMEOUT,
+    SENSOR_STREAM_ENABLED,
+    SENSOR_POLL_INTERVAL
+)
+from sensor_data_sync import http_session, sensor_data_url, fetch_sensor_data
+from metrics import track, start_trace, log_event
+from coordination import claim_reading
+from resilience import breakers, CircuitOpenError
+
+tz = timezone("Asia/Bangkok")
+
+# Callables taking (sensor_data, sensor_id), called for every new reading
+consumers = []
+
+ingestion_thread = None
+stop_event = threading.Event()
+stream_response = None
+
+def register_consumer(consumer):
+    """
+    Register a callable that receives every new sensor reading
+
+    :param consumer: Callable taking (sensor_data, sensor_id)
+    """
+    consumers.append(consumer)
+
+def dispatch_reading(sensor_data, sensor_id):
+    """
+    Hand a reading to every consumer, skipping readings already dispatched
+
+    :param sensor_data: Dictionary of sensor values
+    :param sensor_id: ID of the reading
+    :return: True if the reading was new
+    """
+    # Shared cursor, so a reading is dispatched once even if leadership moves
+    if not claim_reading("sensor_ingestion", sensor_id):
+        return False
+
+    # Ties the consumers' queries and pushes to this reading in the logs
+    start_trace()
+    log_event("sensor_reading_dispatched", sensor_id=sensor_id, consumers=len(consumers))
+    for consumer in consumers:
+        try:
+            consumer(dict(sensor_data), sensor_id)
+        except Exception as e:
+            print(f"Sensor consumer {getattr(consumer, '__name__', consumer)} failed: {e}")
+    return True
+
+def apply_stream_event(snapshot, event_type, payload):
+    """
+    Apply a Firebase 'put' or 'patch' event to the local snapshot
+
+    :param snapshot: Current dictionary of sensor values
+    :param event_type: SSE event name
+    :param payload: Decoded SSE data with 'path' and 'data'
+    :return: Updated snapshot
+    """
+    path = [part for part in payload.get('path', '/').split('/') if part]
+    data = payload.get('data')
+
+    if not path:
+        if event_type == 'put':
+            return dict(data) if isinstance(data, dict) else {}
+        return {**snapshot, **(data or {})}
+
+    # Copy the nodes along the path, the previous snapshot was already dispatched
+    snapshot = dict(snapshot)
+    node = snapshot
+    for part in path[:-1]:
+        child = node.get(part)
+        node[part] = dict(child) if isinstance(child, dict) else {}
+        node = node[part]
+    if event_type == 'put':
+        if data is None:
+            node.pop(path[-1], None)
+        else:
+            node[path[-1]] = data
+    else:
+        existing = node.get(path[-1])
+        node[path[-1]] = {**existing, **data} if isinstance(existing, dict) else data
+    return snapshot
+
+def parse_stream_events(lines):
+    """
+    Decode the lines of a server-sent event stream
+
+    :param lines: Iterable of decoded lines, without line endings
+    :return: Generator of (event name, decoded data) tuples
+    :raises ValueError: If an event's data is not valid JSON
+    """
+    event_type = None
+    for line in lines:
+        if line.startswith('event:'):
+            event_type = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            yield event_type, json.loads(line[len('data:'):].strip())
+
+def stream_readings():
+    """
+    Subscribe to the sensor path as a server-sent event stream
+
+    Blocks until the stream closes, dispatching a reading whenever the
+    snapshot changes.
+    """
+    global stream_response
+
+    snapshot = {}
+
+    with breakers["firebase"].guard(), track("firebase", "stream_connect"):
+        response = http_session.get(
+            sensor_data_url(),
+            headers={'Accept': 'text/event-stream'},
+            stream=True,
+            timeout=(FIREBASE_CONNECT_TIMEOUT, FIREBASE_STREAM_READ_TIMEOUT)
+        )
+        response.raise_for_status()
+
+    with response:
+        stream_response = response
+        print("Subscribed to sensor data stream.")
+
+        for event_type, payload in parse_stream_events(response.iter_lines(decode_unicode=True)):
+            if stop_event.is_set():
+                return
+            if event_type in ('cancel', 'auth_revoked'):
+                print(f"Sensor data stream closed by server: {event_type}")
+                return
+            if event_type not in ('put', 'patch'):
+                continue
+
+            snapshot = apply_stream_event(snapshot, event_type, payload)
+
+            sensor_data = dict(snapshot)
+            sensor_data['timestamp'] = datetime.now(tz).isoformat()
+            dispatch_reading(sensor_data, sensor_data.get('id'))
+
+def poll_once():
+    """
+    Fetch the sensor path once and dispatch the reading if it is new
+    """
+    sensor_data, sensor_id = fetch_sensor_data()
+    if sensor_data:
+        dispatch_reading(sensor_data, sensor_id)
+
+def ingestion_loop():
+    """
+    Stream readings, falling back to polling while the stream is unavailable
+    """
+    while not stop_event.is_set():
+        if SENSOR_STREAM_ENABLED:
+            try:
+                stream_readings()
+            except (requests.RequestException, ValueError, CircuitOpenError, PyMongoError) as e:
+                # PyMongoError: the shared cursor could not be claimed in mongo mode
+                if stop_event.is_set():
+                    return
+                print(f"Sensor data stream failed, polling until it reconnects: {e}")
+
+        try:
+            poll_once()
+        except PyMongoError as e:
+            # Keep the thread (and the leadership it holds) alive, retry after the interval
+            print(f"Could not dispatch sensor reading: {e}")
+        stop_event.wait(SENSOR_POLL_INTERVAL)
+
+def start_ingestion():
+    """
+    Start the ingestion thread
+    """
+    global ingestion_thread
+
+    stop_event.clear()
+    ingestion_thread = threading.Thread(target=ingestion_loop, name="sensor-ingestion", daemon=True)
+    ingestion_thread.start()
+
+def stop_ingestion(timeout=5.0):
+    """
+    Stop the ingestion thread, closing any open stream
+
+    :param timeout: Seconds to wait for the thread to finish
+    """
+    stop_event.set()
+    if stream_response is not None:
+        stream_response.close()
+    if ingestion_thread is not None:
+        ingestion_thread.join(timeout)
@@ -0,0 +1,119 @@
+import math
+
+# Histogram buckets grow geometrically, so a percentile read from a bucket is
+# within SKETCH_RELATIVE_ACCURACY of the true value whatever the sensor's unit.
+# Changing it makes existing histograms unreadable.
+SKETCH_RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Values closer to zero than this share the "z" bucket
+MIN_INDEXED_VALUE = 1e-3
+
+def bucket_key(value):
+    """
+    :param value: Sensor value
+    :return: Histogram bucket name: "p<i>" for positive, "n<i>" for negative values, "z" near zero
+    """
+    if abs(value) < MIN_INDEXED_VALUE:
+        return "z"
+    index = math.ceil(math.log(abs(value)) / LOG_GAMMA)
+    return f"p{index}" if value > 0 else f"n{index}"
+
+def bucket_value(bucket):
+    """
+    :param bucket: Histogram bucket name
+    :return: Value representing the bucket (relative error at most SKETCH_RELATIVE_ACCURACY)
+    """
+    if bucket == "z":
+        return 0.0
+    value = 2 * GAMMA ** int(bucket[1:]) / (GAMMA + 1)
+    return value if bucket[0] == "p" else -value
+
+def sketch_increments(readings, keys):
+    """
+    Sum-of-squares and histogram increments of a batch of readings
+
+    Both only ever grow by $inc, so concurrent writers never lose updates
+    and sketches of different days or devices merge by adding them up.
+
+    :param readings: List of dictionaries of numeric sensor values
+    :param keys: Sensor keys to sketch
+    :return: Dictionary of dotted field to increment, for a MongoDB $inc
+    """
+    increments = {}
+    for reading in readings:
+        for key in keys:
+            value = reading.get(key)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            increments[f'sumsq.{key}'] = increments.get(f'sumsq.{key}', 0) + value * value
+            field = f'hist.{key}.{bucket_key(value)}'
+            increments[field] = increments.get(field, 0) + 1
+    return increments
+
+def merge_histograms(histograms):
+    """
+    :param histograms: Iterable of {bucket: count} dictionaries
+    :return: Merged histogram
+    """
+    merged = {}
+    for histogram in histograms:
+        for bucket, count in (histogram or {}).items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    return merged
+
+def percentile(histogram, q, minimum=None, maximum=None):
+    """
+    :param histogram: {bucket: count} dictionary
+    :param q: Quantile between 0 and 1
+    :param minimum: Exact minimum, used to clamp the estimate
+    :param maximum: Exact maximum, used to clamp the estimate
+    :return: Estimated percentile or None for an empty histogram
+    """
+    buckets = sorted((bucket_value(bucket), count) for bucket, count in histogram.items() if count)
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+
+    rank = q * (total - 1)
+    seen = 0
+    for value, count in buckets:
+        seen += count
+        if seen > rank:
+            break
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+def standard_deviation(total, sumsq, count):
+    """
+    :param total: Sum of the values
+    :param sumsq: Sum of the squared values
+    :param count: Number of values
+    :return: Sample standard deviation
+    """
+    if count < 2:
+        return 0.0
+    # Rounding can push a constant series slightly below zero
+    return math.sqrt(max(0.0, (sumsq - total * total / count) / (count - 1)))
+
+def distribution(stats):
+    """
+    Percentiles and spread of one sensor key
+
+    Aggregates written before the sketches existed only cover part of the
+    readings, their percentiles would be biased and are left out.
+
+    :param stats: Dictionary with 'sum', 'count', 'min', 'max' and, when sketched, 'sumsq' and 'hist'
+    :return: Dictionary with 'p50', 'p90' and 'std' (each None when unknown)
+    """
+    histogram = stats.get('hist') or {}
+    complete = sum(histogram.values()) == stats['count']
+    return {
+        'p50': percentile(histogram, 0.5, stats.get('min'), stats.get('max')) if complete else None,
+        'p90': percentile(histogram, 0.9, stats.get('min'), stats.get('max')) if complete else None,
+        'std': standard_deviation(stats['sum'], stats['sumsq'], stats['count'])
+        if stats.get('sumsq') is not None and complete else None
+    }
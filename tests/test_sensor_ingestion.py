@@ -0,0 +1,116 @@
+"""
+Tests of the sensor stream handling, against a local Firebase stand-in
+
+    python -m unittest discover tests
+"""
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+import sensor_ingestion
+from fake_services import FakeFirebase
+from sensor_ingestion import apply_stream_event, parse_stream_events
+
+class ApplyStreamEventTest(unittest.TestCase):
+    def test_put_at_root_replaces_the_snapshot(self):
+        snapshot = apply_stream_event({"id": 1, "humidity": 60}, "put", {"path": "/", "data": {"id": 2}})
+        self.assertEqual(snapshot, {"id": 2})
+
+    def test_put_of_null_at_root_clears_the_snapshot(self):
+        self.assertEqual(apply_stream_event({"id": 1}, "put", {"path": "/", "data": None}), {})
+
+    def test_patch_at_root_merges(self):
+        snapshot = apply_stream_event({"id": 1, "humidity": 60}, "patch", {"path": "/", "data": {"id": 2}})
+        self.assertEqual(snapshot, {"id": 2, "humidity": 60})
+
+    def test_put_at_a_child_path_sets_the_value(self):
+        snapshot = apply_stream_event({"id": 1}, "put", {"path": "/soil/moisture", "data": 40})
+        self.assertEqual(snapshot, {"id": 1, "soil": {"moisture": 40}})
+
+    def test_put_of_null_at_a_child_path_removes_the_key(self):
+        snapshot = apply_stream_event({"id": 1, "humidity": 60}, "put", {"path": "/humidity", "data": None})
+        self.assertEqual(snapshot, {"id": 1})
+
+    def test_patch_at_a_child_path_merges_into_the_child(self):
+        snapshot = apply_stream_event(
+            {"soil": {"moisture": 40, "ph": 6}}, "patch", {"path": "/soil", "data": {"moisture": 35}})
+        self.assertEqual(snapshot, {"soil": {"moisture": 35, "ph": 6}})
+
+    def test_the_previous_snapshot_is_not_modified(self):
+        previous = {"soil": {"moisture": 40}}
+        apply_stream_event(previous, "put", {"path": "/soil/moisture", "data": 35})
+        self.assertEqual(previous, {"soil": {"moisture": 40}})
+
+class ParseStreamEventsTest(unittest.TestCase):
+    def test_events_are_paired_with_their_data(self):
+        lines = [
+            "event: put",
+            'data: {"path": "/", "data": {"id": 1}}',
+            "",
+            "event: keep-alive",
+            "data: null",
+            "",
+            "event: patch",
+            'data: {"path": "/", "data": {"id": 2}}',
+            "",
+        ]
+        self.assertEqual(list(parse_stream_events(lines)), [
+            ("put", {"path": "/", "data": {"id": 1}}),
+            ("keep-alive", None),
+            ("patch", {"path": "/", "data": {"id": 2}}),
+        ])
+
+    def test_comments_and_unknown_fields_are_ignored(self):
+        lines = [": comment", "id: 7", "event: cancel", 'data: "Permission denied"']
+        self.assertEqual(list(parse_stream_events(lines)), [("cancel", "Permission denied")])
+
+    def test_invalid_data_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            list(parse_stream_events(["event: put", "data: {not json"]))
+
+class StreamReadingsTest(unittest.TestCase):
+    def setUp(self):
+        self.firebase = FakeFirebase({"id": 1, "humidity": 60})
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        base_url = asyncio.run_coroutine_threadsafe(self.firebase.start(), self.loop).result(5)
+        self.url = f"{base_url}/sensor.json"
+        sensor_ingestion.stop_event.clear()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.firebase.stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def publish(self, event_type, path="/", data=None):
+        self.loop.call_soon_threadsafe(self.firebase.publish, event_type, path, data)
+
+    def test_every_change_is_dispatched_until_the_server_cancels(self):
+        dispatched = []
+        subscribed = threading.Event()
+
+        def dispatch(sensor_data, sensor_id):
+            dispatched.append((sensor_data, sensor_id))
+            subscribed.set()
+
+        with mock.patch.object(sensor_ingestion, "sensor_data_url", return_value=self.url), \
+                mock.patch.object(sensor_ingestion, "dispatch_reading", side_effect=dispatch):
+            streaming = threading.Thread(target=sensor_ingestion.stream_readings)
+            streaming.start()
+            self.assertTrue(subscribed.wait(5))
+
+            self.publish("patch", data={"id": 2, "humidity": 55})
+            self.publish("keep-alive")
+            self.publish("put", "/temperature", 28)
+            self.publish("cancel", data="Permission denied")
+            streaming.join(5)
+
+        self.assertFalse(streaming.is_alive())
+        self.assertEqual([sensor_id for _, sensor_id in dispatched], [1, 2, 2])
+        last_reading = dispatched[-1][0]
+        self.assertEqual(last_reading["humidity"], 55)
+        self.assertEqual(last_reading["temperature"], 28)
+        self.assertIn("timestamp", last_reading)
+
+if __name__ == "__main__":
+    unittest.main()
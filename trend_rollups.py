@@ -0,0 +1,403 @@
+import sys
+from datetime import date, datetime, timedelta
+import numpy as np
+from pytz import timezone
+from pymongo import ReplaceOne
+
+import repository
+from sensor_history import sparkline
+from sensor_sketches import merge_histograms, distribution
+from emotion_counters import reconcile_counters, COUNTERS_COLLECTION
+
+tz = timezone("Asia/Bangkok")
+
+ROLLUPS_COLLECTION = "trend_rollups"
+
+# Sensors shown in trend replies: (key, label, unit)
+TREND_SENSORS = [
+    ("temperature", "🌡️ Temperature", "°C"),
+    ("humidity", "💧 Humidity", "%"),
+    ("soilMoisture", "🪴 Soil moisture", ""),
+]
+
+def rollups_collection():
+    """
+    :return: Collection of day, week and month rollups
+    """
+    return repository.db[ROLLUPS_COLLECTION]
+
+def week_start(day):
+    """
+    :param day: date
+    :return: Monday of the ISO week containing day
+    """
+    return day - timedelta(days=day.weekday())
+
+def month_start(day):
+    return day.replace(day=1)
+
+def period_end(level, start):
+    """
+    :param level: "day", "week" or "month"
+    :param start: First date of the period
+    :return: Last date of the period (inclusive)
+    """
+    if level == "day":
+        return start
+    if level == "week":
+        return start + timedelta(days=6)
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def rollup_id(level, start):
+    return f"{level}:{start.isoformat()}"
+
+def days_between(start, end):
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+def sensor_stats(record):
+    """
+    Per-key sum, count, min, max and sketches of a sensor_averages document
+
+    :param record: Daily aggregate document or None
+    :return: Dictionary of sensor key to {'sum', 'count', 'min', 'max'}, plus
+        'sumsq' and 'hist' for readings written since the sketches exist
+    """
+    if not record:
+        return {}
+
+    sums = record.get('sums')
+    if not sums:
+        # Documents from before running sums only have the day's average
+        return {
+            key: {'sum': value, 'count': 1, 'min': value, 'max': value}
+            for key, value in record.get('averages', {}).items()
+        }
+
+    counts = record.get('counts', {})
+    min_values = record.get('min_values', {})
+    max_values = record.get('max_values', {})
+    stats = {
+        key: {
+            'sum': total,
+            'count': counts[key],
+            'min': min_values.get(key, total / counts[key]),
+            'max': max_values.get(key, total / counts[key])
+        }
+        for key, total in sums.items()
+        if counts.get(key)
+    }
+    for key, key_stats in stats.items():
+        if key in record.get('sumsq', {}):
+            key_stats['sumsq'] = record['sumsq'][key]
+            key_stats['hist'] = record.get('hist', {}).get(key, {})
+    return stats
+
+def build_day_rollups(days):
+    """
+    Build day rollups from the daily sources with one query per collection
+
+    :param days: List of dates
+    :return: List of day rollup documents
+    """
+    if not days:
+        return []
+    keys = [day.isoformat() for day in days]
+
+    # Trends cover the original sensor feed, fleet devices have device_id set
+    sensors = {
+        doc['date']: doc
+        for doc in repository.sensor_averages_collection().find({'device_id': None, 'date': {'$in': keys}})
+    }
+    water = {doc['date']: doc for doc in repository.water_collection().find({'date': {'$in': keys}})}
+    counters = {doc['_id']: doc for doc in repository.db[COUNTERS_COLLECTION].find({'_id': {'$in': keys}})}
+
+    missing = [day for day in days if day.isoformat() not in counters]
+    if missing:
+        # Days before the counters existed
+        reconcile_counters(min(missing), max(missing))
+        counters = {doc['_id']: doc for doc in repository.db[COUNTERS_COLLECTION].find({'_id': {'$in': keys}})}
+
+    today = datetime.now(tz).date()
+    now = datetime.now(tz)
+    documents = []
+    for day, key in zip(days, keys):
+        water_times = len((water.get(key) or {}).get('water_time', []))
+        emotions = counters.get(key) or {}
+        documents.append({
+            '_id': rollup_id("day", day),
+            'level': "day",
+            'start': key,
+            'end': key,
+            'days': 1,
+            'sensors': sensor_stats(sensors.get(key)),
+            'water': {'times': water_times, 'days_watered': int(water_times > 0)},
+            'emotions': {'total': emotions.get('total', 0), 'counts': emotions.get('counts', {})},
+            # Rebuilt by refresh_rollups until the day is over and, for
+            # yesterday, until its emotion counters are sealed (late detections)
+            'complete': day < today - timedelta(days=1) or (day < today and bool(emotions.get('sealed'))),
+            'built_at': now
+        })
+    return documents
+
+def merge_rollups(documents):
+    """
+    Merge rollups into one with NumPy: sums, counts, sums of squares and
+    histogram buckets add up, extremes combine
+
+    :param documents: List of rollup documents (any level)
+    :return: Dictionary with merged 'days', 'sensors', 'water' and 'emotions'
+    """
+    keys = sorted({key for document in documents for key in document.get('sensors', {})})
+    sensors = {}
+    if keys and documents:
+        # One row per document, one column per sensor key, NaN where missing
+        table = np.full((5, len(documents), len(keys)), np.nan)
+        for row, document in enumerate(documents):
+            for column, key in enumerate(keys):
+                stats = document.get('sensors', {}).get(key)
+                if stats:
+                    table[:, row, column] = (
+                        stats['sum'], stats['count'], stats['min'], stats['max'], stats.get('sumsq', np.nan)
+                    )
+
+        sums = np.nansum(table[0], axis=0)
+        counts = np.nansum(table[1], axis=0)
+        # fmin/fmax skip NaN without warnings
+        minimums = np.fmin.reduce(table[2], axis=0)
+        maximums = np.fmax.reduce(table[3], axis=0)
+        sumsqs = np.nansum(table[4], axis=0)
+        # Sketches only merge when every document with readings has them
+        sketched = np.all(np.isnan(table[1]) | ~np.isnan(table[4]), axis=0)
+        for column, key in enumerate(keys):
+            if counts[column]:
+                sensors[key] = {
+                    'sum': float(sums[column]),
+                    'count': int(counts[column]),
+                    'min': float(minimums[column]),
+                    'max': float(maximums[column])
+                }
+                if sketched[column]:
+                    sensors[key]['sumsq'] = float(sumsqs[column])
+                    sensors[key]['hist'] = merge_histograms(
+                        document['sensors'][key].get('hist') for document in documents
+                        if key in document.get('sensors', {})
+                    )
+
+    water = np.array([
+        (document['water']['times'], document['water']['days_watered']) for document in documents
+    ] or [(0, 0)]).sum(axis=0)
+
+    emotion_counts = {}
+    for document in documents:
+        for emotion, count in document['emotions']['counts'].items():
+            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + count
+
+    return {
+        'days': sum(document['days'] for document in documents),
+        'sensors': sensors,
+        'water': {'times': int(water[0]), 'days_watered': int(water[1])},
+        'emotions': {'total': sum(emotion_counts.values()), 'counts': emotion_counts}
+    }
+
+def build_period_rollup(level, start, day_documents):
+    """
+    :param level: "week" or "month"
+    :param start: First date of the period
+    :param day_documents: Day rollups of the period's days up to today
+    :return: Rollup document for the period
+    """
+    end = period_end(level, start)
+    today = datetime.now(tz).date()
+    return {
+        '_id': rollup_id(level, start),
+        'level': level,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        **merge_rollups(day_documents),
+        'complete': end < today and all(document['complete'] for document in day_documents),
+        'built_at': datetime.now(tz)
+    }
+
+def save_rollups(documents):
+    if documents:
+        rollups_collection().bulk_write([
+            ReplaceOne({'_id': document['_id']}, document, upsert=True) for document in documents
+        ], ordered=False)
+
+def ensure_day_rollups(days, rebuild=False):
+    """
+    Return the day rollups of the given days, building the missing ones
+
+    Rollups of days that were still open when built are kept current by
+    refresh_rollups and returned as they are.
+
+    :param days: List of dates (future dates are ignored)
+    :param rebuild: Rebuild every day instead of only the missing ones, except
+        days whose raw data was archived (see retention.py)
+    :return: Dictionary of date to day rollup document
+    """
+    today = datetime.now(tz).date()
+    days = [day for day in days if day <= today]
+    query = {'_id': {'$in': [rollup_id("day", day) for day in days]}}
+    if rebuild:
+        query['archived'] = True
+    existing = {document['start']: document for document in rollups_collection().find(query)}
+    built = build_day_rollups([day for day in days if day.isoformat() not in existing])
+    save_rollups(built)
+    existing.update({document['start']: document for document in built})
+    return {day: existing[day.isoformat()] for day in days}
+
+def refresh_periods(level, starts, rebuild=False):
+    """
+    Rebuild week or month rollups from their day rollups
+
+    :param level: "week" or "month"
+    :param starts: Iterable of period start dates
+    :param rebuild: Rebuild the underlying day rollups too
+    :return: List of rebuilt period documents
+    """
+    documents = []
+    for start in sorted(set(starts)):
+        day_documents = ensure_day_rollups(days_between(start, period_end(level, start)), rebuild)
+        documents.append(build_period_rollup(level, start, list(day_documents.values())))
+    save_rollups(documents)
+    return documents
+
+def refresh_rollups():
+    """
+    Scheduler job: rebuild incomplete day rollups and the weeks/months above them
+
+    Complete periods never change, so each run only touches today, days
+    that were still open at the previous run and their parent periods.
+    """
+    try:
+        today = datetime.now(tz).date()
+        open_days = {today} | {
+            date.fromisoformat(document['start'])
+            for document in rollups_collection().find({'level': "day", 'complete': False}, {'start': 1})
+        }
+        save_rollups(build_day_rollups(sorted(open_days)))
+        refresh_periods("week", [week_start(day) for day in open_days])
+        refresh_periods("month", [month_start(day) for day in open_days])
+    except Exception as e:
+        print(f"Error refreshing trend rollups: {e}")
+
+def load_rollups(level, starts):
+    """
+    Read rollups by period, building any that do not exist yet
+
+    :param level: "day", "week" or "month"
+    :param starts: List of period start dates
+    :return: List of rollup documents in the order of starts
+    """
+    ids = [rollup_id(level, start) for start in starts]
+    found = {document['_id']: document for document in rollups_collection().find({'_id': {'$in': ids}})}
+    missing = [start for start, rollup in zip(starts, ids) if rollup not in found]
+    if missing:
+        if level == "day":
+            built = list(ensure_day_rollups(missing).values())
+        else:
+            built = refresh_periods(level, missing)
+        found.update({document['_id']: document for document in built})
+    return [found[rollup] for rollup in ids if rollup in found]
+
+def format_trend(title, totals, series, series_label):
+    """
+    :param title: First line of the reply
+    :param totals: Merged rollup of the whole period
+    :param series: Rollups shown as sparkline points, oldest first
+    :param series_label: e.g. "daily", "weekly"
+    :return: Reply text
+    """
+    lines = [title]
+    for key, label, unit in TREND_SENSORS:
+        stats = totals['sensors'].get(key)
+        if not stats:
+            continue
+        points = [
+            document['sensors'][key]['sum'] / document['sensors'][key]['count']
+            for document in series if key in document.get('sensors', {})
+        ]
+        spread = distribution(stats)
+        percentiles = (
+            f" | p50 {round(spread['p50'], 1)} | p90 {round(spread['p90'], 1)}"
+            if spread['p50'] is not None else ""
+        )
+        lines.append(
+            f"{label}: avg {round(stats['sum'] / stats['count'], 1)}{unit}{percentiles} | "
+            f"min {round(stats['min'], 1)} | max {round(stats['max'], 1)}"
+        )
+        if len(points) > 1:
+            lines.append(f"   {sparkline(points)} ({series_label} avg)")
+
+    water = totals['water']
+    lines.append(f"🌿 Watering: {water['times']} times on {water['days_watered']} of {totals['days']} days")
+
+    emotions = totals['emotions']
+    if emotions['total']:
+        top = sorted(emotions['counts'].items(), key=lambda item: item[1], reverse=True)[:3]
+        lines.append("😊 Emotions: " + " | ".join(
+            f"{emotion} {round(count / emotions['total'] * 100)}%" for emotion, count in top
+        ))
+    else:
+        lines.append("😊 Emotions: no detections recorded")
+    return "\n".join(lines)
+
+def week_trend():
+    """
+    :return: Reply for the last 7 days, read from 7 day rollups
+    """
+    today = datetime.now(tz).date()
+    days = load_rollups("day", days_between(today - timedelta(days=6), today))
+    if not days:
+        return "No data recorded in the last 7 days yet. 🌱"
+    title = f"📊 Trend for the last 7 days ({days[0]['start']} – {today.isoformat()})"
+    return format_trend(title, merge_rollups(days), days, "daily")
+
+def month_trend():
+    """
+    :return: Reply for this month, read from the month rollup and its weeks
+    """
+    today = datetime.now(tz).date()
+    start = month_start(today)
+    month = load_rollups("month", [start])
+    weeks = []
+    week = week_start(start)
+    while week <= today:
+        weeks.append(week)
+        week += timedelta(days=7)
+    weeks = load_rollups("week", weeks)
+    if not month or not month[0]['days']:
+        return "No data recorded this month yet. 🌱"
+    title = f"📊 Trend for {today:%B %Y} (so far)"
+    return format_trend(title, month[0], weeks, "weekly")
+
+def trend_period(request_message):
+    """
+    :param request_message: Text of a "Trend week" or "Trend month" message
+    :return: "month" or "week"
+    """
+    return "month" if "month" in request_message.lower().split() else "week"
+
+def trend_reply(period):
+    """
+    Build the reply to "Trend week" or "Trend month"
+
+    :param period: "week" or "month", see trend_period
+    :return: Reply text
+    """
+    if period == "month":
+        return month_trend()
+    return week_trend()
+
+if __name__ == "__main__":
+    # python trend_rollups.py --backfill 2024-06-01
+    if len(sys.argv) >= 3 and sys.argv[1] == "--backfill":
+        first = date.fromisoformat(sys.argv[2])
+        last = datetime.now(tz).date()
+        refresh_periods("week", {week_start(day) for day in days_between(first, last)}, rebuild=True)
+        refresh_periods("month", {month_start(day) for day in days_between(first, last)})
+        print(f"Backfilled trend rollups from {first} to {last}.")
+    else:
+        refresh_rollups()
@@ -1,28 +1,37 @@
-import os
-from pymongo import MongoClient
-from dotenv import load_dotenv
 from notifications import send_line_summary
 from pytz import timezone
-from datetime import datetime, timedelta
-from config import EMOTIONS_COLLECTION, WATER_COLLECTION, USERS_COLLECTION
-from sensor_data_sync import fetch_sensor_data
+from datetime import datetime
+from pymongo.errors import PyMongoError
+from repository import water_collection, sensor_averages_collection
+from emotion_counters import emotion_breakdown
+from known_users import is_known, upsert_user, async_upsert_user
+from sensor_data_sync import derive_averages, derive_distributions, aggregate_filter
 
-load_dotenv()
 tz = timezone("Asia/Bangkok")
 
-last_sensor_id = None
-
 def store_user_id(user_id):
     """
     Store user ID in the database if it doesn't exist
-    
+
+    Repeat senders are answered from the in-memory known-user set.
+
     :param user_id: LINE user ID to store
     """
-    if USERS_COLLECTION.find_one({"user_id": user_id}) is None:
-        USERS_COLLECTION.insert_one({"user_id": user_id})
+    if is_known(user_id):
+        return
+    if upsert_user(user_id):
+        print(f"User ID {user_id} has been added to the database.")
+
+async def async_store_user_id(user_id):
+    """
+    Store user ID in the database if it doesn't exist, without blocking the event loop
+
+    :param user_id: LINE user ID to store
+    """
+    if is_known(user_id):
+        return
+    if await async_upsert_user(user_id):
         print(f"User ID {user_id} has been added to the database.")
-    else:
-        print(f"User ID {user_id} already exists in the database.")
 
 def count_water_times_today():
     """
@@ -31,111 +40,89 @@ def count_water_times_today():
     :return: Tuple of (date, water times count) or None
     """
     today_date = datetime.now().strftime("%Y-%m-%d")
-    record = WATER_COLLECTION.find_one({"date": today_date})
+    record = water_collection().find_one({"date": today_date})
     if not record or "water_time" not in record:
         return None
 
     water_times_count = len(record["water_time"])
     return today_date, water_times_count
 
-def get_latest_sensor_averages():
+def get_latest_sensor_stats(device_id=None):
+    """
+    Retrieve today's sensor averages and their distribution from MongoDB
+
+    :param device_id: Fleet device ID, None for the original sensor feed
+    :return: Tuple of (temperature, humidity, dictionary of sensor key to {'p50', 'p90', 'std'})
+    """
+    try:
+        # Get today's date
+        today = datetime.now(tz).strftime("%Y-%m-%d")
+
+        # Fetch today's sensor data
+        sensor_data = sensor_averages_collection().find_one(aggregate_filter(today, device_id))
+
+        averages = derive_averages(sensor_data)
+        if averages:
+            temperature = averages.get('temperature', 22.0)
+            humidity = averages.get('humidity', 60.0)
+            return temperature, humidity, derive_distributions(sensor_data)
+
+        return 22.0, 60.0, {}  # Default values if no data found
+
+    except PyMongoError:
+        # Let callers fall back to the last known good values, see resilience.py
+        raise
+    except Exception as e:
+        print(f"Error fetching sensor averages: {e}")
+        return 22.0, 60.0, {}
+
+def get_latest_sensor_averages(device_id=None):
     """
     Retrieve the latest sensor averages from MongoDB
     
+    :param device_id: Fleet device ID, None for the original sensor feed
     :return: Tuple of (temperature, humidity)
     """
-    try:
-        MONGODB_URI = os.getenv("MONGODB_URI")
-        mongo_client = MongoClient(MONGODB_URI)
-        
-        try:
-            db = mongo_client["emotion_detection"]
-            sensor_averages_collection = db["sensor_averages"]
-            
-            # Get today's date
-            today = datetime.now(tz).strftime("%Y-%m-%d")
-            
-            # Fetch today's sensor data
-            sensor_data = sensor_averages_collection.find_one({"date": today})
-            
-            if sensor_data and 'averages' in sensor_data:
-                temperature = sensor_data['averages'].get('temperature', 22.0)
-                humidity = sensor_data['averages'].get('humidity', 60.0)
-                return temperature, humidity
-            
-            return 22.0, 60.0  # Default values if no data found
-        
-        except Exception as e:
-            print(f"Error fetching sensor averages: {e}")
-            return 22.0, 60.0
-        
-        finally:
-            mongo_client.close()
-    
-    except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
-        return 22.0, 60.0
+    temperature, humidity, _ = get_latest_sensor_stats(device_id)
+    return temperature, humidity
+
+def format_percentiles(distributions, key, unit=""):
+    """
+    :param distributions: Output of derive_distributions
+    :param key: Sensor key
+    :param unit: Unit appended to the values
+    :return: e.g. " (p50 27°C, p90 31°C)", or "" when today's readings have no sketch
+    """
+    spread = distributions.get(key) or {}
+    if spread.get('p50') is None:
+        return ""
+    return f" (p50 {round(spread['p50'])}{unit}, p90 {round(spread['p90'])}{unit})"
 
-def summarize_emotion_and_water(auto_send=True):
+def summarize_emotion_and_water(auto_send=True, device_id=None):
     """
     Generate a comprehensive daily summary of plant care, emotions, and watering
     
     :param auto_send: If True, sends summary to all registered users via LINE
+    :param device_id: Fleet device whose sensor data is reported, None for the original feed
     :return: Summary string
     """
     current_date = datetime.now().strftime("%Y-%m-%d")
     
-    today = datetime.now(tz).isoformat()
-    todayYMD = today[0:10]
-    tmr = datetime.now(tz) + timedelta(days=1)
-    tmrYMD = tmr.isoformat()[0:10]
-    total_emotions = EMOTIONS_COLLECTION.count_documents({
-        "date_time": {
-            "$gte": todayYMD + "T00:00:00+07:00",
-            "$lt": tmrYMD + "T00:00:00+07:00"
-        }
-    })
-    
-    print(total_emotions)
-    print(datetime.strptime(current_date, "%Y-%m-%d"))
+    # O(1) read of the maintained counters, see emotion_counters.py
+    emotion_counts = emotion_breakdown()
     
-    emotion_counts = {}
-    if total_emotions > 0:
-        emotion_pipeline = [
-            {
-                "$match": {
-                    "date_time": {
-                        "$gte": todayYMD + "T00:00:00+07:00", 
-                        "$lt": tmrYMD + "T00:00:00+07:00"
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$emotion",
-                    "count": {"$sum": 1}
-                }
-            }
-        ]
-        emotion_results = list(EMOTIONS_COLLECTION.aggregate(emotion_pipeline))
-        
-        emotion_counts = {
-            result['_id']: {
-                'count': result['count'],
-                'percentage': round((result['count'] / total_emotions) * 100, 1)
-            } for result in emotion_results
-        }
-    
-    water_data = WATER_COLLECTION.find_one({"date": current_date})
+    water_data = water_collection().find_one({"date": current_date})
     water_count = len(water_data["water_time"]) if water_data and "water_time" in water_data else 0
     
-    # Fetch latest temperature and humidity
-    temperature, humidity = get_latest_sensor_averages()
+    # Fetch latest temperature and humidity, with their median and 90th percentile
+    temperature, humidity, distributions = get_latest_sensor_stats(device_id)
     
     summary = f"🌱 Plant Care Update for Today: 🌱\n\n" \
             f"🌿 Watering: You've watered the plant {water_count} times today.\n" \
-            f"🌡️ Temperature: Current temperature is {round(temperature)}°C.\n" \
-            f"💨 Humidity: Current humidity is {round(humidity)}%.\n\n" \
+            f"🌡️ Temperature: Current temperature is {round(temperature)}°C" \
+            f"{format_percentiles(distributions, 'temperature', '°C')}.\n" \
+            f"💨 Humidity: Current humidity is {round(humidity)}%" \
+            f"{format_percentiles(distributions, 'humidity', '%')}.\n\n" \
             f"Emotion Analysis for Today:\n" \
             f"😀 Happy: {emotion_counts.get('happy', {'percentage': 0})['percentage']}%\n" \
             f"😠 Angry: {emotion_counts.get('angry', {'percentage': 0})['percentage']}%\n" \
@@ -154,49 +141,3 @@ def summarize_emotion_and_water(auto_send=True):
         send_line_summary(summary)
     
     return summary
-
-def check_sensor_conditions():
-    """
-    Check real-time sensor conditions and send notifications if thresholds are exceeded
-    """
-    global last_sensor_id
-
-    sensor_data, current_sensor_id = fetch_sensor_data()  # Fetch real-time data
-    
-    if (current_sensor_id is not None and 
-        current_sensor_id != last_sensor_id):
-        
-        if not sensor_data:
-            print("No real-time sensor data found.")
-            return
-
-        notifications = []
-
-        # Temperature check
-        temperature = sensor_data.get('temperature', 0)
-        if temperature < 20:
-            notifications.append(f"⚠️ Too cold! Current temperature is {temperature}°C 🥶")
-        elif temperature > 35:
-            notifications.append(f"⚠️ Too hot! Current temperature is {temperature}°C 🥵")
-
-        # Light intensity check
-        light_intensity = sensor_data.get('lightIntensity_val', 0)
-        if light_intensity < 300:
-            notifications.append(f"⚠️ Low light in the room! Current brightness level is {light_intensity} lux 💡")
-
-        # Air quality check
-        air_quality = sensor_data.get('airQuality_val', 0)
-        if air_quality > 1536:
-            notifications.append(f"⚠️ Poor air quality detected! Current air quality index is {air_quality} 😷")
-
-        # Send notifications if any
-        if notifications:
-            notification_message = "🌿 **Real-Time Environment Alerts:**\n" + "\n".join(notifications)
-            send_line_summary(notification_message)
-            print("Sent real-time environment notifications:", notification_message)
-        
-        # Update the last sensor ID
-        last_sensor_id = current_sensor_id
-        print("No critical real-time sensor conditions detected. 🌟")
-    else:
-        print("No new sensor data to process.")
\ No newline at end of file
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pytz import utc
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import repository
+from config import WEBHOOK_DEDUPE_TTL, WEBHOOK_DEDUPE_MAX_ENTRIES, WEBHOOK_DEDUPE_MONGO, MONGO_CALL_DEADLINE
+from coordination import distributed, INSTANCE_ID
+from resilience import breakers
+
+WEBHOOK_EVENTS_COLLECTION = "webhook_events"
+
+class SeenEvents:
+    """
+    Bounded set of recently seen webhook event IDs with a time-to-live
+
+    Entries are kept in insertion order, so expired and overflowing entries
+    are always at the front.
+    """
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def prune(self, now):
+        while self.entries:
+            event_id, expires_at = next(iter(self.entries.items()))
+            if expires_at > now and len(self.entries) <= self.max_entries:
+                break
+            self.entries.popitem(last=False)
+
+    def add(self, event_id):
+        """
+        :param event_id: Webhook event ID
+        :return: True if the ID was not seen within the TTL
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.prune(now)
+            expires_at = self.entries.get(event_id)
+            if expires_at is not None and expires_at > now:
+                return False
+            self.entries[event_id] = now + self.ttl
+            self.entries.move_to_end(event_id)
+            return True
+
+    def discard(self, event_id):
+        with self.lock:
+            self.entries.pop(event_id, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+seen_events = SeenEvents(WEBHOOK_DEDUPE_TTL, WEBHOOK_DEDUPE_MAX_ENTRIES)
+duplicate_events = 0
+
+def use_mongo():
+    """
+    :return: True if event IDs are also claimed in MongoDB, so a redelivery
+        landing on another worker or replica is recognised
+    """
+    if WEBHOOK_DEDUPE_MONGO == "auto":
+        return distributed()
+    return WEBHOOK_DEDUPE_MONGO == "true"
+
+def event_id_of(event):
+    """
+    :param event: LINE webhook event
+    :return: webhookEventId or None for events without one
+    """
+    return getattr(event, 'webhook_event_id', None)
+
+def is_redelivery(event):
+    """
+    :param event: LINE webhook event
+    :return: True if LINE flagged the event as a redelivery
+    """
+    delivery_context = getattr(event, 'delivery_context', None)
+    return bool(delivery_context and delivery_context.is_redelivery)
+
+def claim_local(event):
+    """
+    Mark an event as seen by this process
+
+    :param event: LINE webhook event
+    :return: False if this process already accepted the event
+    """
+    global duplicate_events
+
+    event_id = event_id_of(event)
+    if event_id is None or seen_events.add(event_id):
+        return True
+    duplicate_events += 1
+    return False
+
+def release_local(event):
+    """
+    Forget an event so a later redelivery is processed, used when a batch is rejected
+
+    :param event: LINE webhook event
+    """
+    event_id = event_id_of(event)
+    if event_id is not None:
+        seen_events.discard(event_id)
+
+async def claim_shared(event):
+    """
+    Claim an event across every process sharing the database
+
+    :param event: LINE webhook event
+    :return: False if another process already handled the event
+    """
+    global duplicate_events
+
+    event_id = event_id_of(event)
+    if event_id is None or not use_mongo() or breakers["mongodb"].state() != "closed":
+        return True
+
+    now = datetime.now(utc)
+    try:
+        await asyncio.wait_for(repository.async_db[WEBHOOK_EVENTS_COLLECTION].insert_one({
+            "_id": event_id,
+            "owner": INSTANCE_ID,
+            "redelivery": is_redelivery(event),
+            "received_at": now,
+            # Removed by the TTL index
+            "expires_at": now + timedelta(seconds=WEBHOOK_DEDUPE_TTL)
+        }), timeout=MONGO_CALL_DEADLINE)
+        return True
+    except DuplicateKeyError:
+        duplicate_events += 1
+        return False
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        # Better to risk a duplicate reply than to drop the message
+        print(f"Could not claim webhook event {event_id}: {e}")
+        return True
+
+def dedupe_stats():
+    """
+    :return: Dictionary with the size of the seen-event cache and duplicates skipped
+    """
+    return {
+        "entries": len(seen_events),
+        "capacity": WEBHOOK_DEDUPE_MAX_ENTRIES,
+        "ttl_seconds": WEBHOOK_DEDUPE_TTL,
+        "mongo": use_mongo(),
+        "duplicates": duplicate_events
+    }
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+import zlib
+from starlette.concurrency import run_in_threadpool
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+
+from config import (
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+    WEBHOOK_BACKPRESSURE_POLICY,
+    MONGO_CALL_DEADLINE,
+    LINE_CALL_DEADLINE,
+    REPLY_LATENCY_BUDGET
+)
+from response_message import reponse_message, UNAVAILABLE_TEXT
+from utils import async_store_user_id
+from metrics import track, start_trace, trace_stats_var, log_event
+from webhook_dedupe import claim_local, release_local, claim_shared, is_redelivery
+from resilience import breakers
+from line_client import get_line_bot_api
+
+# One queue per worker. Events from the same user always land on the same
+# queue, so they are handled in order while different users run concurrently.
+event_queues = []
+workers = []
+
+# Counters exposed for monitoring the backpressure policy
+dropped_events = 0
+rejected_batches = 0
+
+def ordering_key(event):
+    """
+    :param event: LINE webhook event
+    :return: ID whose events must be handled in order (user, else group or room)
+    """
+    source = getattr(event, 'source', None)
+    for attribute in ('user_id', 'group_id', 'room_id'):
+        value = getattr(source, attribute, None)
+        if value:
+            return value
+    return ''
+
+def shard_for(event):
+    """
+    :param event: LINE webhook event
+    :return: Queue the event belongs to
+    """
+    # crc32 rather than hash(), which is salted per process
+    return event_queues[zlib.crc32(ordering_key(event).encode()) % len(event_queues)]
+
+def enqueue_events(events, trace_id=None):
+    """
+    Put webhook events on their bounded queues without waiting
+
+    Events this process has already accepted (LINE redeliveries) are dropped.
+
+    :param events: List of parsed LINE webhook events
+    :param trace_id: Trace ID of the webhook request, carried to the workers
+    :return: True if the batch was accepted, False if it should be rejected
+    """
+    global dropped_events, rejected_batches
+
+    if not event_queues:
+        raise RuntimeError("Webhook workers are not running.")
+
+    events = [event for event in events if claim_local(event)]
+    placements = [(shard_for(event), event) for event in events]
+
+    if WEBHOOK_BACKPRESSURE_POLICY == "reject":
+        # Accept the whole batch or nothing, so LINE can redeliver it as a unit
+        needed = {}
+        for queue, _ in placements:
+            needed[id(queue)] = needed.get(id(queue), 0) + 1
+        if any(queue.maxsize - queue.qsize() < needed[id(queue)] for queue, _ in placements):
+            rejected_batches += 1
+            print(f"Webhook queue full, rejecting batch of {len(events)} events.")
+            for event in events:
+                release_local(event)
+            return False
+        for queue, event in placements:
+            queue.put_nowait((trace_id, event))
+        return True
+
+    for queue, event in placements:
+        while True:
+            try:
+                queue.put_nowait((trace_id, event))
+                break
+            except asyncio.QueueFull:
+                queue.get_nowait()
+                queue.task_done()
+                dropped_events += 1
+                print("Webhook queue full, dropped the oldest queued event.")
+    return True
+
+async def handle_event(event):
+    """
+    Process a single webhook event: store the sender and reply to text messages
+
+    :param event: LINE webhook event
+    """
+    if not isinstance(event, MessageEvent) or not isinstance(event.message, TextMessageContent):
+        return
+
+    if not await claim_shared(event):
+        # Already handled by another worker process or replica
+        log_event("webhook_event_duplicate", event_id=event.webhook_event_id,
+                  redelivery=is_redelivery(event))
+        return
+
+    user_id = event.source.user_id
+    if user_id and breakers["mongodb"].state() == "closed":
+        try:
+            await asyncio.wait_for(async_store_user_id(user_id), timeout=MONGO_CALL_DEADLINE)
+        except Exception as e:
+            # The user is stored on a later message, the reply matters more
+            log_event("store_user_failed", logging.WARNING, error=str(e))
+
+    # reponse_message still runs blocking queries, keep them off the event loop.
+    # The budget leaves time to reply before the reply token expires.
+    try:
+        reply_message = await asyncio.wait_for(
+            run_in_threadpool(reponse_message, event), timeout=REPLY_LATENCY_BUDGET
+        )
+    except asyncio.TimeoutError:
+        log_event("reply_budget_exceeded", logging.WARNING, budget_s=REPLY_LATENCY_BUDGET)
+        reply_message = TextMessage(text=UNAVAILABLE_TEXT)
+
+    if reply_message:
+        with breakers["line"].guard(), track("line", "reply_message"):
+            await asyncio.wait_for(
+                get_line_bot_api().reply_message(
+                    ReplyMessageRequest(
+                        reply_token=event.reply_token,
+                        messages=[reply_message]
+                    )
+                ),
+                timeout=LINE_CALL_DEADLINE
+            )
+
+async def worker_loop(worker_id, event_queue):
+    """
+    Consume events from the worker's queue until cancelled
+
+    :param worker_id: Index of the worker, used in log messages
+    :param event_queue: Queue owned by this worker
+    """
+    while True:
+        trace_id, event = await event_queue.get()
+        start_trace(trace_id)
+        started = time.perf_counter()
+        try:
+            await handle_event(event)
+            log_event(
+                "webhook_event_processed",
+                worker=worker_id,
+                event_type=event.type,
+                redelivery=is_redelivery(event),
+                duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                **trace_stats_var.get()
+            )
+        except Exception as e:
+            log_event("webhook_event_failed", logging.ERROR, worker=worker_id, error=str(e))
+        finally:
+            event_queue.task_done()
+
+async def start_workers():
+    """
+    Create the queues and the worker tasks
+    """
+    # WEBHOOK_QUEUE_SIZE is the total capacity, split across the workers
+    shard_size = max(1, -(-WEBHOOK_QUEUE_SIZE // WEBHOOK_WORKERS))
+    for worker_id in range(WEBHOOK_WORKERS):
+        event_queue = asyncio.Queue(maxsize=shard_size)
+        event_queues.append(event_queue)
+        workers.append(asyncio.create_task(worker_loop(worker_id, event_queue)))
+    print(f"Started {WEBHOOK_WORKERS} webhook workers (queue size {WEBHOOK_QUEUE_SIZE}).")
+
+async def stop_workers(drain_timeout=5.0):
+    """
+    Drain the queue for up to drain_timeout seconds, then stop the workers
+
+    :param drain_timeout: Seconds to wait for queued events to finish
+    """
+    if event_queues:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*[event_queue.join() for event_queue in event_queues]),
+                timeout=drain_timeout
+            )
+        except asyncio.TimeoutError:
+            remaining = sum(event_queue.qsize() for event_queue in event_queues)
+            print(f"Stopping with {remaining} unprocessed webhook events.")
+
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
+    event_queues.clear()